@@ -0,0 +1,117 @@
+"""In-process fake Ollama HTTP server with scripted responses."""
+
+import asyncio
+import json
+import re
+
+from aiohttp import web
+
+_USER_LINE_RE = re.compile(r"^(?:\[[^\]]*\] )?user: (.*)$", re.MULTILINE)
+_TOKEN_RE = re.compile(r"\S+\s*|\s+")
+
+
+def last_user_utterance(prompt: str) -> str:
+    """Return the last user line of the conversation history in the prompt."""
+    matches = _USER_LINE_RE.findall(prompt)
+    return matches[-1].strip() if matches else ""
+
+
+class FakeOllamaServer:
+    """
+    A fake Ollama server for benchmarks and evaluations.
+
+    The responses come from the script, a callable getting the request payload
+    and returning the response text, or the text and its generation time in
+    seconds. The response is delivered token by token (whitespace separated
+    words) with the given delay per token, both in the streaming and the
+    non-streaming mode, so early termination and the number of generated tokens
+    affect the latency like on a real server.
+    """
+    def __init__(self, script, model: str = "fake:latest", token_delay: float = 0.0,
+                 load_delay: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        """
+        Initialize the server.
+
+        :param script: Callable returning the response text for a request payload.
+        :param model: The model name reported by /api/tags and /api/ps.
+        :param token_delay: Delay in seconds per generated token.
+        :param load_delay: Delay in seconds for the first request (model load).
+        :param host: The address to listen on.
+        :param port: The port to listen on, 0 picks a free port.
+        """
+        self.script = script
+        self.model = model
+        self.token_delay = token_delay
+        self.load_delay = load_delay
+        self.host = host
+        self.port = port
+        self.requests = []  # Payloads of the generate requests
+        self.cancelled = 0  # Streams closed by the client before the end
+        self._loaded = False
+        self._runner = None
+
+    @property
+    def generate_calls(self) -> int:
+        """Return the number of generation requests excluding the model loads."""
+        return sum(1 for payload in self.requests if payload.get("prompt"))
+
+    async def start(self) -> None:
+        """Start the server."""
+        app = web.Application()
+        app.router.add_get("/api/tags", self._handle_models)
+        app.router.add_get("/api/ps", self._handle_models)
+        app.router.add_post("/api/generate", self._handle_generate)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # pylint: disable=protected-access
+
+    async def stop(self) -> None:
+        """Stop the server."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle_models(self, _request: web.Request) -> web.Response:
+        models = [{"name": self.model, "model": self.model}] if self._loaded or \
+                 _request.path.endswith("tags") else []
+        return web.json_response({"models": models})
+
+    async def _load(self) -> None:
+        if not self._loaded:
+            await asyncio.sleep(self.load_delay)
+            self._loaded = True
+
+    async def _handle_generate(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.requests.append(payload)
+        await self._load()
+
+        text = self.script(payload) if payload.get("prompt") else ""
+        duration = None
+        if isinstance(text, tuple):
+            # The response with its total generation time, e.g. from a recorded trace
+            text, duration = text
+        tokens = _TOKEN_RE.findall(text)
+        token_delay = self.token_delay if duration is None else duration / max(len(tokens), 1)
+        stats = {"done": True, "load_duration": 0, "prompt_eval_count": len(payload["prompt"]) // 4,
+                 "prompt_eval_duration": 0, "eval_count": len(tokens),
+                 "eval_duration": int(len(tokens) * token_delay * 1e9)}
+
+        if not payload.get("stream", True):
+            await asyncio.sleep(len(tokens) * token_delay)
+            return web.json_response({"model": self.model, "response": text, **stats})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        try:
+            for token in tokens:
+                await asyncio.sleep(token_delay)
+                chunk = {"model": self.model, "response": token, "done": False}
+                await response.write(json.dumps(chunk).encode() + b"\n")
+            await response.write(json.dumps({"model": self.model, "response": "",
+                                             **stats}).encode() + b"\n")
+        except ConnectionResetError:
+            # The client stopped the generation early
+            self.cancelled += 1
+        return response
@@ -0,0 +1,227 @@
+"""
+Deterministic replay of the command traces recorded by the Paavo AI agent.
+
+Loads the traces from the integration's diagnostics download (or a plain list
+of traces) and runs the commands again in their conversations through
+PaavoAIConversationAgent.async_process, with a stub hass and a fake Ollama
+server answering the recorded responses. A prompt is answered with the
+response recorded for the same prompt, or else with the next response recorded
+for the same utterance. By default each command starts at its recorded offset
+from the first one and the responses take their recorded time, so overlapping
+commands and a latency spike seen in production can be reproduced and profiled
+offline. The recorded and the replayed durations and replies are reported as
+JSON.
+
+Run from the repository root (requires homeassistant and aiohttp):
+
+    python -m benchmarks.replay_traces config_entry-paavoai.json
+    python -m benchmarks.replay_traces traces.json --no-timing --output replay.json
+    python -m benchmarks.replay_traces traces.json --sequential
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import tomllib
+from collections import deque
+from pathlib import Path
+
+from custom_components.paavoai.circuit_breaker import CircuitBreaker
+from custom_components.paavoai.conversation import PaavoAIConversationAgent
+from custom_components.paavoai.metrics import LatencyHistogram, PaavoAIMetrics
+from custom_components.paavoai.ollama_client import OllamaClient
+from custom_components.paavoai.prompts import PromptRegistry
+from custom_components.paavoai.scheduler import OllamaScheduler
+
+from .fake_ollama import FakeOllamaServer, last_user_utterance
+from .run_benchmark import DEFAULT_CONFIG, make_input
+from .stub_hass import StubHass
+
+_NOTHINK_SUFFIX = "\n/nothink"
+
+
+def load_traces(path: Path) -> list[dict]:
+    """Load the traces from a diagnostics download or a list of traces."""
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if isinstance(data, dict):
+        # The diagnostics download has the diagnostics under 'data'
+        data = data.get("data", data).get("traces", [])
+    return data
+
+
+class RecordedResponses:
+    """The script of the fake server, answering the recorded responses."""
+    def __init__(self, traces: list[dict], timing: bool):
+        """
+        Index the recorded responses by the prompt and by the utterance.
+
+        :param traces: The recorded traces.
+        :param timing: Delay the responses by their recorded time.
+        """
+        self.timing = timing
+        self._by_prompt = {}     # Prompt -> deque of (response, seconds)
+        self._by_utterance = {}  # Utterance -> deque of (response, seconds)
+        self.matched = 0
+        self.fallbacks = 0
+        self.unknown = 0
+        for trace in traces:
+            for event in trace["events"]:
+                if event["kind"] != "ollama" or event.get("response") is None:
+                    continue
+                answer = (event["response"], event.get("ms", 0) / 1000)
+                self._by_prompt.setdefault(event["prompt"].strip(), deque()).append(answer)
+                self._by_utterance.setdefault(trace["text"], deque()).append(answer)
+
+    @staticmethod
+    def _next(answers: deque):
+        """Return the next answer, the last one is repeated when they run out."""
+        return answers.popleft() if len(answers) > 1 else answers[0]
+
+    def __call__(self, payload: dict):
+        prompt = payload["prompt"]
+        if prompt.endswith(_NOTHINK_SUFFIX):
+            prompt = prompt[:-len(_NOTHINK_SUFFIX)]
+        if prompt.strip() in self._by_prompt:
+            self.matched += 1
+            response, seconds = self._next(self._by_prompt[prompt.strip()])
+        elif last_user_utterance(prompt) in self._by_utterance:
+            # The prompt differs, e.g. after a paavoai.toml change
+            self.fallbacks += 1
+            response, seconds = self._next(self._by_utterance[last_user_utterance(prompt)])
+        else:
+            self.unknown += 1
+            return ""
+        return (response, seconds) if self.timing else response
+
+
+def _reply(trace: dict) -> str | None:
+    """Return the reply of a trace."""
+    replies = [event["text"] for event in trace["events"] if event["kind"] == "reply"]
+    return replies[-1] if replies else None
+
+
+async def replay(args, traces: list[dict]) -> dict:
+    """Replay the traces and return the report."""
+    with open(args.config, "rb") as f:
+        config = tomllib.load(f)
+    # The embeddings are not recorded, and the recorded commands weren't cached
+    config.setdefault("router", {})["enabled"] = False
+    config.setdefault("cache", {})["enabled"] = False
+    conversations = {trace["conversation_id"] for trace in traces}
+    config.setdefault("trace", {}).update(enabled=True,
+                                          max_conversations=max(len(conversations), 1))
+
+    responses = RecordedResponses(traces, timing=not args.no_timing)
+    server = FakeOllamaServer(responses)
+    await server.start()
+    metrics = PaavoAIMetrics(window=max(len(traces), 1))
+    client = OllamaClient("127.0.0.1", server.port, server.model, metrics=metrics)
+    try:
+        await client.warm_up()
+        scheduler = OllamaScheduler(CircuitBreaker(client), parallel=args.parallel,
+                                    metrics=metrics)
+        hass = StubHass(service_delay=args.service_delay)
+        agent = PaavoAIConversationAgent(hass, {}, scheduler, PromptRegistry.from_config(config),
+                                         metrics=metrics)
+
+        traces = sorted(traces, key=lambda trace: trace.get("started_at", 0))
+        first = traces[0].get("started_at", 0) if traces else 0
+        begin = time.perf_counter()
+
+        async def _command(trace: dict) -> float:
+            """Run the command at its recorded offset, return its duration in ms."""
+            if not args.sequential:
+                offset = trace.get("started_at", first) - first
+                await asyncio.sleep(max(offset - (time.perf_counter() - begin), 0))
+            start = time.perf_counter()
+            await agent.async_process(make_input(trace["text"], trace["conversation_id"]))
+            return (time.perf_counter() - start) * 1000
+
+        if args.sequential:
+            durations = [await _command(trace) for trace in traces]
+        else:
+            durations = await asyncio.gather(*(_command(trace) for trace in traces))
+        await hass.async_block_till_done()
+
+        # The replayed traces in the order the commands started
+        replayed_traces = {}
+        for replayed in agent.traces.export():
+            key = (replayed["conversation_id"], replayed["text"])
+            replayed_traces.setdefault(key, deque()).append(replayed)
+
+        recorded_ms = LatencyHistogram(len(traces))
+        replayed_ms = LatencyHistogram(len(traces))
+        commands = []
+        for trace, elapsed in zip(traces, durations):
+            replayed = replayed_traces[(trace["conversation_id"], trace["text"])].popleft()
+            if trace.get("duration_ms") is not None:
+                recorded_ms.observe(trace["duration_ms"])
+            replayed_ms.observe(elapsed)
+            commands.append({
+                "text": trace["text"],
+                "conversation_id": trace["conversation_id"],
+                "recorded_ms": trace.get("duration_ms"),
+                "replayed_ms": round(elapsed, 1),
+                "recorded_reply": _reply(trace),
+                "replayed_reply": _reply(replayed),
+                "recorded_events": [event["kind"] for event in trace["events"]],
+                "replayed_events": [event["kind"] for event in replayed["events"]],
+            })
+
+        return {
+            "commands": len(commands),
+            "replies_matched": sum(1 for command in commands
+                                   if command["recorded_reply"] == command["replayed_reply"]),
+            "responses": {"matched": responses.matched, "fallbacks": responses.fallbacks,
+                          "unknown": responses.unknown},
+            "recorded_ms": recorded_ms.summary(),
+            "replayed_ms": replayed_ms.summary(),
+            "stages": metrics.as_dict(),
+            "traces": commands,
+        }
+    finally:
+        await client.close()
+        await server.stop()
+
+
+async def main(args) -> None:
+    """Replay the traces and print or write the report."""
+    logging.getLogger().setLevel(args.log_level)
+    report = {
+        "settings": {key: (str(value) if isinstance(value, Path) else value)
+                     for key, value in vars(args).items()},
+        "replay": await replay(args, load_traces(args.traces)),
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    else:
+        print(output)
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("traces", type=Path,
+                        help="diagnostics download or JSON list of the recorded traces")
+    parser.add_argument("--config", type=Path, default=DEFAULT_CONFIG,
+                        help="paavoai.toml to use")
+    parser.add_argument("--no-timing", action="store_true",
+                        help="answer immediately instead of in the recorded time")
+    parser.add_argument("--sequential", action="store_true",
+                        help="run the commands one after another instead of at "
+                             "their recorded offsets")
+    parser.add_argument("--parallel", type=int, default=1,
+                        help="concurrent requests to the fake server (Ollama slots)")
+    parser.add_argument("--service-delay", type=float, default=0.0,
+                        help="fake service call delay in seconds")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the agent")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,222 @@
+"""
+Latency and throughput benchmark for the Paavo AI conversation agent.
+
+Drives PaavoAIConversationAgent.async_process with a weighted mix of Finnish
+utterances against the fake Ollama server and a stub hass, at one or more
+concurrency levels, and reports the end-to-end and per-stage latency
+percentiles, the LLM calls per command and the throughput as JSON.
+
+Run from the repository root (requires homeassistant and aiohttp):
+
+    python -m benchmarks.run_benchmark --commands 200 --concurrency 1 4 8
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import logging
+import random
+import time
+import tomllib
+from pathlib import Path
+
+from homeassistant.components.conversation import ConversationInput
+from homeassistant.core import Context
+
+from custom_components.paavoai.circuit_breaker import CircuitBreaker
+from custom_components.paavoai.conversation import PaavoAIConversationAgent
+from custom_components.paavoai.metrics import LatencyHistogram, PaavoAIMetrics
+from custom_components.paavoai.ollama_client import OllamaClient
+from custom_components.paavoai.prompts import PromptRegistry
+from custom_components.paavoai.scheduler import OllamaScheduler
+
+from .fake_ollama import FakeOllamaServer, last_user_utterance
+from .stub_hass import StubHass
+
+DEFAULT_CONFIG = Path(__file__).parent.parent / "custom_components" / "paavoai" / "paavoai.toml"
+
+# Utterance, weight, topic, action
+SCENARIO = [
+    ("seuraava", 20, "music", "next"),
+    ("tauko", 10, "music", "pause"),
+    ("jatka", 10, "music", "resume"),
+    ("lopeta musiikki", 10, "music", "stop"),
+    ("soita musiikkia", 10, "music", "play"),
+    ("soita jotain rauhallista", 8, "music", "load rauhallinen"),
+    ("mikä kappale tämä on", 8, "music", "info"),
+    ("vaihda johonkin toiseen biisiin", 6, "music", "next"),
+    ("laita soimaan soittolista kesähitit", 6, "music", "load kesähitit"),
+    ("mikä on olohuoneen lämpötila", 6, "sensor", "none"),
+    ("sammuta olohuoneen valot", 6, "lights", "none"),
+]
+
+# Extra output the model tends to add after the answer line
+_TRAILER = "\nThe user clearly wants this, and this choice matches the request best " \
+           "based on the conversation history above."
+
+
+def scripted_response(payload: dict, scenario: list = SCENARIO) -> str:
+    """Return the fake model response for a request, based on the last user utterance."""
+    prompt = payload["prompt"]
+    utterance = last_user_utterance(prompt)
+    topic, action = next(((t, a) for u, _w, t, a in scenario if u == utterance),
+                         ("sensor", "none"))
+
+    if isinstance(payload.get("format"), dict) and \
+       "areas" in payload["format"].get("properties", {}):
+        return json.dumps({"action": "off", "areas": ["Olohuone"]})
+    if isinstance(payload.get("format"), dict):
+        name, _, parameter = action.partition(" ")
+        return json.dumps({"topic": topic, "action": name, "parameter": parameter,
+                           "reply": "Selvä, tehty."})
+    if "(starts with 'topic:')" in prompt:
+        return f"reasoning: The user talks about {topic}\ntopic: {topic}{_TRAILER}"
+    if "(starts with 'action:')" in prompt:
+        return f"reasoning: The user wants {action}\naction: {action}{_TRAILER}"
+    return "Selvä, tehty."
+
+
+def make_input(text: str, conversation_id: str) -> ConversationInput:
+    """Create a ConversationInput, filling the fields of the installed HA version."""
+    values = {"text": text, "context": Context(), "conversation_id": conversation_id,
+              "language": "fi", "agent_id": "paavoai"}
+    kwargs = {field.name: values.get(field.name)
+              for field in dataclasses.fields(ConversationInput)
+              if field.name in values or (field.default is dataclasses.MISSING and
+                                          field.default_factory is dataclasses.MISSING)}
+    return ConversationInput(**kwargs)
+
+
+def load_config(args) -> dict:
+    """Load paavoai.toml and apply the command line overrides."""
+    with open(args.config, "rb") as f:
+        config = tomllib.load(f)
+    if args.classification:
+        config["conversation"]["classification"] = args.classification
+    if args.no_fast_path:
+        config.setdefault("fast_path", {})["enabled"] = False
+    if args.no_cache:
+        config.setdefault("cache", {})["enabled"] = False
+    if args.no_early_stop:
+        config["conversation"]["stream_early_stop"] = False
+    if args.speculative:
+        config["conversation"]["speculative_action"] = True
+    music = config.setdefault("music", {})
+    music["entity_ids"] = [f"media_player.room_{index}" for index in range(args.media_players)]
+    if args.non_blocking:
+        music["blocking"] = False
+    return config
+
+
+async def run_level(args, concurrency: int) -> dict:
+    """Run the commands at one concurrency level and return the report."""
+    server = FakeOllamaServer(scripted_response, token_delay=args.token_delay)
+    await server.start()
+    config = load_config(args)
+    hass = StubHass(service_delay=args.service_delay,
+                    media_players=tuple(config["music"]["entity_ids"]))
+    metrics = PaavoAIMetrics(window=args.commands)
+    client = OllamaClient("127.0.0.1", server.port, server.model, metrics=metrics)
+    try:
+        await client.warm_up()
+        circuit_breaker = CircuitBreaker(client)
+        scheduler = OllamaScheduler(circuit_breaker, parallel=args.parallel, metrics=metrics)
+        agent = PaavoAIConversationAgent(hass, {}, scheduler, PromptRegistry.from_config(config),
+                                         metrics=metrics)
+
+        rng = random.Random(args.seed)
+        utterances = rng.choices([s[0] for s in SCENARIO], [s[1] for s in SCENARIO],
+                                 k=args.commands)
+        pending = iter(utterances)
+        end_to_end = LatencyHistogram(window=args.commands)
+        calls_before = server.generate_calls
+
+        async def worker(index: int) -> None:
+            # One conversation per worker, like one per satellite waiting for its reply
+            for text in pending:
+                start = time.perf_counter()
+                await agent.async_process(make_input(text, f"bench-{index}"))
+                end_to_end.observe((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        await hass.async_block_till_done()
+
+        return {
+            "concurrency": concurrency,
+            "commands": args.commands,
+            "throughput_per_s": round(args.commands / elapsed, 2),
+            "end_to_end_ms": end_to_end.summary(),
+            "llm_calls_per_command": round((server.generate_calls - calls_before) /
+                                           args.commands, 3),
+            "cancelled_generations": server.cancelled,
+            "service_calls": len(hass.services.calls),
+            "stages": metrics.as_dict(),
+            "fast_path": agent.fast_path.stats(),
+            "classification_cache": agent.cache.stats(),
+            "speculation": agent.speculation_stats(),
+            "scheduler": scheduler.stats(),
+            "circuit_breaker": circuit_breaker.stats(),
+            "music_player": agent.music_player.stats(),
+            "entity_index": agent.entity_index.stats(),
+            "light_areas": agent.light_controller.stats(),
+        }
+    finally:
+        await client.close()
+        await server.stop()
+
+
+async def main(args) -> None:
+    """Run all the concurrency levels and print or write the report."""
+    logging.getLogger().setLevel(args.log_level)
+    report = {
+        "settings": {key: (str(value) if isinstance(value, Path) else value)
+                     for key, value in vars(args).items()},
+        "levels": [await run_level(args, concurrency) for concurrency in args.concurrency],
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    else:
+        print(output)
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", type=Path, default=DEFAULT_CONFIG,
+                        help="paavoai.toml to use")
+    parser.add_argument("--commands", type=int, default=100,
+                        help="commands per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4],
+                        help="concurrency levels to run")
+    parser.add_argument("--token-delay", type=float, default=0.02,
+                        help="fake generation delay per token in seconds")
+    parser.add_argument("--parallel", type=int, default=1,
+                        help="concurrent requests to the fake server (Ollama slots)")
+    parser.add_argument("--service-delay", type=float, default=0.05,
+                        help="fake media_player service call delay in seconds")
+    parser.add_argument("--classification", choices=["chain", "structured"],
+                        help="override [conversation] classification")
+    parser.add_argument("--no-fast-path", action="store_true", help="disable the fast path")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="disable the classification cache")
+    parser.add_argument("--no-early-stop", action="store_true",
+                        help="disable the streaming early stop")
+    parser.add_argument("--speculative", action="store_true",
+                        help="classify the music action speculatively with the topic")
+    parser.add_argument("--media-players", type=int, default=1,
+                        help="fake media players each command is sent to")
+    parser.add_argument("--non-blocking", action="store_true",
+                        help="fire the service calls and confirm them from the states")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the utterance mix")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the agent")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,252 @@
+"""
+Offline accuracy and latency evaluation of the Paavo AI classification prompts.
+
+Runs a labelled corpus of Finnish utterances through the topic_get and
+music_get_actions code paths of PaavoAIConversationAgent against an Ollama
+server, or by default against the fake Ollama server answering from the corpus
+labels (with an optional share of format slips for exercising the parser). Each
+paavoai.toml and model combination is run separately with bounded parallelism
+and reported with the prompt versions, the accuracy, the format failure rates,
+the generated tokens and the latency percentiles as JSON, to be diffed between
+runs.
+
+Run from the repository root (requires homeassistant and aiohttp):
+
+    python -m benchmarks.run_evaluation --output eval-before.json
+    python -m benchmarks.run_evaluation --host 192.168.1.10 --model qwen3:30b qwen3:8b \\
+        --config paavoai.toml paavoai-new.toml
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import tomllib
+from pathlib import Path
+
+from custom_components.paavoai.circuit_breaker import CircuitBreaker
+from custom_components.paavoai.conversation import PaavoAIConversationAgent, PaavoAIError
+from custom_components.paavoai.metrics import LatencyHistogram, PaavoAIMetrics
+from custom_components.paavoai.ollama_client import OllamaClient
+from custom_components.paavoai.prompts import PromptRegistry
+from custom_components.paavoai.scheduler import OllamaScheduler
+
+from .fake_ollama import FakeOllamaServer, last_user_utterance
+from .run_benchmark import DEFAULT_CONFIG
+from .stub_hass import StubHass
+
+DEFAULT_CORPUS = Path(__file__).parent / "eval_corpus.toml"
+FAKE_MODEL = "fake:latest"
+
+
+def load_corpus(path: Path) -> list[dict]:
+    """Load the labelled utterances."""
+    with open(path, "rb") as f:
+        utterances = tomllib.load(f).get("utterances", [])
+    for item in utterances:
+        if not {"text", "topic", "action"} <= item.keys():
+            raise ValueError(f"Corpus entry without text, topic or action: {item}")
+    return utterances
+
+
+def _slipped(answer: str, key: str, rng: random.Random) -> str:
+    """Return the answer line with a format slip a real model makes now and then."""
+    slip = rng.randrange(4)
+    if slip == 0:
+        return f"**{key.capitalize()}:** {answer.capitalize()}"
+    if slip == 1:
+        name, separator, parameter = answer.partition(" ")
+        return f"{key}: {name}{name[-1]}{separator}{parameter}"  # Misspelled
+    if slip == 2:
+        return answer  # Without the key
+    return "I am not sure about this one."  # Unparsable, retried
+
+
+def scripted_response(payload: dict, labels: dict, slip_rate: float, seed: int) -> str:
+    """
+    Return the fake model response for a request from the labels of the last
+    user utterance. The format slips are deterministic per utterance and seed.
+    """
+    prompt = payload["prompt"]
+    utterance = last_user_utterance(prompt)
+    topic, action = labels.get(utterance, ("sensor", "none"))
+
+    if isinstance(payload.get("format"), dict):
+        # The constrained retry of an unparsable answer
+        properties = payload["format"].get("properties", {})
+        if "topic" in properties:
+            return json.dumps({"topic": topic})
+        name, _, parameter = action.partition(" ")
+        return json.dumps({"action": name, "parameter": parameter})
+
+    if "(starts with 'topic:')" in prompt:
+        key, answer = "topic", topic
+    elif "(starts with 'action:')" in prompt:
+        key, answer = "action", action
+    else:
+        return "Selvä."
+    rng = random.Random(f"{seed}-{key}-{utterance}")
+    line = _slipped(answer, key, rng) if rng.random() < slip_rate else f"{key}: {answer}"
+    return f"reasoning: The user talks about {topic}\n{line}"
+
+
+async def evaluate_item(agent: PaavoAIConversationAgent, item: dict, index: int,
+                        histograms: dict, tokens: dict) -> dict:
+    """Classify one utterance like the agent does and return the result."""
+    conversation_id = f"eval-{index}"
+    await agent.conversation_store(conversation_id, "user", item["text"])
+    result = {"text": item["text"], "expected_topic": item["topic"],
+              "expected_action": item["action"], "topic": None, "action": None, "error": None}
+    # The generated tokens include the constrained retries, also when they fail
+    stats = {"topic": {}, "action": {}}
+    try:
+        start = time.perf_counter()
+        result["topic"] = await agent.topic_get(conversation_id, stats=stats["topic"])
+        histograms["topic"].observe((time.perf_counter() - start) * 1000)
+        if item["topic"] == "music":
+            # Evaluated for the music utterances even if the topic was wrong
+            start = time.perf_counter()
+            result["action"] = await agent.music_get_actions(conversation_id,
+                                                             stats=stats["action"])
+            histograms["action"].observe((time.perf_counter() - start) * 1000)
+    except PaavoAIError as e:
+        result["error"] = str(e)
+    finally:
+        for name, counts in stats.items():
+            tokens[name] += counts.get("eval_count", 0)
+    return result
+
+
+def _accuracy(results: list[dict], expected: str, got: str, normalize=lambda value: value):
+    """Return the share of the results with the expected value."""
+    if not results:
+        return None
+    correct = sum(1 for result in results
+                  if result[got] is not None and
+                  normalize(result[got]) == normalize(result[expected]))
+    return round(correct / len(results), 4)
+
+
+async def run_variant(args, corpus: list[dict], config_path: Path, model: str) -> dict:
+    """Evaluate the corpus with one paavoai.toml and model and return the report."""
+    with open(config_path, "rb") as f:
+        config = tomllib.load(f)
+    # Only the prompts are evaluated, not the local shortcuts
+    config.setdefault("router", {})["enabled"] = False
+    if args.no_retry:
+        config["conversation"]["parse_retry"] = False
+    prompts = PromptRegistry.from_config(config)
+
+    server = None
+    host, port = args.host, args.port
+    if host is None:
+        labels = {item["text"]: (item["topic"], item["action"]) for item in corpus}
+        server = FakeOllamaServer(
+            lambda payload: scripted_response(payload, labels, args.slip_rate, args.seed),
+            model=model, token_delay=args.token_delay)
+        await server.start()
+        host, port = "127.0.0.1", server.port
+    metrics = PaavoAIMetrics(window=len(corpus))
+    client = OllamaClient(host, port, model, timeout=args.timeout, metrics=metrics)
+    try:
+        await client.warm_up()
+        scheduler = OllamaScheduler(CircuitBreaker(client), parallel=args.parallel,
+                                    metrics=metrics)
+        agent = PaavoAIConversationAgent(StubHass(), {}, scheduler, prompts, metrics=metrics)
+
+        histograms = {"topic": LatencyHistogram(len(corpus)),
+                      "action": LatencyHistogram(len(corpus))}
+        tokens = {"topic": 0, "action": 0}
+        semaphore = asyncio.Semaphore(args.parallel)
+
+        async def bounded(index: int, item: dict) -> dict:
+            async with semaphore:
+                return await evaluate_item(agent, item, index, histograms, tokens)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(bounded(i, item) for i, item in enumerate(corpus)))
+        elapsed = time.perf_counter() - start
+
+        music = [result for result in results if result["expected_topic"] == "music"]
+        return {
+            "config": str(config_path),
+            "model": model,
+            "backend": "fake" if server is not None else client.base_url,
+            "prompt_versions": {name: version for name, version in prompts.versions().items()
+                                if name in ("topic_get_prompt", "music_get_action_prompt")},
+            "utterances": len(results),
+            "elapsed_s": round(elapsed, 2),
+            "topic_accuracy": _accuracy(results, "expected_topic", "topic"),
+            "action_accuracy": _accuracy(music, "expected_action", "action"),
+            # The playlist names of 'load' are often rephrased, the action alone
+            "action_name_accuracy": _accuracy(music, "expected_action", "action",
+                                              lambda value: value.split(" ")[0]),
+            "errors": sum(1 for result in results if result["error"]),
+            "format": agent.parser.stats(),
+            "tokens_generated": dict(tokens, per_utterance=round(
+                (tokens["topic"] + tokens["action"]) / len(results), 2) if results else None),
+            "latency_ms": {name: histogram.summary() for name, histogram in histograms.items()},
+            "mistakes": [result for result in results
+                         if result["error"] or result["topic"] != result["expected_topic"] or
+                         (result["expected_topic"] == "music" and
+                          result["action"] != result["expected_action"])],
+        }
+    finally:
+        await client.close()
+        if server is not None:
+            await server.stop()
+
+
+async def main(args) -> None:
+    """Run all the paavoai.toml and model combinations and print or write the report."""
+    logging.getLogger().setLevel(args.log_level)
+    corpus = load_corpus(args.corpus)
+    models = args.model or [FAKE_MODEL]
+    report = {
+        "settings": {key: (str(value) if isinstance(value, Path) else value)
+                     for key, value in vars(args).items()},
+        "runs": [await run_variant(args, corpus, config_path, model)
+                 for config_path in args.config for model in models],
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    else:
+        print(output)
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS,
+                        help="labelled utterances (TOML)")
+    parser.add_argument("--config", type=Path, nargs="+", default=[DEFAULT_CONFIG],
+                        help="paavoai.toml files (prompt versions) to evaluate")
+    parser.add_argument("--model", nargs="+",
+                        help="models to evaluate, required with --host")
+    parser.add_argument("--host", help="Ollama server, the fake server is used if not given")
+    parser.add_argument("--port", type=int, default=11434, help="Ollama server port")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="timeout of a single Ollama request in seconds")
+    parser.add_argument("--parallel", type=int, default=1,
+                        help="utterances classified concurrently (Ollama slots)")
+    parser.add_argument("--no-retry", action="store_true",
+                        help="disable the constrained retry of unparsable answers")
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="fake generation delay per token in seconds")
+    parser.add_argument("--slip-rate", type=float, default=0.1,
+                        help="share of the fake answers with a format slip")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the fake format slips")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the agent")
+    args = parser.parse_args(argv)
+    if args.host and not args.model:
+        parser.error("--model is required with --host")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
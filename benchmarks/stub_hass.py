@@ -0,0 +1,204 @@
+"""Minimal stand-in for the HomeAssistant object with a fake media player."""
+
+import asyncio
+from types import MappingProxyType
+
+from homeassistant.config_entries import ConfigEntryState
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.core import Event
+
+
+class StubState:
+    """The state of an entity."""
+    def __init__(self, entity_id: str, state: str, attributes: dict | None = None):
+        self.entity_id = entity_id
+        self.domain = entity_id.split(".")[0]
+        self.state = state
+        self.attributes = MappingProxyType(dict(attributes or {}))
+        self.name = self.attributes.get("friendly_name", entity_id)
+
+
+class StubBus:
+    """The event bus of the stub, the listeners are called immediately."""
+    def __init__(self):
+        self._listeners = []
+
+    def async_listen(self, event_type: str, listener, event_filter=None, **_kwargs):
+        entry = (event_type, listener, event_filter)
+        self._listeners.append(entry)
+        return lambda: self._listeners.remove(entry)
+
+    def async_fire(self, event_type: str, event_data: dict | None = None) -> None:
+        event = Event(event_type, event_data or {})
+        for listened_type, listener, event_filter in list(self._listeners):
+            if listened_type == event_type and (event_filter is None or event_filter(event)):
+                listener(event)
+
+
+class StubStates:
+    """The state machine of the stub, the changes are fired on the bus."""
+    def __init__(self, bus: StubBus):
+        self._bus = bus
+        self._states = {}
+
+    def get(self, entity_id: str) -> StubState | None:
+        return self._states.get(entity_id)
+
+    def async_all(self, domain: str | None = None) -> list:
+        return [state for state in self._states.values()
+                if domain is None or state.domain == domain]
+
+    def async_set(self, entity_id: str, state: str, attributes: dict | None = None) -> None:
+        old_state = self._states.get(entity_id)
+        new_state = self._states[entity_id] = StubState(entity_id, state, attributes)
+        self._bus.async_fire(EVENT_STATE_CHANGED, {"entity_id": entity_id,
+                                                   "old_state": old_state,
+                                                   "new_state": new_state})
+
+
+class StubRegistryEntry:
+    """An entity or area registry entry."""
+    def __init__(self, **fields):
+        self.aliases = set()
+        self.area_id = self.device_id = self.disabled_by = None
+        self.__dict__.update(fields)
+
+
+class StubRegistry:
+    """The entity, device or area registry of the stub, the devices are not registered."""
+    def __init__(self, items: dict | None = None):
+        self.entities = items or {}
+
+    def async_get(self, item_id: str):
+        return self.entities.get(item_id)
+
+    def async_get_area(self, area_id: str):
+        return self.entities.get(area_id)
+
+    def async_list_areas(self) -> list:
+        return list(self.entities.values())
+
+
+class StubConfigEntry:
+    """A loaded config entry."""
+    def __init__(self, domain: str):
+        self.domain = domain
+        self.entry_id = f"{domain}_entry"
+        self.state = ConfigEntryState.LOADED
+
+
+class StubConfigEntries:
+    """The config entries of the stub, one loaded entry per domain."""
+    def __init__(self, domains: tuple):
+        self._entries = [StubConfigEntry(domain) for domain in domains]
+
+    def async_entries(self, domain: str | None = None) -> list:
+        return [entry for entry in self._entries if domain is None or entry.domain == domain]
+
+
+class StubServices:
+    """Service registry of the stub, the calls are recorded and take service_delay."""
+    def __init__(self, hass, service_delay: float):
+        self._hass = hass
+        self.service_delay = service_delay
+        self.calls = []
+
+    async def async_call(self, domain: str, service: str, service_data: dict | None = None,
+                         blocking: bool = False, target: dict | None = None, **_kwargs):
+        self.calls.append((domain, service, dict(service_data or {}), dict(target or {})))
+        if (domain, service) == ("music_assistant", "get_library"):
+            await asyncio.sleep(self.service_delay)
+            return {"items": [{"name": name, "uri": f"library://playlist/{index}"}
+                              for index, name in enumerate(self._hass.playlists)]}
+        if blocking:
+            await self._run(domain, service, target or {})
+        else:
+            self._hass.async_create_task(self._run(domain, service, target or {}))
+
+    async def _run(self, domain: str, service: str, target: dict) -> None:
+        await asyncio.sleep(self.service_delay)
+        if domain == "media_player":
+            entity_ids = target.get("entity_id", [])
+            if isinstance(entity_ids, str):
+                entity_ids = [entity_ids]
+            for entity_id in entity_ids:
+                self._hass.fake_media_player_service(entity_id, service)
+
+
+class StubHass:
+    """
+    The parts of HomeAssistant the agent uses, with fake media_player entities
+    reacting to the media_player services.
+    """
+    def __init__(self, service_delay: float = 0.0,
+                 media_players: tuple = ("media_player.shieldi",),
+                 playlists: tuple = ("Kesähitit", "Rauhallinen", "Suomirock", "Joulu")):
+        self.loop = asyncio.get_running_loop()
+        rooms = ("Olohuone", "Keittiö", "Makuuhuone", "Sauna", "Ulko")
+        areas = {room.lower(): StubRegistryEntry(id=room.lower(), name=room) for room in rooms}
+        # Two lights in each area
+        lights = {f"light.{area_id}_{index}": StubRegistryEntry(
+                      entity_id=f"light.{area_id}_{index}", domain="light", area_id=area_id)
+                  for area_id in areas for index in range(2)}
+        self.data = {"entity_registry": StubRegistry(lights),
+                     "device_registry": StubRegistry(),
+                     "area_registry": StubRegistry(areas)}
+        self.playlists = playlists  # The fake Music Assistant library
+        self.config_entries = StubConfigEntries(("music_assistant",))
+        self.bus = StubBus()
+        self.states = StubStates(self.bus)
+        self.services = StubServices(self, service_delay)
+        self._tasks = set()
+        self._track = 0
+        for entity_id in media_players:
+            self.states.async_set(entity_id, "idle", {"friendly_name": entity_id.split(".")[1]})
+        for entity_id in lights:
+            self.states.async_set(entity_id, "off")
+        for index, room in enumerate(rooms):
+            self.states.async_set(f"sensor.temperature_{index}", str(20 + index),
+                                  {"friendly_name": f"{room} lämpötila",
+                                   "device_class": "temperature",
+                                   "unit_of_measurement": "°C"})
+            self.states.async_set(f"sensor.humidity_{index}", str(40 + index),
+                                  {"friendly_name": f"{room} kosteus",
+                                   "device_class": "humidity",
+                                   "unit_of_measurement": "%"})
+
+    def async_create_task(self, target, name: str | None = None, eager_start: bool = True):
+        task = self.loop.create_task(target, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def async_create_background_task(self, target, name: str, eager_start: bool = True):
+        return self.async_create_task(target, name)
+
+    def async_run_hass_job(self, job, *args):
+        return job.target(*args)
+
+    async def async_add_executor_job(self, target, *args):
+        return await self.loop.run_in_executor(None, target, *args)
+
+    async def async_block_till_done(self) -> None:
+        """Wait for the tasks, e.g. the non-blocking service calls and confirmations."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def fake_media_player_service(self, entity_id: str, service: str) -> None:
+        """Update the fake media player state like a real player would."""
+        state = self.states.get(entity_id)
+        attributes = dict(state.attributes) if state else {}
+        new_state = state.state if state else "idle"
+        if service in ("play_media", "media_play", "turn_on"):
+            new_state = "playing" if service != "turn_on" else \
+                ("idle" if new_state == "off" else new_state)
+        elif service == "media_pause":
+            new_state = "paused"
+        elif service in ("media_stop", "turn_off"):
+            new_state = "idle"
+        elif service in ("media_next_track", "media_previous_track"):
+            self._track += 1 if service == "media_next_track" else -1
+        if new_state == "playing" or service.endswith("_track"):
+            attributes.update({"media_title": f"Kappale {self._track}",
+                               "media_artist": "Artisti"})
+        self.states.async_set(entity_id, new_state, attributes)
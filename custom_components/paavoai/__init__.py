@@ -7,32 +7,26 @@ from homeassistant import config_entries, core
 from homeassistant.core import HomeAssistant
 from homeassistant.components import conversation as ha_conversation
 from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
-from .conversation import PaavoAIConversationAgent
+from .backend_pool import BackendConfigError, OllamaBackendPool, parse_backends
+from .circuit_breaker import CircuitBreaker
+from .conversation import STREAMING_SUPPORTED, PaavoAIConversationAgent
+from .intent_router import IntentRouter, IntentRouterError
+from .metrics import PaavoAIMetrics
 from .ollama_client import OllamaClient
+from .playlist_catalog import PlaylistCatalog, PlaylistCatalogError
+from .prompts import PromptError, PromptRegistry
+from .scheduler import OllamaScheduler
 
 DOMAIN = "paavoai"
+PLATFORMS = ["binary_sensor", "sensor"]
 _LOGGER = logging.getLogger(__name__)
 
 async def async_setup(_hass: core.HomeAssistant, _config: dict) -> bool:
     """Set up the Paavo AI integration (legacy)."""
     return True
 
-def _load_paavoai_toml_config_sync():
-    """Synchronously loads the paavoai.toml file."""
-    current_dir = os.path.dirname(__file__)
-    toml_path = os.path.join(current_dir, "paavoai.toml")
-    _LOGGER.debug("Attempting to load paavoai.toml from: %s", toml_path)
-    try:
-        with open(toml_path, "rb") as f:
-            return tomllib.load(f)
-    except FileNotFoundError:
-        _LOGGER.error("paavoai.toml not found at %s", toml_path)
-        raise
-    except tomllib.TOMLDecodeError as e:
-        _LOGGER.error("Error decoding paavoai.toml from %s: %s", toml_path, str(e))
-        raise
-
 async def async_setup_entry(hass: HomeAssistant, entry: config_entries.ConfigEntry) -> bool:
     """Set up Paavo AI from a config entry."""
     _LOGGER.debug("Setting up Paavo AI entry: %s, data: %s", str(entry.entry_id), str(entry.data))
@@ -42,13 +36,41 @@ async def async_setup_entry(hass: HomeAssistant, entry: config_entries.ConfigEnt
     port = entry.data["port"]
     model = entry.data["model"]
 
-    ollama_client = OllamaClient(host, port, model)
+    # Load the paavoai.toml configuration and compile the prompts
+    prompts = PromptRegistry(os.path.join(os.path.dirname(__file__), "paavoai.toml"))
+    try:
+        await hass.async_add_executor_job(prompts.load)
+        paavoai_config = prompts.config
+        _LOGGER.info("Successfully loaded paavoai.toml for entry %s", str(entry.entry_id))
+    except (FileNotFoundError, tomllib.TOMLDecodeError, PromptError) as e:
+        error_message = f"Error loading paavoai.toml: {e}"
+        _LOGGER.error(error_message)
+        raise ConfigEntryNotReady(error_message) from e
+    except Exception as e: # Catch any other unexpected error during loading
+        error_message = f"Unexpected error loading paavoai.toml: {e}"
+        _LOGGER.error(error_message)
+        raise ConfigEntryNotReady(error_message) from e
+
+    metrics = PaavoAIMetrics()
+    ollama_config = paavoai_config.get("ollama", {})
+    try:
+        backends = [(host, port, model)] + parse_backends(entry.data.get("additional_backends"))
+    except BackendConfigError as e:
+        _LOGGER.error("Invalid additional backends for Paavo AI entry %s: %s",
+                      str(entry.entry_id), str(e))
+        raise ConfigEntryNotReady(str(e)) from e
+    session = async_get_clientsession(hass)
+    ollama_client = OllamaBackendPool(
+        [OllamaClient(backend_host, backend_port, backend_model, session=session,
+                      keep_alive=ollama_config.get("keep_alive"), metrics=metrics)
+         for backend_host, backend_port, backend_model in backends],
+        probe_interval=ollama_config.get("probe_interval", 30),
+        failover_timeout=ollama_config.get("failover_timeout", 10))
 
     try:
-        # Perform a test call to ensure the client can connect.
-        # TODO: Use a faster test, e.g. to list the models instead of running them"
+        # Quick check that the servers are up and have the models, the models are loaded later
         _LOGGER.debug("Testing connection to Ollama for Paavo AI entry %s...", str(entry.entry_id))
-        await hass.async_add_executor_job(ollama_client.send_request, "hello")
+        await ollama_client.check_model()
         _LOGGER.info("Successfully connected to Ollama for Paavo AI entry %s", str(entry.entry_id))
 
     except Exception as e: # Catch specific exceptions from your client if possible
@@ -57,35 +79,29 @@ async def async_setup_entry(hass: HomeAssistant, entry: config_entries.ConfigEnt
         # This is CRUCIAL. It tells HA that setup failed and to retry later.
         raise ConfigEntryNotReady(f"Ollama connection error for {host}:{port}: {e}") from e
 
-    # Load the paavoai.toml configuration
-    try:
-        paavoai_config = await hass.async_add_executor_job(_load_paavoai_toml_config_sync)
-        conversation_config = paavoai_config.get("conversation", {}) if paavoai_config else {}
-        if not conversation_config.get("topic_get_prompt"):
-            error_message = "paavoai.toml is empty or 'topic_get_prompt' under "\
-                            "[conversation] is missing or empty."
-            _LOGGER.error(error_message)
-            raise ConfigEntryNotReady(error_message)
-        _LOGGER.info("Successfully loaded paavoai.toml for entry %s", str(entry.entry_id))
-    except (FileNotFoundError, tomllib.TOMLDecodeError) as e:
-        error_message = f"Error loading paavoai.toml: {e}"
-        _LOGGER.error(error_message)
-        raise ConfigEntryNotReady(error_message) from e
-    except Exception as e: # Catch any other unexpected error during loading
-        error_message = f"Unexpected error loading paavoai.toml: {e}"
-        _LOGGER.error(error_message)
-        raise ConfigEntryNotReady(error_message) from e
+    # Requests fail fast while all the servers are down
+    circuit_breaker = CircuitBreaker(ollama_client,
+                                     threshold=ollama_config.get("breaker_threshold", 3),
+                                     open_seconds=ollama_config.get("breaker_open_seconds", 30))
 
+    # Requests from all the satellites are queued by priority for the servers' slots
+    scheduler = OllamaScheduler(circuit_breaker,
+                                parallel=ollama_config.get("parallel", 1) * len(backends),
+                                metrics=metrics)
 
     hass.data[DOMAIN][entry.entry_id] = {
         "ollama_client": ollama_client,
+        "circuit_breaker": circuit_breaker,
+        "scheduler": scheduler,
+        "metrics": metrics,
         "hass_config": entry.data, # Storing original config data
-        "paavoai_config": paavoai_config # Loaded paavoai.toml data
+        "prompts": prompts # Loaded paavoai.toml data and the compiled prompts
    }
 
-    # Pass the initialized client and the loaded paavoai.toml config to the agent
+    # Pass the initialized client and the prompt registry to the agent
     try:
-        agent = PaavoAIConversationAgent(hass, dict(entry.data), ollama_client, paavoai_config)
+        agent = PaavoAIConversationAgent(hass, dict(entry.data), scheduler, prompts,
+                                         metrics=metrics)
     except Exception as e:
         error_message = f"Failed to initialize PaavoAIConversationAgent: {e}"
         _LOGGER.error(error_message)
@@ -93,15 +109,65 @@ async def async_setup_entry(hass: HomeAssistant, entry: config_entries.ConfigEnt
 
     hass.data[DOMAIN][entry.entry_id]["agent"] = agent
 
-    ha_conversation.async_set_agent(hass, entry, agent)
-    _LOGGER.info("Paavo AI conversation agent set for entry %s", str(entry.entry_id))
+    # The streaming entity replaces the legacy agent when enabled and supported
+    platforms = list(PLATFORMS)
+    if paavoai_config["conversation"].get("stream_replies", False):
+        if STREAMING_SUPPORTED:
+            platforms.append("conversation")
+        else:
+            _LOGGER.warning("stream_replies is enabled but this Home Assistant version "
+                            "doesn't support streaming conversation output")
+    hass.data[DOMAIN][entry.entry_id]["platforms"] = platforms
+    if "conversation" not in platforms:
+        ha_conversation.async_set_agent(hass, entry, agent)
+        _LOGGER.info("Paavo AI conversation agent set for entry %s", str(entry.entry_id))
+
+    # Changes to paavoai.toml are applied without reloading the entry
+    entry.async_on_unload(prompts.async_start_watching(hass))
+    # The backends are probed for the routing
+    entry.async_on_unload(ollama_client.async_start_probing(hass))
+    # The playlist names are resolved locally from the Music Assistant library
+    catalog = agent.music_player.catalog
+    entry.async_on_unload(catalog.async_start_refreshing())
+    # The sensors are looked up from an index kept current with the state changes
+    entry.async_on_unload(agent.entity_index.async_start_tracking())
+    # The lights are controlled by area, the area -> lights map follows the registries
+    entry.async_on_unload(agent.light_controller.async_start_tracking())
+
+    await hass.config_entries.async_forward_entry_setups(entry, platforms)
+
+    # Load the model in the background, the agent waits for it if needed
+    entry.async_create_background_task(hass, ollama_client.warm_up(),
+                                       f"{DOMAIN} model warm-up {entry.entry_id}")
+    entry.async_create_background_task(hass, _async_refresh_catalog(catalog),
+                                       f"{DOMAIN} playlist catalog {entry.entry_id}")
+    entry.async_create_background_task(hass, _async_prepare_router(agent.router),
+                                       f"{DOMAIN} intent router {entry.entry_id}")
 
     return True
 
+async def _async_refresh_catalog(catalog: PlaylistCatalog) -> None:
+    """Fetch the playlists at startup, Music Assistant may not be loaded yet."""
+    try:
+        await catalog.async_refresh()
+    except PlaylistCatalogError:
+        _LOGGER.info("Playlists not available yet, retrying on the next refresh")
+
+async def _async_prepare_router(router: IntentRouter) -> None:
+    """Embed the router exemplars at startup, retried on the first commands on failure."""
+    try:
+        await router.async_prepare()
+    except IntentRouterError:
+        _LOGGER.info("Intent router not ready, the LLM classifies the commands meanwhile")
+
 async def async_unload_entry(hass: core.HomeAssistant, entry: config_entries.ConfigEntry) -> bool:
     """Unload a config entry."""
     _LOGGER.debug("Unloading Paavo AI entry: %s", str(entry.entry_id))
-    ha_conversation.async_unset_agent(hass, entry)
+    platforms = hass.data.get(DOMAIN, {}).get(entry.entry_id, {}).get("platforms", PLATFORMS)
+    if "conversation" not in platforms:
+        ha_conversation.async_unset_agent(hass, entry)
+    if not await hass.config_entries.async_unload_platforms(entry, platforms):
+        return False
 
     if DOMAIN in hass.data and entry.entry_id in hass.data[DOMAIN]:
         hass.data[DOMAIN].pop(entry.entry_id)
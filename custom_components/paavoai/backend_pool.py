@@ -0,0 +1,312 @@
+""" Pool of Ollama backends with health probes and latency-aware routing """
+
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import AsyncIterator, Callable
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_track_time_interval
+
+from .ollama_client import OllamaClient, OllamaClientError
+
+_LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_PROBE_INTERVAL = 30     # Seconds between the health probes
+_DEFAULT_FAILOVER_TIMEOUT = 10   # Seconds for an attempt when another backend is left
+_EWMA_ALPHA = 0.3                # Weight of the newest latency observation
+_NOT_LOADED_PENALTY = 5000       # Milliseconds added when the model is not in memory
+_UNHEALTHY_PENALTY = 60000       # Milliseconds added for a backend failing its probe
+
+
+class BackendConfigError(Exception):
+    """Custom exception for an invalid backend list."""
+
+
+def parse_backends(text: str) -> list[tuple[str, int, str]]:
+    """
+    Parse a comma separated backend list, e.g. "gpu2:11434/qwen3:30b, cpu:11434/qwen3:4b".
+    :return: List of (host, port, model) tuples.
+    """
+    backends = []
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        address, slash, model = item.partition("/")
+        host, colon, port = address.rpartition(":")
+        if not slash or not colon or not host or not model.strip():
+            raise BackendConfigError(f"Invalid backend '{item}', expected host:port/model")
+        try:
+            backends.append((host, int(port), model.strip()))
+        except ValueError as e:
+            raise BackendConfigError(f"Invalid port in backend '{item}'") from e
+    return backends
+
+
+class _Backend:
+    """Routing state of a single backend."""
+    __slots__ = ("client", "healthy", "model_loaded", "latency", "in_flight",
+                 "requests", "failures")
+
+    def __init__(self, client: OllamaClient):
+        self.client = client
+        self.healthy = True
+        self.model_loaded = False
+        self.latency = None  # EWMA of the observed latencies in milliseconds
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+
+    def observe(self, latency: float) -> None:
+        """Add a latency observation in milliseconds."""
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = _EWMA_ALPHA * latency + (1 - _EWMA_ALPHA) * self.latency
+
+    def score(self) -> float:
+        """Return the expected cost of a request, lower is better."""
+        score = (self.latency or 0) * (1 + self.in_flight)
+        if not self.model_loaded:
+            score += _NOT_LOADED_PENALTY
+        if not self.healthy:
+            score += _UNHEALTHY_PENALTY
+        return score
+
+
+class OllamaBackendPool:
+    """
+    Routes the requests to a set of Ollama backends, each with its own model.
+
+    The backends are probed periodically through /api/ps, which is cheap and
+    tells whether the model is loaded. A request goes to the backend with the
+    lowest expected latency, based on the observed latencies, the requests in
+    flight and whether the model is loaded. A failed request is retried on the
+    next best backend. Provides the same interface as a single OllamaClient.
+    """
+    def __init__(self, clients: list[OllamaClient],
+                 probe_interval: float = _DEFAULT_PROBE_INTERVAL,
+                 failover_timeout: float = _DEFAULT_FAILOVER_TIMEOUT):
+        """
+        Initialize the pool.
+
+        :param clients: The clients of the backends, the first one is the primary.
+        :param probe_interval: Seconds between the health probes.
+        :param failover_timeout: Timeout in seconds for a classification attempt when
+               there are other backends left to try, so a stalled backend is given
+               up quickly.
+        """
+        if not clients:
+            raise BackendConfigError("At least one Ollama backend is required")
+        self._backends = [_Backend(client) for client in clients]
+        self.probe_interval = probe_interval
+        self.failover_timeout = failover_timeout
+        self.failovers = 0
+
+    @property
+    def model(self) -> str:
+        """Return the model of the primary backend."""
+        return self._backends[0].client.model
+
+    @property
+    def clients(self) -> list[OllamaClient]:
+        """Return the clients of all the backends."""
+        return [backend.client for backend in self._backends]
+
+    @property
+    def ready(self) -> bool:
+        """Return True once the model of any backend is known to be loaded."""
+        return any(backend.client.ready for backend in self._backends)
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Wait until the model of any backend is loaded."""
+        if self.ready:
+            return True
+        waits = [asyncio.ensure_future(backend.client.wait_ready(timeout))
+                 for backend in self._backends]
+        try:
+            for wait in asyncio.as_completed(waits):
+                if await wait:
+                    return True
+            return False
+        finally:
+            for wait in waits:
+                wait.cancel()
+
+    async def check_model(self) -> None:
+        """
+        Check that the backends are reachable and have their models. The failing
+        backends are marked unhealthy, raises OllamaClientError if all of them fail.
+        """
+        results = await asyncio.gather(*(backend.client.check_model()
+                                         for backend in self._backends),
+                                       return_exceptions=True)
+        for backend, result in zip(self._backends, results):
+            backend.healthy = not isinstance(result, Exception)
+            if isinstance(result, Exception):
+                _LOGGER.warning("Ollama backend %s is not available: %s",
+                                backend.client.base_url, result)
+        if not any(backend.healthy for backend in self._backends):
+            raise OllamaClientError(f"None of the Ollama backends are available: {results[0]}")
+
+    async def warm_up(self) -> None:
+        """Load the models of all the healthy backends."""
+        await asyncio.gather(*(backend.client.warm_up() for backend in self._backends
+                               if backend.healthy))
+        await self.probe()
+
+    async def close(self) -> None:
+        """Close the clients."""
+        await asyncio.gather(*(backend.client.close() for backend in self._backends))
+
+    async def probe(self) -> None:
+        """Probe all the backends and update their health and loaded state."""
+        await asyncio.gather(*(self._probe(backend) for backend in self._backends))
+
+    async def _probe(self, backend: _Backend) -> None:
+        """Probe a backend through /api/ps."""
+        client = backend.client
+        start = time.perf_counter()
+        try:
+            loaded = await client.loaded_models()
+        except OllamaClientError as e:
+            if backend.healthy:
+                _LOGGER.warning("Ollama backend %s failed the health probe: %s",
+                                client.base_url, e)
+            backend.healthy = False
+            return
+        if not backend.healthy:
+            _LOGGER.info("Ollama backend %s is available again", client.base_url)
+        backend.healthy = True
+        backend.model_loaded = client.model in loaded or f"{client.model}:latest" in loaded
+        if backend.latency is None:
+            # Nothing better known yet, start from the round trip time
+            backend.observe((time.perf_counter() - start) * 1000)
+
+    @callback
+    def async_start_probing(self, hass: HomeAssistant) -> Callable[[], None]:
+        """Start the periodic health probes, returns a function stopping them."""
+        async def _async_probe(_now) -> None:
+            await self.probe()
+
+        return async_track_time_interval(hass, _async_probe,
+                                         timedelta(seconds=self.probe_interval))
+
+    def _ranked(self) -> list[_Backend]:
+        """Return the backends in the order of preference."""
+        return sorted(self._backends, key=_Backend.score)
+
+    async def send_request(self, prompt: str, timeout: float | None = None, **kwargs) -> str:
+        """
+        Send the request to the best backend, retrying on the next ones on failure.
+        The model of the backend that answered is set in the stats dict, if given.
+
+        :param prompt: The prompt to send.
+        :param timeout: Optional timeout for the attempts. The earlier attempts of a
+               classification are limited to the failover timeout.
+        :param kwargs: The other arguments for the client's send_request.
+        """
+        # The classifications stop early, follow a schema or are capped, so they
+        # are short and a slow answer means a stalled backend. The free form
+        # replies may take longer and get the whole timeout.
+        bounded = any(kwargs.get(name) is not None
+                      for name in ("stop_when", "fmt", "num_predict"))
+        backends = self._ranked()
+        error = None
+        for index, backend in enumerate(backends):
+            last = index == len(backends) - 1
+            backend.in_flight += 1
+            backend.requests += 1
+            attempt_timeout = timeout
+            if bounded and not last:
+                attempt_timeout = min(timeout or self.failover_timeout, self.failover_timeout)
+            start = time.perf_counter()
+            try:
+                response = await backend.client.send_request(prompt, timeout=attempt_timeout,
+                                                             **kwargs)
+            except OllamaClientError as e:
+                backend.failures += 1
+                backend.healthy = False
+                error = e
+                if not last:
+                    self.failovers += 1
+                    _LOGGER.warning("Ollama backend %s failed, retrying on %s",
+                                    backend.client.base_url,
+                                    backends[index + 1].client.base_url)
+                continue
+            finally:
+                backend.in_flight -= 1
+            backend.healthy = True
+            backend.model_loaded = True
+            backend.observe((time.perf_counter() - start) * 1000)
+            if kwargs.get("stats") is not None:
+                kwargs["stats"]["model"] = backend.client.model
+            return response
+        raise error
+
+    async def embed(self, texts: list[str], model: str, **kwargs) -> list[list[float]]:
+        """
+        Return the embeddings from the best backend, retrying on the next ones on failure.
+
+        :param texts: The texts to embed.
+        :param model: The embedding model.
+        :param kwargs: The other arguments for the client's embed.
+        """
+        error = None
+        for backend in self._ranked():
+            try:
+                return await backend.client.embed(texts, model, **kwargs)
+            except OllamaClientError as e:
+                error = e
+        raise error
+
+    async def stream_request(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """
+        Stream the response from the best backend. A backend failing before the
+        first text is given up for the next one, later failures are raised.
+
+        :param prompt: The prompt to send.
+        :param kwargs: The other arguments for the client's stream_request.
+        """
+        backends = self._ranked()
+        for index, backend in enumerate(backends):
+            last = index == len(backends) - 1
+            backend.in_flight += 1
+            backend.requests += 1
+            started = False
+            start = time.perf_counter()
+            try:
+                async for text in backend.client.stream_request(prompt, **kwargs):
+                    if not started:
+                        started = True
+                        backend.observe((time.perf_counter() - start) * 1000)
+                    yield text
+            except OllamaClientError:
+                backend.failures += 1
+                backend.healthy = False
+                if started or last:
+                    raise
+                self.failovers += 1
+                _LOGGER.warning("Ollama backend %s failed, retrying on %s",
+                                backend.client.base_url, backends[index + 1].client.base_url)
+                continue
+            finally:
+                backend.in_flight -= 1
+            backend.healthy = True
+            backend.model_loaded = True
+            return
+
+    def stats(self) -> dict:
+        """Return the routing state of the backends."""
+        return {
+            "failovers": self.failovers,
+            "backends": [{
+                "url": backend.client.base_url,
+                "model": backend.client.model,
+                "healthy": backend.healthy,
+                "model_loaded": backend.model_loaded,
+                "latency_ms": None if backend.latency is None else round(backend.latency, 1),
+                "in_flight": backend.in_flight,
+                "requests": backend.requests,
+                "failures": backend.failures,
+            } for backend in self._backends],
+        }
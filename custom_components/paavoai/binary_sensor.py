@@ -0,0 +1,54 @@
+""" Ollama availability sensor for the Paavo AI integration."""
+
+from homeassistant.components.binary_sensor import (
+    BinarySensorDeviceClass,
+    BinarySensorEntity,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.device_registry import DeviceInfo
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+DOMAIN = "paavoai"
+
+
+async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry,
+                            async_add_entities: AddEntitiesCallback) -> None:
+    """Set up the circuit breaker sensor for a config entry."""
+    circuit_breaker = hass.data[DOMAIN][entry.entry_id]["circuit_breaker"]
+    async_add_entities([PaavoAICircuitBreakerSensor(entry, circuit_breaker)])
+
+
+class PaavoAICircuitBreakerSensor(BinarySensorEntity):
+    """
+    On while the Ollama circuit breaker is open or half-open, i.e. the commands
+    needing the LLM fail fast. The breaker state and counters are given as attributes.
+    """
+    _attr_has_entity_name = True
+    _attr_device_class = BinarySensorDeviceClass.PROBLEM
+    _attr_should_poll = False
+    _attr_name = "Ollama circuit breaker"
+
+    def __init__(self, entry: ConfigEntry, circuit_breaker):
+        self._circuit_breaker = circuit_breaker
+        self._attr_unique_id = f"{entry.entry_id}_circuit_breaker"
+        self._attr_device_info = DeviceInfo(identifiers={(DOMAIN, entry.entry_id)},
+                                            name=entry.title)
+
+    async def async_added_to_hass(self) -> None:
+        """Follow the breaker state changes."""
+        self.async_on_remove(self._circuit_breaker.add_listener(self._state_changed))
+
+    @callback
+    def _state_changed(self) -> None:
+        self.async_write_ha_state()
+
+    @property
+    def is_on(self) -> bool:
+        """Return True while the requests fail fast."""
+        return self._circuit_breaker.is_open
+
+    @property
+    def extra_state_attributes(self) -> dict:
+        """Return the breaker state and counters."""
+        return self._circuit_breaker.stats()
@@ -0,0 +1,119 @@
+""" Cache for the classification results of the conversation agent """
+
+import logging
+import time
+from collections import OrderedDict
+
+from .fast_path import normalize_utterance
+
+_LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_MAX_ENTRIES = 256
+_DEFAULT_TTL = 3600  # Seconds
+
+
+class ClassificationCache:
+    """
+    Bounded LRU cache with a time-to-live for the topic and action decisions.
+
+    The entries are keyed by the normalized utterance, the prompt version and the
+    model name, so changing the prompts or the model never returns stale decisions.
+    """
+    def __init__(self, paavoai_config: dict, model: str, prompt_version: str):
+        """
+        Initialize the cache.
+
+        :param paavoai_config: The loaded paavoai.toml configuration.
+        :param model: The name of the model used for the classification.
+        :param prompt_version: Version (hash) of the classification prompts.
+        """
+        self.model = model
+        self.prompt_version = prompt_version
+
+        self._entries = OrderedDict()  # Key -> (expiry time, decision dict)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.configure(paavoai_config)
+
+    def configure(self, paavoai_config: dict) -> None:
+        """Apply the [cache] section of a (re)loaded paavoai.toml."""
+        cfg = paavoai_config.get("cache", {})
+        self.enabled = cfg.get("enabled", True)
+        self.max_entries = cfg.get("max_entries", _DEFAULT_MAX_ENTRIES)
+        self.ttl = cfg.get("ttl", _DEFAULT_TTL)
+        if not self.enabled:
+            self._entries.clear()
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop the least recently used entries over max_entries."""
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _key(self, utterance: str) -> tuple:
+        """Return the cache key for the utterance."""
+        return (normalize_utterance(utterance), self.prompt_version, self.model)
+
+    def get(self, utterance: str) -> dict | None:
+        """
+        Get the cached decision for the utterance.
+        :param utterance: The user's utterance.
+        :return: A copy of the decision dictionary or None if not cached.
+        """
+        if not self.enabled:
+            return None
+
+        key = self._key(utterance)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        _LOGGER.debug("Classification cache hit for '%s': %s", key[0], entry[1])
+        return dict(entry[1])
+
+    def put(self, utterance: str, **decision) -> None:
+        """
+        Store (or update) the decision fields for the utterance.
+        :param utterance: The user's utterance.
+        :param decision: The decision fields, e.g. topic and action.
+        """
+        if not self.enabled:
+            return
+
+        key = self._key(utterance)
+        entry = self._entries.pop(key, None)
+        stored = entry[1] if entry is not None and entry[0] >= time.monotonic() else {}
+        stored.update(decision)
+        self._entries[key] = (time.monotonic() + self.ttl, stored)
+        self._evict()
+
+    def invalidate(self, model: str | None = None, prompt_version: str | None = None) -> None:
+        """Drop all the entries, e.g. after the prompts or the model have changed."""
+        if model is not None:
+            self.model = model
+        if prompt_version is not None:
+            self.prompt_version = prompt_version
+        self._entries.clear()
+        _LOGGER.debug("Classification cache invalidated (model %s, prompt version %s)",
+                      self.model, self.prompt_version)
+
+    def stats(self) -> dict:
+        """Return the cache counters."""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "model": self.model,
+            "prompt_version": self.prompt_version,
+        }
@@ -0,0 +1,192 @@
+""" Circuit breaker for the Ollama requests """
+
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable
+
+from .ollama_client import OllamaClientError, OllamaServerError
+
+_LOGGER = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"        # Requests go through
+STATE_OPEN = "open"            # Requests fail immediately
+STATE_HALF_OPEN = "half_open"  # A single probe request goes through
+
+_DEFAULT_THRESHOLD = 3         # Consecutive failures opening the circuit
+_DEFAULT_OPEN_SECONDS = 30     # Seconds the circuit stays open before a probe
+
+
+class OllamaCircuitOpen(OllamaClientError):
+    """Raised without contacting the server while the circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Fails the requests fast while the Ollama server is down.
+
+    The circuit opens after 'threshold' consecutive requests failing on the
+    server: unreachable, timed out or a 5xx status. The other errors, e.g. an
+    invalid response, show the server is up and don't count. While open, the
+    requests raise OllamaCircuitOpen immediately. After 'open_seconds' the
+    circuit is half-open: a single request is let through as a probe while the
+    others still fail fast. The circuit closes if the probe succeeds and opens
+    again if it fails. Provides the same interface as the client.
+    """
+    def __init__(self, client, threshold: int = _DEFAULT_THRESHOLD,
+                 open_seconds: float = _DEFAULT_OPEN_SECONDS):
+        """
+        Initialize the breaker.
+
+        :param client: The client (or backend pool) the requests are sent with.
+        :param threshold: Consecutive failures opening the circuit.
+        :param open_seconds: Seconds the circuit stays open before a probe.
+        """
+        self._client = client
+        self.threshold = max(threshold, 1)
+        self.open_seconds = open_seconds
+        self.state = STATE_CLOSED
+        self.failures = 0      # Consecutive failures
+        self.opened = 0        # Times the circuit has opened
+        self.fast_failed = 0   # Requests failed without contacting the server
+        self._opened_at = 0.0
+        self._probing = False
+        self._listeners = []
+
+    @property
+    def model(self) -> str:
+        """Return the model of the client."""
+        return self._client.model
+
+    @property
+    def is_open(self) -> bool:
+        """Return True if the requests are currently failing fast."""
+        return self.state != STATE_CLOSED
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Wait until the client's model is loaded, not at all while the circuit is open."""
+        if self.is_open:
+            # Don't hold the command back, the request fails fast anyway
+            return True
+        return await self._client.wait_ready(timeout)
+
+    def stats(self) -> dict:
+        """Return the breaker state and counters."""
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "fast_failed": self.fast_failed,
+        }
+
+    def add_listener(self, listener: Callable[[], None]) -> Callable[[], None]:
+        """Add a callback called on the state changes, returns a function removing it."""
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+    def _set_state(self, state: str) -> None:
+        """Change the state and notify the listeners."""
+        if state == self.state:
+            return
+        _LOGGER.warning("Ollama circuit breaker %s -> %s", self.state, state)
+        self.state = state
+        for listener in list(self._listeners):
+            listener()
+
+    def _allow(self) -> bool:
+        """Return True if a request may be sent now, moving to half-open when it is time."""
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_OPEN and \
+           time.monotonic() - self._opened_at >= self.open_seconds:
+            self._set_state(STATE_HALF_OPEN)
+        if self.state == STATE_HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def _record_success(self) -> None:
+        self.failures = 0
+        self._set_state(STATE_CLOSED)
+
+    def _record_failure(self) -> None:
+        self.failures += 1
+        if self.state == STATE_HALF_OPEN or self.failures >= self.threshold:
+            self._opened_at = time.monotonic()
+            if self.state != STATE_OPEN:
+                self.opened += 1
+            self._set_state(STATE_OPEN)
+
+    def _check(self) -> bool:
+        """Raise OllamaCircuitOpen if the request can't be sent, return True for a probe."""
+        if not self._allow():
+            self.fast_failed += 1
+            raise OllamaCircuitOpen("The Ollama server is not available, failing fast")
+        return self.state == STATE_HALF_OPEN
+
+    async def stream_request(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """
+        Stream the response unless the circuit is open.
+
+        :param prompt: The prompt to send.
+        :param kwargs: The other arguments for the client's stream_request.
+        """
+        probe = self._check()
+        completed = False
+        try:
+            async for text in self._client.stream_request(prompt, **kwargs):
+                yield text
+            completed = True
+        except OllamaServerError:
+            self._record_failure()
+            raise
+        except OllamaClientError:
+            # The server answered
+            completed = True
+            raise
+        finally:
+            if completed:
+                self._record_success()
+            if probe:
+                self._probing = False
+
+    async def embed(self, texts: list[str], model: str, **kwargs) -> list[list[float]]:
+        """
+        Return the embeddings unless the circuit is open. The embedding model is
+        not the generation model, so the result doesn't change the circuit state.
+
+        :param texts: The texts to embed.
+        :param model: The embedding model.
+        :param kwargs: The other arguments for the client's embed.
+        """
+        if self.is_open:
+            self.fast_failed += 1
+            raise OllamaCircuitOpen("The Ollama server is not available, failing fast")
+        return await self._client.embed(texts, model, **kwargs)
+
+    async def send_request(self, prompt: str, **kwargs) -> str:
+        """
+        Send the request unless the circuit is open.
+
+        :param prompt: The prompt to send.
+        :param kwargs: The other arguments for the client's send_request.
+        """
+        probe = self._check()
+        try:
+            response = await self._client.send_request(prompt, **kwargs)
+        except asyncio.CancelledError:
+            # Says nothing about the server, let the next request probe
+            raise
+        except OllamaServerError:
+            self._record_failure()
+            raise
+        except OllamaClientError:
+            # The server answered
+            self._record_success()
+            raise
+        else:
+            self._record_success()
+            return response
+        finally:
+            if probe:
+                self._probing = False
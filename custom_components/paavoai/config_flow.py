@@ -5,6 +5,8 @@ import voluptuous as vol
 
 from homeassistant import config_entries
 
+from .backend_pool import BackendConfigError, parse_backends
+
 # It's better to test the connection in async_setup_entry
 # as config_flow should ideally not perform long I/O operations directly
 # without careful handling (e.g. async_add_executor_job for sync client parts)
@@ -19,6 +21,13 @@ class PaavoaiConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     async def async_step_user(self, user_input=None):
         errors = {}
         if user_input is not None:
+            try:
+                parse_backends(user_input.get("additional_backends", ""))
+            except BackendConfigError as e:
+                _LOGGER.debug("Invalid additional backends: %s", e)
+                errors["additional_backends"] = "invalid_backends"
+
+        if user_input is not None and not errors:
             # Create a unique ID, e.g., based on host and port
             # This helps HA identify if this exact configuration already exists.
             unique_id = f"{user_input['host']}/{user_input['port']}/{user_input['model']}"
@@ -40,6 +49,8 @@ class PaavoaiConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             vol.Required("host", default="localhost"): str,  # type: ignore[assignment]
             vol.Required("port", default=11434): int,        # type: ignore[assignment]
             vol.Required("model", default="qwen3:30b"): str, # type: ignore[assignment]
+            # Other servers as "host:port/model, host:port/model", e.g. a CPU fallback
+            vol.Optional("additional_backends", default=""): str, # type: ignore[assignment]
         })
 
         return self.async_show_form(step_id="user", data_schema=data_schema, errors=errors)
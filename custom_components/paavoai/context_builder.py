@@ -0,0 +1,107 @@
+""" Token-budgeted conversation context with a rolling summary """
+
+import logging
+from typing import Awaitable, Callable
+
+from .history import ConversationHistoryStore
+
+_LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_CHARS_PER_TOKEN = 3.0  # Finnish takes more tokens per character than English
+_DEFAULT_BUDGET = 300           # Tokens of history for the prompts without a budget
+_DEFAULT_KEEP_ENTRIES = 4       # Latest entries never folded into the summary
+_DEFAULT_FOLD_ENTRIES = 4       # Older entries needed before they are summarized, folding
+                                # in larger steps keeps the prompt prefix stable longer
+
+
+class ContextBuilder:
+    """
+    Renders the conversation history for the prompts within a token budget per
+    prompt.
+
+    The latest entries are included as they are, the older ones are folded into
+    a rolling summary. The summary is generated in the background after the
+    reply has been sent, so it never delays a command. Between the summaries
+    the rendered history only grows at the end, so the prompt prefix stays byte
+    for byte the same and Ollama can reuse its prompt cache.
+    """
+    def __init__(self, history: ConversationHistoryStore, config: dict | None = None,
+                 summarize: Callable[[str, str], Awaitable[str]] | None = None):
+        """
+        Initialize the builder.
+
+        :param history: The conversation history store.
+        :param config: The [context] section of paavoai.toml.
+        :param summarize: Coroutine function generating the new summary from the
+               previous summary and the entries to fold, None disables the summary.
+        """
+        self.history = history
+        self.summarize = summarize
+        # The entries past max_entries are kept until they are in the summary
+        history.keep_unsummarized = summarize is not None
+        self.configure(config)
+        self._summarizing = set()  # Conversations being summarized
+        self.summaries = 0
+        self.summary_failures = 0
+
+    def configure(self, config: dict | None) -> None:
+        """Apply the [context] section of a (re)loaded paavoai.toml."""
+        config = config or {}
+        self.chars_per_token = config.get("chars_per_token", _DEFAULT_CHARS_PER_TOKEN)
+        self.default_budget = config.get("default_budget", _DEFAULT_BUDGET)
+        self.budgets = config.get("budgets", {})  # Prompt name -> tokens
+        self.keep_entries = max(config.get("keep_entries", _DEFAULT_KEEP_ENTRIES), 1)
+        self.fold_entries = max(config.get("fold_entries", _DEFAULT_FOLD_ENTRIES), 1)
+
+    def budget(self, prompt_name: str) -> int:
+        """Return the history token budget of the prompt."""
+        return self.budgets.get(prompt_name, self.default_budget)
+
+    def render(self, conversation_id: str, prompt_name: str) -> str:
+        """
+        Return the conversation history for the prompt.
+        :param conversation_id: The conversation.
+        :param prompt_name: The prompt the history is for, selects the budget.
+        """
+        max_chars = int(self.budget(prompt_name) * self.chars_per_token)
+        return self.history.render(conversation_id, max_chars)
+
+    def needs_summary(self, conversation_id: str) -> bool:
+        """Return True if there are enough older entries to fold into the summary."""
+        return self.summarize is not None and \
+            conversation_id not in self._summarizing and \
+            len(self.history.unsummarized(conversation_id, self.keep_entries)) >= \
+            self.fold_entries
+
+    async def async_update_summary(self, conversation_id: str) -> None:
+        """Fold the older entries into the summary, call after the reply is sent."""
+        if not self.needs_summary(conversation_id):
+            return
+        entries = self.history.unsummarized(conversation_id, self.keep_entries)
+        self._summarizing.add(conversation_id)
+        try:
+            summary = await self.summarize(self.history.summary(conversation_id),
+                                           "".join(entry.line for entry in entries))
+        except Exception as e: # pylint: disable=broad-except
+            # The store keeps the entries (up to twice max_entries), so they are
+            # summarized with the next ones; meanwhile the budget keeps the
+            # prompts short
+            self.summary_failures += 1
+            _LOGGER.warning("Failed to summarize conversation %s: %s", conversation_id, e)
+            return
+        finally:
+            self._summarizing.discard(conversation_id)
+
+        summary = " ".join(summary.split())
+        self.history.set_summary(conversation_id, summary, entries[-1].seq)
+        self.summaries += 1
+        _LOGGER.debug("Conversation %s summarized up to entry %d: %s",
+                      conversation_id, entries[-1].seq, summary)
+
+    def stats(self) -> dict:
+        """Return the summary counters."""
+        return {
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+            "summarizing": len(self._summarizing),
+        }
@@ -1,30 +1,113 @@
 """ Conversation agent for PaavoAI using Ollama."""
 
 
+import asyncio
+import dataclasses
+import json
 import logging
-import sys
-from datetime import datetime
-from collections import deque
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 from homeassistant.components.conversation import (
     AbstractConversationAgent,
     ConversationInput,
     ConversationResult,
 )
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.intent import IntentResponse
 from homeassistant.core import HomeAssistant
-
+from homeassistant.util.ulid import ulid_now
+
+from .cache import ClassificationCache
+from .circuit_breaker import OllamaCircuitOpen
+from .context_builder import ContextBuilder
+from .entity_index import EntityIndex
+from .fast_path import FastPathMatcher
+from .history import ConversationHistoryStore
+from .intent_router import GROUP_TOPICS, IntentRouter
+from .light_controller import LIGHT_ACTIONS, LightController
+from .metrics import PaavoAIMetrics
+from .ollama_client import OllamaClientError, OllamaServerError
+from .prompts import PromptRegistry
+from .scheduler import PRIORITY_BACKGROUND, PRIORITY_ERROR, PRIORITY_LIVE, PRIORITY_REPLY
 from .music_player import MusicPlayer
-
-logging.basicConfig(
-    level=logging.DEBUG,  # or INFO
-    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
-    stream=sys.stdout
-)
+from .playlist_catalog import PlaylistCatalog
+from .replies import ReplyTemplates
+from .response_parser import ResponseParseError, ResponseParser
+from .streaming import sentence_chunks
+from .trace_recorder import TraceRecorder, trace_event
+
+try:  # Streaming conversation output, Home Assistant 2025.5 and later
+    from homeassistant.components.conversation import (
+        AssistantContent,
+        ChatLog,
+        ConversationEntity,
+    )
+    STREAMING_SUPPORTED = hasattr(ConversationEntity, "_attr_supports_streaming")
+except ImportError:
+    AssistantContent = ChatLog = None
+    STREAMING_SUPPORTED = False
 
 _DOMAIN = "paavoai"
 _LOGGER = logging.getLogger(__name__)
-_MAX_HISTORY_LENGTH = 10  # Static max history length
+
+_TOPICS = ["lights", "music", "sensor"]
+_MUSIC_ACTIONS = ["play", "stop", "pause", "resume", "next", "prev", "info"]
+
+_PARAMETRIZED_ACTIONS = ("load", "message")
+
+# Complete answer lines that end a classification, used to stop the generation early.
+# Markdown around the key and the answer is allowed, the parser removes it.
+_TOPIC_LINE_RE = re.compile(
+    rf"^[\s*_`#>-]*topic[\s*_`]*[:=][\s*_`]*({'|'.join(_TOPICS)})[\s*_`.]*$",
+    re.IGNORECASE | re.MULTILINE)
+_ACTION_LINE_RE = re.compile(
+    rf"^[\s*_`#>-]*action[\s*_`]*[:=][\s*_`]*"
+    rf"({'|'.join(_MUSIC_ACTIONS)}|(load|message) .+?)[\s*_`.]*$",
+    re.IGNORECASE | re.MULTILINE)
+
+# JSON schema for the single-call structured classification
+_CLASSIFY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "topic": {"type": "string", "enum": _TOPICS},
+        "action": {"type": "string",
+                   "enum": _MUSIC_ACTIONS + list(_PARAMETRIZED_ACTIONS) + ["none"]},
+        "parameter": {"type": "string"},
+        "reply": {"type": "string"},
+    },
+    "required": ["topic", "action", "parameter", "reply"],
+}
+
+
+def _lights_schema(area_names: list[str]) -> dict:
+    """Return the JSON schema of the light decision, limited to the known areas."""
+    return {
+        "type": "object",
+        "properties": {
+            "action": {"type": "string", "enum": LIGHT_ACTIONS},
+            "areas": {"type": "array", "items": {"type": "string",
+                                                 "enum": area_names + ["all"]}},
+            "brightness": {"type": "integer", "minimum": 0, "maximum": 100},
+            "color": {"type": "string"},
+        },
+        "required": ["action", "areas"],
+    }
+
+
+def _topic_line_complete(text: str) -> bool:
+    """Return True once a valid 'topic:' line has been received."""
+    return _TOPIC_LINE_RE.search(text) is not None
+
+
+def _action_line_complete(text: str) -> bool:
+    """Return True once a valid 'action:' line has been received."""
+    return _ACTION_LINE_RE.search(text) is not None
 
 
 class PaavoAIError(Exception):
@@ -34,24 +117,120 @@ class PaavoAIError(Exception):
         self.ollama_broken= ollama_broken
 
 
+# The chat log of the command in process, when the reply can be streamed
+_REPLY_STREAM: ContextVar["_ReplyStream | None"] = ContextVar("paavoai_reply_stream",
+                                                              default=None)
+# The models of the failover backends that answered the command in process
+_FALLBACK_MODELS: ContextVar["set[str] | None"] = ContextVar("paavoai_fallback_models",
+                                                             default=None)
+
+
+async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry,
+                            async_add_entities: AddEntitiesCallback) -> None:
+    """Set up the streaming conversation entity, used instead of the legacy agent."""
+    # Only imported on the Home Assistant versions supporting it
+    from .conversation_entity import PaavoAIConversationEntity  # pylint: disable=import-outside-toplevel
+    agent = hass.data[_DOMAIN][entry.entry_id]["agent"]
+    async_add_entities([PaavoAIConversationEntity(entry, agent)])
+
+
+class _ReplyStream:
+    """Where the reply of the command in process is streamed to."""
+    __slots__ = ("chat_log", "agent_id", "streamed")
+
+    def __init__(self, chat_log, agent_id: str):
+        self.chat_log = chat_log
+        self.agent_id = agent_id
+        self.streamed = False  # The reply has been added to the chat log
+
+
+class _Speculation:
+    """An action classification started before the topic is known."""
+    __slots__ = ("topic", "task", "stats")
+
+    def __init__(self, topic: str, task: asyncio.Task, stats: dict):
+        self.topic = topic
+        self.task = task
+        self.stats = stats  # Generated tokens, updated while streaming
+
+
 class PaavoAIConversationAgent(AbstractConversationAgent):
     """ PaavoAI conversation agent using Ollama for processing user input."""
 
-    def __init__(self, hass: HomeAssistant, hass_data: dict, ollama_client, paavoai_config: dict):
+    def __init__(self, hass: HomeAssistant, hass_data: dict, ollama_client,
+                 prompts: PromptRegistry, metrics: PaavoAIMetrics | None = None):
         """ Initialize the PaavoAI conversation agent."""
         self._hass = hass
         self._hass_data = hass_data
         self._ollama = ollama_client
-        self._cfg = paavoai_config
-
-        # Single history for the discussion
-        self._history = deque(maxlen=_MAX_HISTORY_LENGTH)
-        # TODO: Don't hardcode the media player entity ID
-        media_player_entity_id = self._hass_data.get("media_player_entity_id",
-                                                      "media_player.shieldi")
+        self._prompts = prompts
+        self._processing = {}  # Conversation id -> number of commands in process
+        self._topic_counts = Counter()  # Prior for the speculative classification
+        self.speculation = {"started": 0, "hits": 0, "misses": 0, "wasted_tokens": 0}
+        self.metrics = metrics if metrics is not None else PaavoAIMetrics()
+
+        # Separate history for each conversation
+        self._history = ConversationHistoryStore()
+        self._history.configure(self._cfg.get("history"))
+        # The history is rendered within a token budget per prompt, the older
+        # entries are folded into a summary in the background
+        self.context = ContextBuilder(self._history, self._cfg.get("context"),
+                                      self.summarize_history)
+        music_cfg = self._cfg.get("music", {})
+        media_player_entity_ids = music_cfg.get("entity_ids") or \
+            self._hass_data.get("media_player_entity_id", "media_player.shieldi")
         default_playlist = self._hass_data.get("default_playlist_id", "")
-        self.music_player = MusicPlayer(self._hass, media_player_entity_id, default_playlist)
+        self.music_player = MusicPlayer(self._hass, media_player_entity_ids, default_playlist,
+                                        PlaylistCatalog(self._hass, music_cfg),
+                                        blocking=music_cfg.get("blocking", True),
+                                        confirm_timeout=music_cfg.get("confirm_timeout", 5))
+        self.entity_index = EntityIndex(self._hass, self._cfg.get("sensor"))
+        self.light_controller = LightController(self._hass, self._cfg.get("lights"))
+        # Topics and music actions by embedding similarity, before the LLM
+        self.router = IntentRouter(self._hass, self._ollama, self._cfg.get("router"))
+        self.fast_path = FastPathMatcher(self._cfg)
+        self.replies = ReplyTemplates(self._cfg)
+        # Tolerant parsing of the classification answers, counted per prompt
+        self.parser = ResponseParser()
+        # The latest commands for debugging and replay
+        self.traces = TraceRecorder(self._cfg.get("trace"))
+        self.cache = ClassificationCache(self._cfg, self._ollama.model,
+                                         self._classification_prompt_version())
+        self._prompts.add_listener(self._config_reloaded)
 
+    @property
+    def _cfg(self) -> dict:
+        """The current paavoai.toml configuration."""
+        return self._prompts.config
+
+    def _config_reloaded(self) -> None:
+        """Apply a reloaded paavoai.toml."""
+        self.fast_path = FastPathMatcher(self._cfg)
+        self.replies = ReplyTemplates(self._cfg)
+        self.context.configure(self._cfg.get("context"))
+        self._history.configure(self._cfg.get("history"))
+        self.light_controller.configure(self._cfg.get("lights"))
+        self.entity_index.configure(self._cfg.get("sensor"))
+        self.cache.configure(self._cfg)
+        self.music_player.catalog.configure(self._cfg.get("music"))
+        self.router.configure(self._cfg.get("router"))
+        self.traces.configure(self._cfg.get("trace"))
+        prompt_version = self._classification_prompt_version()
+        if prompt_version != self.cache.prompt_version:
+            self.cache.invalidate(prompt_version=prompt_version)
+
+    def _classification_prompt_version(self) -> str:
+        """Return a hash of the prompts and settings the classification depends on."""
+        version = self._prompts.version("topic_get_prompt", "music_get_action_prompt",
+                                        "classify_prompt")
+        return f"{self._cfg['conversation'].get('classification', 'chain')}-{version}"
+
+    def _lights_prompt_version(self) -> str:
+        """
+        Return a hash of the lights prompt, stored with the cached light decisions.
+        Versioned separately, so editing it doesn't drop the topic and action decisions.
+        """
+        return self._prompts.version("lights_prompt")
 
     def raise_error(self, message: str, broken: bool=False, cause_exception=None):
         """Helper method to log error and raise PaavoAIError."""
@@ -76,150 +255,421 @@ class PaavoAIConversationAgent(AbstractConversationAgent):
             # "url": "URL_TO_OLLAMA_OR_YOUR_PROJECT" # Optional
         }
 
-    async def conversation_store(self, role: str, message: str) -> None:
-        """Store the conversation in the history."""
-        if len(self._history) >= _MAX_HISTORY_LENGTH:
-            self._history.popleft()
-        self._history.append({"role": role,
-                              "content": message,
-                              "timestamp": datetime.utcnow().isoformat()})
+    def history_stats(self) -> dict:
+        """Return the conversation history store counters."""
+        return self._history.stats()
 
-    async def conversation_get_str(self, length: int) -> str:
-        """Get the conversation history as a string."""
-        history = ""
+    async def conversation_store(self, conversation_id: str, role: str, message: str) -> None:
+        """Store the message in the history of the conversation."""
+        self._history.add(conversation_id, role, message)
 
-        if len(self._history) == 0:
+    async def conversation_get_str(self, conversation_id: str, prompt_name: str) -> str:
+        """Get the conversation history as a string, within the prompt's token budget."""
+        history = self.context.render(conversation_id, prompt_name)
+        if not history:
             # This can't happen as we always first add the user input
             return "Error: No conversation history available."
-
-        for entry in list(self._history)[-length:]:
-            role = entry["role"]
-            content = entry["content"]
-            timestamp = entry["timestamp"]
-            history += f"[{timestamp}] {role}: {content}\n"
         return history
 
-    async def music_get_actions(self) -> str:
+    async def summarize_history(self, summary: str, history: str) -> str:
+        """Return the previous summary updated with the older history entries."""
+        if "summary_prompt" not in self._prompts.versions():
+            raise PaavoAIError("'summary_prompt' is not configured")
+        prompt = self._prompts.render("summary_prompt", summary=summary or "(none)",
+                                      conversation_history=history)
+        # Not part of any command, runs when the server has nothing else to do
+        return await self.ollama_prompt(None, prompt, think=False,
+                                        priority=PRIORITY_BACKGROUND)
+
+    def speculation_stats(self) -> dict:
+        """Return the speculative action classification counters."""
+        finished = self.speculation["hits"] + self.speculation["misses"]
+        return dict(self.speculation,
+                    hit_rate=self.speculation["hits"] / finished if finished else None)
+
+    def _likely_topic(self, conversation_id: str) -> str | None:
+        """Return the likely topic: the previous one of the conversation or the most common."""
+        topic = self._history.last_topic(conversation_id)
+        if topic is None and self._topic_counts:
+            topic = self._topic_counts.most_common(1)[0][0]
+        return topic
+
+    def _start_speculation(self, conversation_id: str) -> _Speculation | None:
+        """
+        Start the action classification of the likely topic concurrently with the
+        topic classification, if enabled. Only useful with parallel server slots.
+        """
+        if not self._cfg['conversation'].get('speculative_action', False):
+            return None
+        topic = self._likely_topic(conversation_id)
+        if topic != "music":
+            # The only topic with an action classifier
+            return None
+        stats = {}
+        task = asyncio.ensure_future(self.music_get_actions(conversation_id, stats=stats))
+        self.speculation["started"] += 1
+        return _Speculation(topic, task, stats)
+
+    def _finish_speculation(self, speculation: _Speculation | None,
+                            topic: str | None) -> asyncio.Task | None:
+        """
+        Return the speculative classification task if it was for the right topic,
+        otherwise cancel it. The hit is counted when the task's result is used.
+        """
+        if speculation is None:
+            return None
+        if topic == speculation.topic:
+            return speculation.task
+        self._cancel_speculation(speculation, f"the topic is {topic}")
+        return None
+
+    def _cancel_speculation(self, speculation: _Speculation, reason: str) -> None:
+        """Cancel the speculative classification and count the tokens generated in vain."""
+        def _cancelled(task: asyncio.Task) -> None:
+            if not task.cancelled():
+                task.exception()  # Retrieved, an error doesn't matter anymore
+            self.speculation["wasted_tokens"] += speculation.stats.get("eval_count", 0)
+
+        self.speculation["misses"] += 1
+        speculation.task.add_done_callback(_cancelled)
+        speculation.task.cancel()
+        _LOGGER.debug("Speculative %s classification cancelled, %s", speculation.topic, reason)
+
+    def _playlist_values(self, prompt_name: str, conversation_id: str) -> dict:
+        """
+        Return the {playlists} placeholder value if the prompt has it: the names
+        of the playlists closest to the user's last message, so the model picks
+        a real name.
+        """
+        if "playlists" not in self._prompts.get(prompt_name).placeholders:
+            return {}
+        count = self._cfg.get("music", {}).get("playlist_prompt_candidates", 5)
+        entries = self._history.entries(conversation_id)
+        names = self.music_player.catalog.candidates(entries[-1].content, count) \
+            if entries else []
+        return {"playlists": ", ".join(names) or "(unknown)"}
+
+    async def music_get_actions(self, conversation_id: str, stats: dict | None = None) -> str:
         """Get the music actions."""
 
-        prompt = self._cfg['conversation']['music_get_action_prompt']
-        conversation_history = await self.conversation_get_str(4)
-        prompt = prompt.replace("{conversation_history}",conversation_history)
+        conversation_history = await self.conversation_get_str(conversation_id,
+                                                               "music_get_action_prompt")
+        prompt = self._prompts.render("music_get_action_prompt",
+                                      conversation_history=conversation_history,
+                                      **self._playlist_values("music_get_action_prompt",
+                                                              conversation_id))
 
         try:
-            response = await self.ollama_prompt(prompt)
+            response = await self.ollama_prompt(conversation_id, prompt,
+                                                self._early_stop(_action_line_complete),
+                                                stats=stats)
         except PaavoAIError as e:
             self.raise_error("Error while getting music actions from Ollama",
                              broken=True,
                              cause_exception=e)
 
-        response = response.strip().lower()
-        if ("reasoning:" not in response) or ("action:" not in response):
-            self.raise_error("Ollama response was not in specified format. " \
-                             f"Response: {response}")
-
-        # Extract the topic from the response
-        action = response.split("action:")[-1].strip()
-        action = action.split("\n")[0].strip()
-        # Check if the topic is valid
-        if action not in ["play", "stop", "pause", "resume", "next", "prev", "info"]:
-            # These takes extra parameters, so need to check separately
-            if not action.startswith("load ") and not action.startswith("message "):
-                self.raise_error(f"Invalid action '{action}' "
-                                 f"returned by Ollama. Response: {response}")
-
-        # Extract the reasoning
-        reasoning = response.split("reasoning:")[-1].strip()
-        reasoning = reasoning.split("\n")[0].strip()
-        # Log the reasoning
+        action, reasoning = await self._parse_answer(
+            conversation_id, "music_get_action_prompt", prompt, response, "action",
+            _MUSIC_ACTIONS, _PARAMETRIZED_ACTIONS, stats=stats)
         _LOGGER.debug("Ollama action '%s' with reasoning: %s", action, reasoning)
 
         return action
 
-    async def topic_get(self) -> str:
-        """Get the topic of the conversation."""
-        prompt = self._cfg['conversation']['topic_get_prompt']
-        conversation_history = await self.conversation_get_str(4)
-        prompt = prompt.replace("{conversation_history}", conversation_history)
+    async def lights_decide(self, conversation_id: str) -> dict:
+        """
+        Decide the light action with a single structured call.
+        :return: Dictionary with the 'action' ('on' or 'off'), the 'areas' and
+                 the optional 'brightness' (percent) and 'color'.
+        """
+        area_names = self.light_controller.area_names()
+        conversation_history = await self.conversation_get_str(conversation_id,
+                                                               "lights_prompt")
+        prompt = self._prompts.render("lights_prompt",
+                                      conversation_history=conversation_history,
+                                      areas=", ".join(area_names) or "(none)")
 
         try:
-            response = await self.ollama_prompt(prompt)
+            response = await self.ollama_prompt(conversation_id, prompt,
+                                                fmt=_lights_schema(area_names), think=False)
         except PaavoAIError as e:
-            self.raise_error("Error while getting topic from Ollama",
+            self.raise_error("Error while getting the light action from Ollama",
                              broken=True,
                              cause_exception=e)
 
-        response = response.strip().lower()
-        if ("reasoning:" not in response) or ("topic:" not in response):
-            self.raise_error(f"Ollama response was not in specified format. Response: {response}")
+        try:
+            decision = json.loads(response)
+            action = str(decision["action"]).strip().lower()
+            areas = [str(area).strip() for area in decision["areas"]]
+            brightness = decision.get("brightness")
+            brightness = int(brightness) if brightness is not None else None
+            color = str(decision.get("color") or "").strip().lower() or None
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.raise_error(f"Invalid light action JSON returned by Ollama: {response}",
+                             cause_exception=e)
+
+        if action not in LIGHT_ACTIONS:
+            self.raise_error(f"Invalid light action '{action}' "
+                             f"returned by Ollama. Response: {response}")
+        _LOGGER.debug("Ollama light action '%s' for %s", action, areas)
+        return {"action": action, "areas": areas, "brightness": brightness, "color": color}
 
-        # Extract the topic from the response
-        topic = response.split("topic:")[-1].strip()
-        topic = topic.split("\n")[0].strip()
-        if topic not in ["lights", "music", "sensor"]:
-            self.raise_error(f"Invalid topic '{topic}' returned by Ollama. Response: {response}")
+    async def topic_get(self, conversation_id: str, stats: dict | None = None) -> str:
+        """Get the topic of the conversation."""
+        conversation_history = await self.conversation_get_str(conversation_id,
+                                                               "topic_get_prompt")
+        prompt = self._prompts.render("topic_get_prompt",
+                                      conversation_history=conversation_history)
 
-        # Extract the reasoning
-        reasoning = response.split("reasoning:")[-1].strip()
-        reasoning = reasoning.split("\n")[0].strip()
-        # Log the reasoning
+        try:
+            response = await self.ollama_prompt(conversation_id, prompt,
+                                                self._early_stop(_topic_line_complete),
+                                                stats=stats)
+        except PaavoAIError as e:
+            self.raise_error("Error while getting topic from Ollama",
+                             broken=True,
+                             cause_exception=e)
+
+        topic, reasoning = await self._parse_answer(conversation_id, "topic_get_prompt",
+                                                    prompt, response, "topic", _TOPICS,
+                                                    stats=stats)
         _LOGGER.debug("Ollama topic '%s' with reasoning: %s", topic, reasoning)
 
         return topic
 
 
-    async def ollama_prompt(self, prompt: str) -> str:
-        """Send a prompt to the Ollama server and return the response."""
+    async def _parse_answer(self, conversation_id: str, prompt_name: str, prompt: str,
+                            response: str, key: str, labels: list[str],
+                            parametrized: tuple[str, ...] = (),
+                            stats: dict | None = None) -> tuple[str, str]:
+        """
+        Return the label and the reasoning of a classification answer. An answer
+        the tolerant parser can't repair is asked once more with the answer
+        constrained to the labels by a JSON schema and a few tokens, so a format
+        slip doesn't cost a full generation and an error reply. The tokens of the
+        retry are added to the stats dict, if given.
+        """
+        try:
+            return self.parser.parse(prompt_name, response, key, labels, parametrized)
+        except ResponseParseError as e:
+            if not self._cfg['conversation'].get('parse_retry', True):
+                self.parser.count(prompt_name, "failed")
+                self.raise_error("Ollama response was not in specified format.",
+                                 cause_exception=e)
+            _LOGGER.warning("Retrying the unparsable %s answer: %s", key, e)
+
+        self.parser.count(prompt_name, "retried")
+        properties = {key: {"type": "string", "enum": labels + list(parametrized)}}
+        if parametrized:
+            properties["parameter"] = {"type": "string"}
+        schema = {"type": "object", "properties": properties, "required": list(properties)}
+        # A 'message' parameter is a whole reply to the user, not a label or a name
+        if "message" in parametrized:
+            num_predict = self._cfg['conversation'].get('parse_retry_message_tokens', 256)
+        else:
+            num_predict = self._cfg['conversation'].get('parse_retry_tokens', 48)
+        retry_stats = {}
+        try:
+            retry = await self.ollama_prompt(conversation_id, prompt, fmt=schema, think=False,
+                                             stats=retry_stats, num_predict=num_predict)
+        except PaavoAIError as e:
+            self.parser.count(prompt_name, "failed")
+            self.raise_error(f"Error while retrying the {key} from Ollama",
+                             broken=True,
+                             cause_exception=e)
+        finally:
+            if stats is not None:
+                stats["eval_count"] = stats.get("eval_count", 0) + \
+                    retry_stats.get("eval_count", 0)
+
+        try:
+            answer = json.loads(retry)
+            label = str(answer[key]).strip().lower()
+            if label in parametrized:
+                parameter = str(answer.get("parameter", "")).strip()
+                label = f"{label} {parameter}" if parameter else ""
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.parser.count(prompt_name, "failed")
+            self.raise_error(f"Invalid {key} JSON returned by Ollama: {retry}",
+                             cause_exception=e)
+        if label not in labels and label.partition(" ")[0] not in parametrized:
+            self.parser.count(prompt_name, "failed")
+            self.raise_error(f"Invalid {key} '{label}' returned by Ollama. Response: {retry}")
+        return label, ""
+
+    async def classify(self, conversation_id: str) -> dict:
+        """
+        Classify the conversation with a single structured call.
+        :return: Dictionary with the 'topic', 'action' (including the parameter for
+                 'load' and 'message') and the spoken 'reply'.
+        """
+        conversation_history = await self.conversation_get_str(conversation_id,
+                                                               "classify_prompt")
+        prompt = self._prompts.render("classify_prompt",
+                                      conversation_history=conversation_history,
+                                      **self._playlist_values("classify_prompt",
+                                                              conversation_id))
+
+        try:
+            response = await self.ollama_prompt(conversation_id, prompt,
+                                                fmt=_CLASSIFY_SCHEMA, think=False)
+        except PaavoAIError as e:
+            self.raise_error("Error while getting classification from Ollama",
+                             broken=True,
+                             cause_exception=e)
+
+        try:
+            decision = json.loads(response)
+            topic = str(decision["topic"]).strip().lower()
+            action = str(decision["action"]).strip().lower()
+            parameter = str(decision.get("parameter", "")).strip()
+            reply = str(decision.get("reply", "")).strip()
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.raise_error(f"Invalid classification JSON returned by Ollama: {response}",
+                             cause_exception=e)
+
+        if topic not in _TOPICS:
+            self.raise_error(f"Invalid topic '{topic}' returned by Ollama. Response: {response}")
+        if topic == "music":
+            if action in ("load", "message"):
+                if not parameter:
+                    self.raise_error(f"Action '{action}' without a parameter returned by "
+                                     f"Ollama. Response: {response}")
+                action = f"{action} {parameter}"
+            elif action not in _MUSIC_ACTIONS:
+                self.raise_error(f"Invalid action '{action}' "
+                                 f"returned by Ollama. Response: {response}")
+
+        _LOGGER.debug("Ollama classification: topic '%s', action '%s', reply: %s",
+                      topic, action, reply)
+        return {"topic": topic, "action": action, "reply": reply}
+
+    def _early_stop(self, stop_when):
+        """Return the stop predicate if streaming with early termination is enabled."""
+        if self._cfg['conversation'].get('stream_early_stop', True):
+            return stop_when
+        return None
+
+    async def _wait_for_model(self) -> None:
+        """Wait for a while for the model to be loaded, then fail fast."""
+        model_wait = self._cfg.get('ollama', {}).get('model_wait', 20)
+        if not await self._ollama.wait_ready(model_wait):
+            self.raise_error(f"Model {self._ollama.model} not loaded after {model_wait} seconds",
+                             broken=True)
+
+    async def ollama_prompt(self, conversation_id: str, prompt: str, stop_when=None,
+                            fmt=None, think=None, priority: int = PRIORITY_LIVE,
+                            stats: dict | None = None, num_predict: int | None = None) -> str:
+        """
+        Send a prompt to the Ollama server and return the response.
+        If stop_when is given, the response is streamed and the generation
+        is stopped as soon as stop_when returns True for the received text.
+        The fmt and think are passed to the Ollama API as the output format
+        and the thinking mode. The request is queued with the given priority.
+        The stats dict, if given, is updated with the generated token count.
+        The num_predict limits the number of generated tokens.
+        """
+        await self._wait_for_model()
+
+        # The backend pool reports the model that answered
+        if stats is None:
+            stats = {}
         # Get the response from the Ollama server
+        start = time.perf_counter()
         try:
-            response = await self._hass.async_add_executor_job(self._ollama.send_request,
-                                                              prompt)
+            with self.metrics.span("ollama_request"):
+                response = await self._ollama.send_request(prompt, priority=priority,
+                                                           conversation_id=conversation_id,
+                                                           stop_when=stop_when,
+                                                           fmt=fmt, think=think, stats=stats,
+                                                           num_predict=num_predict)
         except Exception as e:  # pylint: disable=broad-except
+            trace_event("ollama", prompt=prompt, fmt=fmt, think=think, num_predict=num_predict,
+                        error=e, ms=round((time.perf_counter() - start) * 1000, 1))
             self.raise_error("Error while sending request to Ollama",
                 broken=True,
                 cause_exception=e
             )
 
+        trace_event("ollama", prompt=prompt, fmt=fmt, think=think, num_predict=num_predict,
+                    response=response, ms=round((time.perf_counter() - start) * 1000, 1))
+        fallback_models = _FALLBACK_MODELS.get()
+        if fallback_models is not None and stats.get("model", self._ollama.model) != \
+           self._ollama.model:
+            fallback_models.add(stats["model"])
         return response
 
+    def _cache_put(self, utterance: str, **decision) -> None:
+        """
+        Cache the decision, unless a failover backend with another model took part
+        in the command: the cache is keyed on the primary model.
+        """
+        if _FALLBACK_MODELS.get():
+            _LOGGER.debug("Not caching the decision of the failover model %s",
+                          ", ".join(_FALLBACK_MODELS.get()))
+            return
+        self.cache.put(utterance, **decision)
+
+    def ollama_broken_message(self) -> str:
+        """Return the message telling the user that the AI server is not available."""
+        return self._cfg['conversation'].get('ollama_broken_message',
+                                             "AI server is broken, please try again later.")
+
     async def generate_user_error(self,
                                   user_input: ConversationInput,
                                   message: str,
                                   ollama_broken: bool = False) -> ConversationResult:
         """Generate a user error response."""
         _LOGGER.error(message)
+        trace_event("error", message=message, ollama_broken=ollama_broken)
         if ollama_broken:
-            message = "AI server is broken, please try again later."
+            message = self.ollama_broken_message()
             _LOGGER.error("Ollama broken, overriding the message: %s", message)
             return await self.create_response(user_input, message)
+        if self._processing.get(user_input.conversation_id, 0) > 1:
+            # A newer command of the conversation is in process, don't queue more work for this
+            return await self.create_response(user_input, self.ollama_broken_message())
 
-        prompt = self._cfg['conversation']['user_error_prompt']
-        conversation_history = await self.conversation_get_str(4)
-        prompt = prompt.replace("{conversation_history}", conversation_history)
-        prompt = prompt.replace("{message}", message)
+        conversation_history = await self.conversation_get_str(user_input.conversation_id,
+                                                               "user_error_prompt")
+        prompt = self._prompts.render("user_error_prompt",
+                                      conversation_history=conversation_history,
+                                      message=message)
 
         try:
-            response = await self.ollama_prompt(prompt)
+            response = await self.ollama_prompt(user_input.conversation_id, prompt,
+                                                priority=PRIORITY_ERROR)
             _LOGGER.error("User error response from Ollama: %s", response)
         except PaavoAIError as e:
             # We are already in an error state, so just return a generic error message
             _LOGGER.error("Error while generating user error response: %s", e)
-            response = "AI server is broken, please try again later."
+            response = self.ollama_broken_message()
 
         return await self.create_response(user_input, response)
 
-    async def generate_user_reply(self, message: str) -> str:
+    async def generate_user_reply(self, conversation_id: str, message: str) -> str:
 
         """Generate a user reply based on the action result string."""
         _LOGGER.debug(message)
 
-        prompt = self._cfg['conversation']['user_reply_prompt']
-        conversation_history = await self.conversation_get_str(8)
-        prompt = prompt.replace("{conversation_history}", conversation_history)
-        prompt = prompt.replace("{message}", message)
+        conversation_history = await self.conversation_get_str(conversation_id,
+                                                               "user_reply_prompt")
+        prompt = self._prompts.render("user_reply_prompt",
+                                      conversation_history=conversation_history,
+                                      message=message)
+        return await self._generate_reply(conversation_id, prompt)
 
+    async def _generate_reply(self, conversation_id: str, prompt: str) -> str:
+        """Generate a spoken reply, streamed to the chat log when there is one."""
+        reply_stream = _REPLY_STREAM.get()
         try:
-            response = await self.ollama_prompt(prompt)
+            # Waited for once, the non-streaming fallback finds the model ready
+            await self._wait_for_model()
+            if reply_stream is not None:
+                response = await self._stream_reply(reply_stream, conversation_id, prompt)
+                if response is not None:
+                    return response
+            response = await self.ollama_prompt(conversation_id, prompt,
+                                                priority=PRIORITY_REPLY)
             _LOGGER.debug("The rephased message from Ollama: %s", response)
         except PaavoAIError as e:
             # We are responding to the user, so too late to do any fallbacks
@@ -229,15 +679,118 @@ class PaavoAIConversationAgent(AbstractConversationAgent):
         return response.strip()
 
 
+    async def _stream_reply(self, reply_stream: _ReplyStream, conversation_id: str,
+                            prompt: str) -> str | None:
+        """
+        Stream the reply into the chat log sentence by sentence, so speech synthesis
+        starts before the whole reply is generated. A server failure before the
+        first sentence raises PaavoAIError, a retry without streaming would only
+        fail again.
+        :return: The reply, or None if streaming is not available.
+        """
+        sentences = []
+        start = time.perf_counter()
+
+        async def deltas():
+            async for sentence in sentence_chunks(self._ollama.stream_request(
+                    prompt, priority=PRIORITY_REPLY, conversation_id=conversation_id)):
+                if not sentences:
+                    self.metrics.observe("reply_first_sentence",
+                                         (time.perf_counter() - start) * 1000)
+                    # The first delta starts the assistant message
+                    yield {"role": "assistant", "content": sentence}
+                else:
+                    yield {"content": sentence}
+                sentences.append(sentence)
+
+        try:
+            async for _content in reply_stream.chat_log.async_add_delta_content_stream(
+                    reply_stream.agent_id, deltas()):
+                pass
+        except (OllamaServerError, OllamaCircuitOpen) as e:
+            if not sentences:
+                self.raise_error("Error while streaming the reply", broken=True,
+                                 cause_exception=e)
+            _LOGGER.error("Error while streaming the reply: %s", e)
+        except (OllamaClientError, HomeAssistantError) as e:
+            _LOGGER.error("Error while streaming the reply: %s", e)
+
+        if not sentences:
+            return None
+        reply_stream.streamed = True
+        response = "".join(sentences).strip()
+        trace_event("ollama", prompt=prompt, stream=True, response=response,
+                    ms=round((time.perf_counter() - start) * 1000, 1))
+        _LOGGER.debug("The streamed reply from Ollama: %s", response)
+        return response
+
+    async def sensor_reply(self, conversation_id: str, utterance: str) -> str:
+        """
+        Answer a sensor query. Only the few sensors matching the query are looked
+        up from the entity index. A single clear match is answered directly,
+        otherwise the LLM picks from the matching sensors and their values.
+        """
+        matches = self.entity_index.search(utterance)
+        entry = self.entity_index.unambiguous(matches)
+        if entry is not None:
+            self.entity_index.direct += 1
+            return await self.reply_for_result(conversation_id, self.entity_index.result(entry))
+
+        sensors = self.entity_index.prompt_lines([entry for _score, entry in matches])
+        with self.metrics.span("reply"):
+            if "sensor_prompt" not in self._prompts.versions():
+                return await self.generate_user_reply(
+                    conversation_id, f"The matching sensors:\n{sensors or '(none)'}")
+            conversation_history = await self.conversation_get_str(conversation_id,
+                                                                   "sensor_prompt")
+            prompt = self._prompts.render("sensor_prompt",
+                                          conversation_history=conversation_history,
+                                          sensors=sensors or "(none)")
+            return await self._generate_reply(conversation_id, prompt)
+
+    async def reply_for_result(self, conversation_id: str, result) -> str:
+        """
+        Return the reply for an action result. The reply is rendered from the
+        templates unless the LLM rephrase is enabled or there is no template.
+        """
+        with self.metrics.span("reply"):
+            if not self._cfg['conversation'].get('llm_rephrase', False):
+                response = self.replies.render(result)
+                if response is not None:
+                    return response
+            return await self.generate_user_reply(conversation_id, str(result))
+
+    def track_confirmation(self, result) -> None:
+        """
+        Follow the confirmation of a non-blocking music action in the background.
+        The reply is optimistic and doesn't wait for it, an unconfirmed action is logged.
+        """
+        if result.confirmation is None:
+            return
+
+        async def _confirm() -> None:
+            with self.metrics.span("confirm"):
+                await self.music_player.async_confirm(result)
+
+        self._hass.async_create_background_task(_confirm(),
+                                                f"PaavoAI confirm {result.action}")
+
     async def create_response(self,
                               user_input: ConversationInput,
                               response: str) -> ConversationResult:
         """Return the response from the Ollama server."""
                # Create an IntentResponse object
         intent_response = IntentResponse(language=user_input.language)
+        trace_event("reply", text=response)
 
         intent_response.async_set_speech(response)
 
+        reply_stream = _REPLY_STREAM.get()
+        if reply_stream is not None and not reply_stream.streamed:
+            # The streamed reply is already in the chat log
+            reply_stream.chat_log.async_add_assistant_content_without_tools(
+                AssistantContent(agent_id=reply_stream.agent_id, content=response))
+
         result = ConversationResult(
             response=intent_response,
             conversation_id=user_input.conversation_id,
@@ -245,46 +798,204 @@ class PaavoAIConversationAgent(AbstractConversationAgent):
 
         return result
 
-    async def async_process(self, user_input: ConversationInput) -> ConversationResult:
-        """ The main method to process the user input and return a response."""
+    async def async_process(self, user_input: ConversationInput,
+                            chat_log: "ChatLog | None" = None,
+                            agent_id: str | None = None) -> ConversationResult:
+        """
+        The main method to process the user input and return a response.
+        If the chat log is given, the generated reply is streamed into it as
+        the content of the agent_id.
+        """
+        with self.metrics.span("total"):
+            if user_input.conversation_id is None:
+                user_input = dataclasses.replace(user_input, conversation_id=ulid_now())
+            token = _REPLY_STREAM.set(_ReplyStream(chat_log, agent_id)
+                                      if chat_log is not None else None)
+            fallback_token = _FALLBACK_MODELS.set(set())
+            try:
+                with self.traces.command(user_input.conversation_id, user_input.text), \
+                     self._track_command(user_input.conversation_id):
+                    return await self._process(user_input)
+            finally:
+                _REPLY_STREAM.reset(token)
+                _FALLBACK_MODELS.reset(fallback_token)
+                # The reply is out, fold the older history off the critical path
+                if self.context.needs_summary(user_input.conversation_id):
+                    self._hass.async_create_background_task(
+                        self.context.async_update_summary(user_input.conversation_id),
+                        f"PaavoAI summary {user_input.conversation_id}")
+
+    @contextmanager
+    def _track_command(self, conversation_id: str):
+        """
+        Count the commands in process per conversation. A new command supersedes
+        the previous one, so the previous one's queued Ollama requests are cancelled.
+        """
+        if self._processing.get(conversation_id):
+            self._ollama.cancel_conversation(conversation_id)
+        self._processing[conversation_id] = self._processing.get(conversation_id, 0) + 1
+        try:
+            yield
+        finally:
+            self._processing[conversation_id] -= 1
+            if not self._processing[conversation_id]:
+                del self._processing[conversation_id]
+
+    async def _embed_utterance(self, utterance: str) -> list[float] | None:
+        """Return the utterance embedding for the router, None if not available."""
+        with self.metrics.span("route"):
+            return await self.router.async_embed(utterance)
+
+    async def _process(self, user_input: ConversationInput) -> ConversationResult:
+        """Process the user input, the stages are timed separately."""
 
         _LOGGER.debug("PaavoAI processing: '%s' for conversation_id: %s",
                       user_input.text, user_input.conversation_id)
 
-        # TODO: Need to have the conversation ID
+        conversation_id = user_input.conversation_id
+
         # Add user input to history
-        await self.conversation_store("user", user_input.text)
+        await self.conversation_store(conversation_id, "user", user_input.text)
+
+        # Common commands are mapped directly to music player actions
+        with self.metrics.span("fast_path"):
+            match = self.fast_path.match(user_input.text)
+        if match:
+            trace_event("fast_path", action=match.action, method=match.method)
+            # A music command too, for the speculation of the next command
+            self._history.set_topic(conversation_id, "music")
+            self._topic_counts["music"] += 1
+            try:
+                with self.metrics.span("service"):
+                    result = await self.music_player.parse_action(match.action)
+            except Exception as e: # pylint: disable=broad-except
+                return await self.generate_user_error(user_input,
+                                                     "Error while processing music action",
+                                                     isinstance(e, PaavoAIError) and
+                                                     e.ollama_broken)
+            self.track_confirmation(result)
+            if match.reply and result.action != "load":
+                response_message = match.reply
+            else:
+                # The loaded playlist is the one the catalog resolved, not the user's words
+                response_message = await self.reply_for_result(conversation_id, result)
+            await self.conversation_store(conversation_id, "assistant", response_message)
+            return await self.create_response(user_input, response_message)
 
+        structured = self._cfg['conversation'].get('classification') == "structured"
+        # Decisions for repeated commands are reused from the cache
+        cached = self.cache.get(user_input.text) or {}
+        decision = None
+        speculation = speculative_action = None
+        topic = None
+        # The utterance is embedded once for routing both the topic and the action,
+        # concurrently with the speculative action classification
+        route_task = None
+        if self.router.enabled and ("topic" not in cached or "action" not in cached):
+            route_task = asyncio.ensure_future(self._embed_utterance(user_input.text))
+        route_vector = routed_topic = None
         try:
-            topic = await self.topic_get()
+            if "topic" not in cached and "action" not in cached and not structured:
+                speculation = self._start_speculation(conversation_id)
+            if route_task is not None:
+                route_vector = await route_task
+            if "topic" not in cached:
+                routed_topic = self.router.route(route_vector, GROUP_TOPICS)
+
+            if "topic" in cached:
+                topic = cached["topic"]
+            elif routed_topic is not None and routed_topic.label in _TOPICS:
+                topic = routed_topic.label
+            elif structured:
+                with self.metrics.span("classify"):
+                    decision = await self.classify(conversation_id)
+                topic = decision["topic"]
+            else:
+                with self.metrics.span("topic"):
+                    topic = await self.topic_get(conversation_id)
         except PaavoAIError as e:
             return await self.generate_user_error(user_input,
                                                   "Error while getting topic for the user comment",
                                                   e.ollama_broken)
+        finally:
+            speculative_action = self._finish_speculation(speculation, topic)
+        trace_event("topic", topic=topic, cached="topic" in cached,
+                    routed=routed_topic is not None and topic == routed_topic.label)
+        self._cache_put(user_input.text, topic=topic)
+        self._history.set_topic(conversation_id, topic)
+        self._topic_counts[topic] += 1
 
         action = "NONE"
         if topic == "sensor":
-            # Use HA's APIs to get the sensor value
-            pass
+            with self.metrics.span("sensor"):
+                response_message = await self.sensor_reply(conversation_id, user_input.text)
+            await self.conversation_store(conversation_id, "assistant", response_message)
+            return await self.create_response(user_input, response_message)
         elif topic == "lights":
-            # Use HA's APIs to control the lights
-            pass
+            try:
+                lights = cached.get("lights") \
+                    if cached.get("lights_version") == self._lights_prompt_version() else None
+                if lights is None:
+                    with self.metrics.span("action"):
+                        lights = await self.lights_decide(conversation_id)
+                trace_event("lights", decision=lights)
+                with self.metrics.span("service"):
+                    result = await self.light_controller.execute(
+                        lights["action"], lights["areas"],
+                        lights["brightness"], lights["color"])
+            except Exception as e: # pylint: disable=broad-except
+                return await self.generate_user_error(user_input,
+                                                     "Error while processing light action",
+                                                     isinstance(e, PaavoAIError) and
+                                                     e.ollama_broken)
+            self._cache_put(user_input.text, lights=lights,
+                            lights_version=self._lights_prompt_version())
+            response_message = await self.reply_for_result(conversation_id, result)
+            await self.conversation_store(conversation_id, "assistant", response_message)
+            return await self.create_response(user_input, response_message)
         elif topic == "music":
             try:
-                action_string = await self.music_get_actions()
+                if decision:
+                    action_string = decision["action"]
+                elif "action" in cached:
+                    action_string = cached["action"]
+                elif (routed_action := self.router.route(route_vector, "music")) is not None \
+                     and routed_action.label in _MUSIC_ACTIONS:
+                    action_string = routed_action.label
+                    if speculative_action is not None:
+                        self._cancel_speculation(speculation, "the action was routed")
+                elif speculative_action is not None:
+                    self.speculation["hits"] += 1
+                    with self.metrics.span("action"):
+                        action_string = await speculative_action
+                else:
+                    with self.metrics.span("action"):
+                        action_string = await self.music_get_actions(conversation_id)
+                trace_event("action", action=action_string)
                 if action_string.startswith("message "):
                     # If the action is a message, just return it
                     response_message = action_string.split("message ")[-1].strip()
-                    await self.conversation_store("assistant", response_message)
+                    await self.conversation_store(conversation_id, "assistant", response_message)
                     return await self.create_response(user_input, response_message)
 
-                result = await self.music_player.parse_action(action_string)
-            except Exception: # pylint: disable=broad-except
+                with self.metrics.span("service"):
+                    result = await self.music_player.parse_action(action_string)
+            except Exception as e: # pylint: disable=broad-except
                 return await self.generate_user_error(user_input,
-                                                     "Error while processing music action")
-
-            response_message = await self.generate_user_reply(result)
-            await self.conversation_store("assistant", response_message)
+                                                     "Error while processing music action",
+                                                     isinstance(e, PaavoAIError) and
+                                                     e.ollama_broken)
+            self.track_confirmation(result)
+            # Free-form messages depend on the context, only the actions are cached
+            self._cache_put(user_input.text, action=action_string)
+
+            # The structured reply can't know the result of the 'info' action
+            if decision and decision["reply"] and action_string != "info" and \
+               result.template_key not in self.replies:
+                response_message = decision["reply"]
+            else:
+                response_message = await self.reply_for_result(conversation_id, result)
+            await self.conversation_store(conversation_id, "assistant", response_message)
             return await self.create_response(user_input, response_message)
 
         # TMP: just turn the action for now
@@ -292,7 +1003,7 @@ class PaavoAIConversationAgent(AbstractConversationAgent):
 
         # TODO: Add proper prompt
         # TODO: configure the history length
-        #conversation_history = await self.conversation_get_str(4)
+        #conversation_history = await self.conversation_get_str(conversation_id, 4)
         #engineered_prompt = f"{conversation_history}\n"
 
         #response = await self.ollama_prompt(engineered_prompt)
@@ -0,0 +1,44 @@
+""" Streaming conversation entity for the Paavo AI integration."""
+
+import dataclasses
+
+from homeassistant.components.conversation import (
+    ChatLog,
+    ConversationEntity,
+    ConversationInput,
+    ConversationResult,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.helpers.device_registry import DeviceInfo
+
+DOMAIN = "paavoai"
+
+
+class PaavoAIConversationEntity(ConversationEntity):
+    """
+    The Paavo AI agent as a conversation entity with streaming output. The
+    generated replies are streamed into the chat log sentence by sentence, so
+    the voice pipeline can start the speech synthesis on the first sentence.
+    """
+    _attr_has_entity_name = True
+    _attr_name = None
+    _attr_supports_streaming = True
+
+    def __init__(self, entry: ConfigEntry, agent):
+        self._agent = agent
+        self._attr_unique_id = entry.entry_id
+        self._attr_device_info = DeviceInfo(identifiers={(DOMAIN, entry.entry_id)},
+                                            name=entry.title)
+
+    @property
+    def supported_languages(self) -> list[str]:
+        """Return the languages supported by the agent."""
+        return self._agent.supported_languages
+
+    async def _async_handle_message(self, user_input: ConversationInput,
+                                    chat_log: ChatLog) -> ConversationResult:
+        """Process the command, streaming the generated reply into the chat log."""
+        # The chat session owns the conversation id
+        user_input = dataclasses.replace(user_input, conversation_id=chat_log.conversation_id)
+        return await self._agent.async_process(user_input, chat_log=chat_log,
+                                               agent_id=self.entity_id)
@@ -0,0 +1,41 @@
+""" Diagnostics support for the Paavo AI integration."""
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+DOMAIN = "paavoai"
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict:
+    """Return diagnostics for a config entry."""
+    diagnostics = {"config": dict(entry.data)}
+
+    entry_data = hass.data.get(DOMAIN, {}).get(entry.entry_id, {})
+    if "prompts" in entry_data:
+        diagnostics["prompt_versions"] = entry_data["prompts"].versions()
+    if "ollama_client" in entry_data:
+        diagnostics["backends"] = entry_data["ollama_client"].stats()
+    if "circuit_breaker" in entry_data:
+        diagnostics["circuit_breaker"] = entry_data["circuit_breaker"].stats()
+    if "scheduler" in entry_data:
+        diagnostics["scheduler"] = entry_data["scheduler"].stats()
+    if "metrics" in entry_data:
+        diagnostics["latency"] = entry_data["metrics"].as_dict()
+
+    agent = entry_data.get("agent")
+    if agent is not None:
+        diagnostics["fast_path"] = agent.fast_path.stats()
+        diagnostics["classification_cache"] = agent.cache.stats()
+        diagnostics["history"] = agent.history_stats()
+        diagnostics["speculation"] = agent.speculation_stats()
+        diagnostics["playlist_catalog"] = agent.music_player.catalog.stats()
+        diagnostics["music_player"] = agent.music_player.stats()
+        diagnostics["entity_index"] = agent.entity_index.stats()
+        diagnostics["light_areas"] = agent.light_controller.stats()
+        diagnostics["context"] = agent.context.stats()
+        diagnostics["router"] = agent.router.stats()
+        diagnostics["response_parser"] = agent.parser.stats()
+        diagnostics["trace_recorder"] = agent.traces.stats()
+        diagnostics["traces"] = agent.traces.export()
+
+    return diagnostics
@@ -0,0 +1,328 @@
+""" Incrementally maintained index of the sensor entities for the sensor queries """
+
+import logging
+from typing import Callable
+
+from homeassistant.const import ATTR_FRIENDLY_NAME, ATTR_UNIT_OF_MEASUREMENT, \
+    EVENT_STATE_CHANGED, STATE_UNAVAILABLE, STATE_UNKNOWN
+from homeassistant.core import Event, HomeAssistant, State, callback
+from homeassistant.helpers import area_registry as ar, device_registry as dr, \
+    entity_registry as er
+
+from .playlist_catalog import fold_name
+
+_LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_DOMAINS = ("sensor",)
+_DEFAULT_PROMPT_ENTITIES = 5   # Entities given to the LLM for an ambiguous query
+_MIN_TERM = 4                  # Shortest word part matched against the terms
+_STEM_FROM = 7                 # Longer terms are indexed also without the last two
+                               # letters, e.g. "kosteus" matches "kosteutta"
+
+# Weights of the matched terms, an area and a measured quantity identify a sensor
+_WEIGHT_AREA = 3
+_WEIGHT_CLASS = 2
+_WEIGHT_NAME = 1
+
+
+class SensorEntry:
+    """An indexed sensor entity, the value is read from the state machine."""
+    __slots__ = ("entity_id", "name", "area", "device_class", "terms")
+
+    def __init__(self, entity_id: str, name: str, area: str | None,
+                 device_class: str | None, terms: dict):
+        self.entity_id = entity_id
+        self.name = name
+        self.area = area
+        self.device_class = device_class
+        self.terms = terms  # Folded term -> weight
+
+    def __repr__(self) -> str:
+        return f"SensorEntry({self.entity_id!r}, {self.name!r}, {self.area!r})"
+
+
+class SensorResult:
+    """The current value of a sensor, rendered with the [replies] templates."""
+    __slots__ = ("action", "entity_id", "entity_name", "area", "value", "unit")
+
+    def __init__(self, entity_id: str, entity_name: str, area: str | None = None,
+                 value: str | None = None, unit: str | None = None):
+        self.action = "sensor"
+        self.entity_id = entity_id
+        self.entity_name = entity_name
+        self.area = area
+        self.value = value
+        self.unit = unit
+
+    @property
+    def template_key(self) -> str:
+        """Return the key of the reply template for the result."""
+        return "sensor" if self.value is not None else "sensor_unknown"
+
+    def as_dict(self) -> dict:
+        """Return the result fields for the reply templates."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self) -> str:
+        if self.value is None:
+            return f"The value of {self.entity_name} is not available."
+        return f"{self.entity_name} is {self.value} {self.unit or ''}".rstrip() + "."
+
+
+class EntityIndex:
+    """
+    Index of the sensor entities by their area, name and aliases.
+
+    Built once from the state machine and kept current through the state_changed
+    and registry update events, so a query finds the few relevant sensors
+    without going through all the entities. The terms are folded (lowercase,
+    no accents) and matched against the parts of the query words, so Finnish
+    inflections ("olohuoneen") and compounds ("ulkolämpötila") still match.
+    """
+    def __init__(self, hass: HomeAssistant, config: dict | None = None):
+        """
+        Initialize the index, the entities are indexed by async_start_tracking().
+
+        :param hass: The Home Assistant instance.
+        :param config: The [sensor] section of paavoai.toml.
+        """
+        self.hass = hass
+        self._entries = {}  # Entity id -> SensorEntry
+        self._terms = {}    # Folded term -> {entity id: weight}
+        self._built = False
+        self.queries = 0
+        self.direct = 0     # Queries answered without the LLM, counted by the agent
+        self.configure(config)
+
+    def configure(self, config: dict | None) -> None:
+        """Apply the [sensor] section of a (re)loaded paavoai.toml, reindexing if built."""
+        config = config or {}
+        self.domains = tuple(config.get("domains", _DEFAULT_DOMAINS))
+        self.prompt_entities = config.get("prompt_entities", _DEFAULT_PROMPT_ENTITIES)
+        # Device class -> words, e.g. temperature = ["lämpötila", "astetta"]
+        self._class_aliases = {device_class: [fold_name(word) for word in words]
+                               for device_class, words in config.get("aliases", {}).items()}
+        # Area id -> extra words for the area
+        self._area_aliases = {area_id: [fold_name(word) for word in words]
+                              for area_id, words in config.get("area_aliases", {}).items()}
+        if self._built:
+            self.async_build()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _indexed(self, entity_id: str) -> bool:
+        return entity_id.split(".", 1)[0] in self.domains
+
+    def _area(self, entity_id: str) -> tuple[str | None, list[str]]:
+        """Return the name and the folded words of the entity's (or its device's) area."""
+        entity = er.async_get(self.hass).async_get(entity_id)
+        if entity is None:
+            return None, []
+        area_id = entity.area_id
+        if area_id is None and entity.device_id is not None:
+            device = dr.async_get(self.hass).async_get(entity.device_id)
+            area_id = device.area_id if device else None
+        area = ar.async_get(self.hass).async_get_area(area_id) if area_id else None
+        if area is None:
+            return None, []
+        words = [fold_name(area.name)] + [fold_name(alias) for alias in area.aliases]
+        return area.name, words + self._area_aliases.get(area.id, [])
+
+    def _entry(self, state: State) -> SensorEntry:
+        """Create the index entry of the entity."""
+        name = state.attributes.get(ATTR_FRIENDLY_NAME) or state.entity_id
+        device_class = state.attributes.get("device_class")
+        area, area_words = self._area(state.entity_id)
+
+        terms = {}
+
+        def add(words: list[str], weight: int) -> None:
+            for word in words:
+                for term in word.split():
+                    keys = [term, term[:-2]] if len(term) >= _STEM_FROM else [term]
+                    for key in keys:
+                        if len(key) >= 3:
+                            terms[key] = max(terms.get(key, 0), weight)
+
+        add([fold_name(name), fold_name(state.entity_id.split(".", 1)[1].replace("_", " "))],
+            _WEIGHT_NAME)
+        entity = er.async_get(self.hass).async_get(state.entity_id)
+        if entity is not None:
+            add([fold_name(alias) for alias in entity.aliases], _WEIGHT_NAME)
+        add(self._class_aliases.get(device_class, []), _WEIGHT_CLASS)
+        add(area_words, _WEIGHT_AREA)
+        return SensorEntry(state.entity_id, name, area, device_class, terms)
+
+    def _add(self, state: State) -> None:
+        self._remove(state.entity_id)
+        entry = self._entries[state.entity_id] = self._entry(state)
+        for term, weight in entry.terms.items():
+            self._terms.setdefault(term, {})[entry.entity_id] = weight
+
+    def _remove(self, entity_id: str) -> None:
+        entry = self._entries.pop(entity_id, None)
+        if entry is None:
+            return
+        for term in entry.terms:
+            entity_ids = self._terms.get(term)
+            if entity_ids is not None:
+                entity_ids.pop(entity_id, None)
+                if not entity_ids:
+                    del self._terms[term]
+
+    @callback
+    def async_build(self) -> None:
+        """Index all the entities of the indexed domains."""
+        self._entries.clear()
+        self._terms.clear()
+        for domain in self.domains:
+            for state in self.hass.states.async_all(domain):
+                self._add(state)
+        self._built = True
+        _LOGGER.debug("Entity index built, %d entities and %d terms",
+                      len(self._entries), len(self._terms))
+
+    @callback
+    def async_start_tracking(self) -> Callable[[], None]:
+        """Build the index and keep it current, returns a function stopping the tracking."""
+        self.async_build()
+
+        @callback
+        def _state_changed(event: Event) -> None:
+            entity_id = event.data["entity_id"]
+            if not self._indexed(entity_id):
+                return
+            old_state, new_state = event.data["old_state"], event.data["new_state"]
+            if new_state is None:
+                self._remove(entity_id)
+            elif old_state is None or entity_id not in self._entries or \
+                 old_state.attributes.get(ATTR_FRIENDLY_NAME) != \
+                 new_state.attributes.get(ATTR_FRIENDLY_NAME) or \
+                 old_state.attributes.get("device_class") != \
+                 new_state.attributes.get("device_class"):
+                # Only the names matter, the values are read at query time
+                self._add(new_state)
+
+        @callback
+        def _entity_registry_updated(event: Event) -> None:
+            entity_id = event.data["entity_id"]
+            self._remove(event.data.get("old_entity_id", entity_id))
+            state = self.hass.states.get(entity_id)
+            if event.data["action"] != "remove" and state is not None and \
+               self._indexed(entity_id):
+                self._add(state)
+
+        @callback
+        def _areas_updated(_event: Event) -> None:
+            # Rare, e.g. an area renamed
+            self.async_build()
+
+        @callback
+        def _device_updated(event: Event) -> None:
+            # Only a device moved to another area changes the index, and only
+            # the entities of that device
+            if event.data["action"] != "update" or \
+               "area_id" not in event.data.get("changes", {}):
+                return
+            for entity in er.async_entries_for_device(er.async_get(self.hass),
+                                                      event.data["device_id"]):
+                state = self.hass.states.get(entity.entity_id)
+                if state is not None and self._indexed(entity.entity_id):
+                    self._add(state)
+
+        unsubscribers = [
+            self.hass.bus.async_listen(EVENT_STATE_CHANGED, _state_changed),
+            self.hass.bus.async_listen(er.EVENT_ENTITY_REGISTRY_UPDATED,
+                                       _entity_registry_updated),
+            self.hass.bus.async_listen(ar.EVENT_AREA_REGISTRY_UPDATED, _areas_updated),
+            self.hass.bus.async_listen(dr.EVENT_DEVICE_REGISTRY_UPDATED, _device_updated),
+        ]
+
+        @callback
+        def _stop() -> None:
+            for unsubscribe in unsubscribers:
+                unsubscribe()
+
+        return _stop
+
+    def _word_scores(self, word: str) -> dict:
+        """
+        Return {entity id: score} of the terms found in a query word. The terms
+        within the word cover the inflections and compounds ("ulkolämpötila"),
+        overlapping terms ("olohuoneen" and "olohuone") count once.
+        """
+        spans = []  # (weight, length, start, end, entity id)
+        for start in range(len(word)):
+            for end in range(start + min(_MIN_TERM, len(word) - start), len(word) + 1):
+                if end - start < _MIN_TERM and (start, end) != (0, len(word)):
+                    continue
+                for entity_id, weight in self._terms.get(word[start:end], {}).items():
+                    spans.append((weight, end - start, start, end, entity_id))
+
+        scores = {}
+        taken = {}  # Entity id -> the spans counted
+        for weight, _length, start, end, entity_id in sorted(spans, reverse=True):
+            counted = taken.setdefault(entity_id, [])
+            if all(end <= other_start or start >= other_end
+                   for other_start, other_end in counted):
+                counted.append((start, end))
+                scores[entity_id] = scores.get(entity_id, 0) + weight
+        return scores
+
+    def search(self, utterance: str, limit: int | None = None) -> list[tuple[int, SensorEntry]]:
+        """
+        Return the sensors matching the utterance with their scores, best first.
+
+        :param utterance: The user's query.
+        :param limit: Maximum number of sensors, prompt_entities by default.
+        """
+        if not self._built:
+            self.async_build()
+        self.queries += 1
+        scores = {}
+        for word in fold_name(utterance).split():
+            for entity_id, score in self._word_scores(word).items():
+                scores[entity_id] = scores.get(entity_id, 0) + score
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [(score, self._entries[entity_id])
+                for entity_id, score in ranked[:limit or self.prompt_entities]]
+
+    def unambiguous(self, matches: list[tuple[int, SensorEntry]]) -> SensorEntry | None:
+        """
+        Return the sensor if the query clearly refers to a single one: more than
+        a name word matched and no other sensor scored as high.
+        """
+        if not matches or matches[0][0] <= _WEIGHT_NAME:
+            return None
+        if len(matches) > 1 and matches[1][0] >= matches[0][0]:
+            return None
+        return matches[0][1]
+
+    def result(self, entry: SensorEntry) -> SensorResult:
+        """Return the current value of the sensor."""
+        state = self.hass.states.get(entry.entity_id)
+        value = state.state if state and \
+            state.state not in (STATE_UNAVAILABLE, STATE_UNKNOWN) else None
+        unit = state.attributes.get(ATTR_UNIT_OF_MEASUREMENT) if state else None
+        return SensorResult(entry.entity_id, entry.name, entry.area, value, unit)
+
+    def prompt_lines(self, entries: list[SensorEntry]) -> str:
+        """Return the compact sensor list for the LLM prompt, one sensor per line."""
+        lines = []
+        for entry in entries:
+            result = self.result(entry)
+            area = f" ({entry.area})" if entry.area else ""
+            value = "unavailable" if result.value is None else \
+                f"{result.value} {result.unit or ''}".rstrip()
+            lines.append(f"- {entry.name}{area}: {value}")
+        return "\n".join(lines)
+
+    def stats(self) -> dict:
+        """Return the index size and query counters."""
+        return {
+            "entities": len(self._entries),
+            "terms": len(self._terms),
+            "queries": self.queries,
+            "direct": self.direct,
+        }
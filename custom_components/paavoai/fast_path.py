@@ -0,0 +1,152 @@
+""" Local matcher for common voice commands that don't need the LLM """
+
+import logging
+import re
+from difflib import SequenceMatcher
+
+_LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_FUZZY_THRESHOLD = 0.85  # Minimum similarity for a fuzzy keyword match
+_DEFAULT_FUZZY_MARGIN = 0.1      # Minimum lead over the best match of another action
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_utterance(text: str) -> str:
+    """Lowercase the text and remove the punctuation and extra whitespace."""
+    text = _PUNCTUATION_RE.sub(" ", text.lower())
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+class FastPathError(Exception):
+    """Custom exception for fast path configuration errors."""
+
+
+class FastPathMatch:
+    """A confident match of an utterance to a music player action."""
+    __slots__ = ("action", "reply", "confidence", "method")
+
+    def __init__(self, action: str, reply: str, confidence: float, method: str):
+        self.action = action
+        self.reply = reply
+        self.confidence = confidence
+        self.method = method
+
+    def __repr__(self) -> str:
+        return f"FastPathMatch({self.action!r}, {self.method}, {self.confidence:.2f})"
+
+
+class FastPathMatcher:
+    """
+    Matches short voice commands to MusicPlayer actions without the LLM.
+
+    The rules are read from the [fast_path] section of paavoai.toml. Each rule
+    has an action, keywords matched exactly or fuzzily against the whole
+    utterance, optional regular expressions (a named group 'parameter' is
+    appended to the action, e.g. for 'load') and an optional canned reply. The
+    agent ignores the reply of 'load' in favour of the resolved playlist.
+    Anything not matching with high confidence returns None and should be
+    handled by the LLM.
+    """
+    def __init__(self, paavoai_config: dict):
+        """
+        Initialize the matcher and compile the index.
+
+        :param paavoai_config: The loaded paavoai.toml configuration.
+        """
+        cfg = paavoai_config.get("fast_path", {})
+        self.enabled = cfg.get("enabled", True)
+        self.fuzzy_threshold = cfg.get("fuzzy_threshold", _DEFAULT_FUZZY_THRESHOLD)
+        self.fuzzy_margin = cfg.get("fuzzy_margin", _DEFAULT_FUZZY_MARGIN)
+
+        self._keywords = {}  # Normalized keyword -> rule index
+        self._patterns = []  # (compiled regex, rule index)
+        self._rules = []     # (action, reply)
+        for rule in cfg.get("rules", []):
+            if "action" not in rule:
+                raise FastPathError(f"Fast path rule without an action: {rule}")
+            index = len(self._rules)
+            self._rules.append((rule["action"], rule.get("reply", "")))
+            for keyword in rule.get("keywords", []):
+                self._keywords[normalize_utterance(keyword)] = index
+            for pattern in rule.get("patterns", []):
+                try:
+                    self._patterns.append((re.compile(pattern), index))
+                except re.error as e:
+                    raise FastPathError(f"Invalid fast path pattern '{pattern}': {e}") from e
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Return the share of the utterances handled by the fast path."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        """Return the match counters."""
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hit_rate, 3)}
+
+    def match(self, utterance: str) -> FastPathMatch | None:
+        """
+        Match the utterance against the rules.
+        :param utterance: The user's utterance.
+        :return: The match or None if there was no confident match.
+        """
+        if not self.enabled:
+            return None
+
+        text = normalize_utterance(utterance)
+        result = self._match(text)
+        if result:
+            self.hits += 1
+        else:
+            self.misses += 1
+        _LOGGER.debug("Fast path for '%s': %s (hit rate %.2f)", text, result, self.hit_rate)
+        return result
+
+    def _match(self, text: str) -> FastPathMatch | None:
+        """Match the normalized text: exact keyword, then patterns, then fuzzy keywords."""
+        index = self._keywords.get(text)
+        if index is not None:
+            return self._make_match(index, 1.0, "keyword")
+
+        for pattern, index in self._patterns:
+            m = pattern.fullmatch(text)
+            if m:
+                return self._make_match(index, 1.0, "pattern", m.groupdict().get("parameter"))
+
+        # Best fuzzy score per action, the winner must be clearly ahead of the others
+        scores = {}  # Action -> (score, rule index)
+        floor = self.fuzzy_threshold - self.fuzzy_margin
+        matcher = SequenceMatcher(b=text, autojunk=False)
+        for keyword, index in self._keywords.items():
+            matcher.set_seq1(keyword)
+            if matcher.real_quick_ratio() < floor or matcher.quick_ratio() < floor:
+                continue
+            score = matcher.ratio()
+            action = self._rules[index][0]
+            if score > scores.get(action, (0.0, None))[0]:
+                scores[action] = (score, index)
+        if not scores:
+            return None
+
+        ranked = sorted(scores.values(), reverse=True)
+        best_score, best_index = ranked[0]
+        if best_score < self.fuzzy_threshold:
+            return None
+        if len(ranked) > 1 and best_score - ranked[1][0] < self.fuzzy_margin:
+            _LOGGER.debug("Ambiguous fast path match for '%s': %s", text, ranked[:2])
+            return None
+        return self._make_match(best_index, best_score, "fuzzy")
+
+    def _make_match(self, index: int, confidence: float, method: str,
+                    parameter: str | None = None) -> FastPathMatch:
+        """Create the match for the rule, with the optional parameter filled in."""
+        action, reply = self._rules[index]
+        if parameter:
+            parameter = parameter.strip()
+            action = f"{action} {parameter}"
+            reply = reply.replace("{parameter}", parameter)
+        return FastPathMatch(action, reply, confidence, method)
@@ -0,0 +1,223 @@
+""" Per-conversation history store for the conversation agent """
+
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+_LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_MAX_ENTRIES = 10         # Entries kept per conversation
+_DEFAULT_MAX_CONVERSATIONS = 32   # Conversations kept in memory
+_DEFAULT_MAX_CHARS = 64 * 1024    # Total message characters over all conversations
+
+
+class HistoryEntry:
+    """A single message in a conversation, rendered once when stored."""
+    __slots__ = ("seq", "role", "content", "timestamp", "line")
+
+    def __init__(self, seq: int, role: str, content: str, timestamp: str):
+        self.seq = seq
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp
+        # No timestamp, the rendered history only grows between the summaries
+        # so the prompt prefix stays the same for Ollama's prompt cache
+        self.line = f"{role}: {content}\n"
+
+
+class _Conversation:
+    """The entries of one conversation and the cached rendered history."""
+    __slots__ = ("entries", "chars", "rendered", "topic", "seq", "summary", "summarized")
+
+    def __init__(self):
+        self.entries = deque()
+        self.chars = 0
+        self.rendered = {}     # Max chars -> rendered history string
+        self.topic = None      # Topic of the latest classified command
+        self.seq = 0           # Sequence number of the latest entry
+        self.summary = ""      # Summary of the entries up to 'summarized'
+        self.summarized = 0    # Sequence number of the latest summarized entry
+
+
+class ConversationHistoryStore:
+    """
+    Conversation histories keyed by the conversation_id.
+
+    Both the number of conversations and the total size of the stored messages
+    are capped; the least recently used conversations are evicted first. With
+    'keep_unsummarized' set, the entries over max_entries are only dropped once
+    they are in the summary, up to twice max_entries per conversation.
+    """
+    def __init__(self, max_entries: int = _DEFAULT_MAX_ENTRIES,
+                 max_conversations: int = _DEFAULT_MAX_CONVERSATIONS,
+                 max_chars: int = _DEFAULT_MAX_CHARS):
+        """
+        Initialize the store.
+
+        :param max_entries: Maximum number of entries per conversation.
+        :param max_conversations: Maximum number of conversations.
+        :param max_chars: Maximum total message characters over all conversations.
+        """
+        self.max_entries = max_entries
+        self.max_conversations = max_conversations
+        self.max_chars = max_chars
+        self._conversations = OrderedDict()  # conversation_id -> _Conversation
+        self._chars = 0
+        self.keep_unsummarized = False  # Set when the entries are folded into a summary
+        self.evictions = 0
+        self.unsummarized_dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def configure(self, config: dict | None) -> None:
+        """Apply the [history] section of a (re)loaded paavoai.toml."""
+        config = config or {}
+        self.max_entries = config.get("max_entries", _DEFAULT_MAX_ENTRIES)
+        self.max_conversations = config.get("max_conversations", _DEFAULT_MAX_CONVERSATIONS)
+        self.max_chars = config.get("max_chars", _DEFAULT_MAX_CHARS)
+        for conversation in self._conversations.values():
+            self._trim(conversation)
+        self._evict(None)
+
+    def add(self, conversation_id: str, role: str, content: str) -> None:
+        """
+        Add a message to the conversation and evict idle conversations if needed.
+        :param conversation_id: The conversation the message belongs to.
+        :param role: The role of the message, e.g. 'user' or 'assistant'.
+        :param content: The message.
+        """
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            conversation = _Conversation()
+            self._conversations[conversation_id] = conversation
+        else:
+            self._conversations.move_to_end(conversation_id)
+
+        conversation.seq += 1
+        entry = HistoryEntry(conversation.seq, role, content,
+                             datetime.now(timezone.utc).isoformat())
+        conversation.entries.append(entry)
+        conversation.chars += len(content)
+        self._chars += len(content)
+        conversation.rendered.clear()
+
+        self._trim(conversation)
+        self._evict(conversation_id)
+
+    def _trim(self, conversation: _Conversation) -> None:
+        """Drop the oldest entries over max_entries, keeping the unsummarized ones if asked."""
+        entries = conversation.entries
+        while len(entries) > self.max_entries:
+            unsummarized = entries[0].seq > conversation.summarized
+            if unsummarized and self.keep_unsummarized and \
+               len(entries) <= 2 * self.max_entries:
+                break
+            if unsummarized and self.keep_unsummarized:
+                self.unsummarized_dropped += 1
+            dropped = entries.popleft()
+            conversation.chars -= len(dropped.content)
+            self._chars -= len(dropped.content)
+
+    def _evict(self, current_id: str) -> None:
+        """Evict the least recently used conversations over the limits."""
+        while len(self._conversations) > 1 and \
+              (len(self._conversations) > self.max_conversations or self._chars > self.max_chars):
+            conversation_id, conversation = next(iter(self._conversations.items()))
+            if conversation_id == current_id:
+                break
+            del self._conversations[conversation_id]
+            self._chars -= conversation.chars
+            self.evictions += 1
+            _LOGGER.debug("Evicted the history of conversation %s", conversation_id)
+
+    def entries(self, conversation_id: str) -> list:
+        """Return the entries of the conversation, oldest first."""
+        conversation = self._conversations.get(conversation_id)
+        return list(conversation.entries) if conversation else []
+
+    def set_topic(self, conversation_id: str, topic: str) -> None:
+        """Remember the topic of the latest command of the conversation."""
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None:
+            conversation.topic = topic
+
+    def last_topic(self, conversation_id: str) -> str | None:
+        """Return the topic of the latest classified command of the conversation."""
+        conversation = self._conversations.get(conversation_id)
+        return conversation.topic if conversation else None
+
+    def unsummarized(self, conversation_id: str, keep: int) -> list:
+        """
+        Return the entries not yet in the summary, except the latest 'keep' ones.
+        :param conversation_id: The conversation.
+        :param keep: The number of the latest entries kept as they are.
+        """
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            return []
+        entries = [entry for entry in conversation.entries
+                   if entry.seq > conversation.summarized]
+        return entries[:max(len(entries) - keep, 0)]
+
+    def summary(self, conversation_id: str) -> str:
+        """Return the summary of the older entries of the conversation."""
+        conversation = self._conversations.get(conversation_id)
+        return conversation.summary if conversation else ""
+
+    def set_summary(self, conversation_id: str, summary: str, summarized: int) -> None:
+        """
+        Replace the summary of the conversation.
+        :param conversation_id: The conversation.
+        :param summary: The summary of the entries up to 'summarized'.
+        :param summarized: Sequence number of the latest entry in the summary.
+        """
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None or summarized <= conversation.summarized:
+            return
+        self._chars += len(summary) - len(conversation.summary)
+        conversation.chars += len(summary) - len(conversation.summary)
+        conversation.summary = summary
+        conversation.summarized = summarized
+        conversation.rendered.clear()
+        # The entries kept for the summary can go now
+        self._trim(conversation)
+
+    def render(self, conversation_id: str, max_chars: int) -> str:
+        """
+        Return the summary and the latest entries not in it as a string, one line
+        each, within max_chars. The latest entry is always included.
+        :param conversation_id: The conversation to render.
+        :param max_chars: The maximum length of the rendered history.
+        """
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            return ""
+
+        rendered = conversation.rendered.get(max_chars)
+        if rendered is None:
+            lines = []
+            chars = 0
+            for entry in reversed(conversation.entries):
+                if entry.seq <= conversation.summarized or \
+                   (lines and chars + len(entry.line) > max_chars):
+                    break
+                lines.append(entry.line)
+                chars += len(entry.line)
+            summary = f"summary: {conversation.summary}\n" if conversation.summary else ""
+            if summary and chars + len(summary) > max_chars:
+                summary = ""
+            rendered = summary + "".join(reversed(lines))
+            conversation.rendered[max_chars] = rendered
+        return rendered
+
+    def stats(self) -> dict:
+        """Return the store counters."""
+        return {
+            "conversations": len(self._conversations),
+            "max_conversations": self.max_conversations,
+            "chars": self._chars,
+            "max_chars": self.max_chars,
+            "evictions": self.evictions,
+            "unsummarized_dropped": self.unsummarized_dropped,
+        }
@@ -0,0 +1,273 @@
+""" Embedding-based router for the topics and the music actions """
+
+import asyncio
+import hashlib
+import logging
+import math
+import time
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .ollama_client import OllamaClientError
+
+try:
+    import numpy as np
+except ImportError:  # The scores are computed in Python, fine for a few hundred exemplars
+    np = None
+
+_LOGGER = logging.getLogger(__name__)
+
+DOMAIN = "paavoai"
+
+_STORAGE_VERSION = 1
+_STORAGE_KEY = f"{DOMAIN}.router_embeddings"
+_DEFAULT_MODEL = "bge-m3"
+_DEFAULT_MARGIN = 0.05        # Minimum lead of the best label over the second
+_DEFAULT_MIN_SCORE = 0.5      # Minimum cosine similarity of the best label
+_DEFAULT_TIMEOUT = 2          # Seconds for embedding an utterance
+_PREPARE_TIMEOUT = 120        # Seconds for embedding the exemplars (loads the model)
+_RETRY_SECONDS = 300          # Seconds before a failed preparation is retried
+
+GROUP_TOPICS = "topics"
+# Labels whose exemplars only keep the utterances like them from being routed
+# elsewhere, e.g. a playlist request from 'play'. These are left to the LLM.
+_DEFAULT_ABSTAIN = ["load", "message"]
+
+
+class IntentRouterError(Exception):
+    """Custom exception for intent router errors."""
+
+
+def _exemplar_key(model: str, text: str) -> str:
+    """Return the storage key of an exemplar's vector."""
+    return hashlib.sha1(f"{model}\n{text}".encode()).hexdigest()
+
+
+def _normalize(vector: list[float]) -> list[float]:
+    """Return the vector scaled to unit length, so a dot product is the cosine."""
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class RouteResult:
+    """The best label of a group for an utterance."""
+    __slots__ = ("label", "score", "margin")
+
+    def __init__(self, label: str, score: float, margin: float):
+        self.label = label
+        self.score = score
+        self.margin = margin
+
+    def __repr__(self) -> str:
+        return f"RouteResult({self.label!r}, {self.score:.3f}, {self.margin:.3f})"
+
+
+class _Group:
+    """The normalized exemplar vectors of one group and their labels."""
+    __slots__ = ("labels", "vectors")
+
+    def __init__(self, labels: list[str], vectors: list[list[float]]):
+        self.labels = labels
+        self.vectors = np.array(vectors, dtype=np.float32) if np is not None else vectors
+
+    def scores(self, query: list[float]) -> dict:
+        """Return the best cosine similarity of each label to the normalized query."""
+        if np is not None:
+            similarities = (self.vectors @ np.asarray(query, dtype=np.float32)).tolist()
+        else:
+            similarities = [sum(a * b for a, b in zip(vector, query))
+                            for vector in self.vectors]
+        best = {}
+        for label, similarity in zip(self.labels, similarities):
+            if similarity > best.get(label, -1.0):
+                best[label] = similarity
+        return best
+
+
+class IntentRouter:
+    """
+    Routes the utterances to the topics and music actions by embedding similarity.
+
+    The exemplar utterances of each label come from the [router.exemplars]
+    section of paavoai.toml. They are embedded once with a small embedding model
+    and the vectors are stored on disk, so only new or changed exemplars are
+    embedded after a restart. An utterance is embedded once per command and
+    compared to all the exemplars of a group with a single matrix product. The
+    best label is used only if it is similar enough and ahead of the second
+    label by the margin, otherwise the generative classifier decides. The
+    abstain labels (e.g. 'load', which needs the playlist name) are never
+    routed: an utterance closest to their exemplars goes to the LLM too.
+
+    The exemplars are embedded in the background after the setup and after a
+    reload, the commands are classified by the LLM until the router is ready.
+    """
+    def __init__(self, hass: HomeAssistant, client, config: dict | None = None):
+        """
+        Initialize the router, the exemplars are embedded by async_prepare().
+
+        :param hass: The Home Assistant instance.
+        :param client: The Ollama client (or a wrapper) providing embed().
+        :param config: The [router] section of paavoai.toml.
+        """
+        self.hass = hass
+        self._client = client
+        self._store = None
+        self._groups = {}  # Group name -> _Group
+        self._prepared_at = None
+        self._failed_at = None
+        self._lock = asyncio.Lock()
+        self._preparing = None  # Background preparation task
+        self.routed = {}    # Group name -> utterances routed without the LLM
+        self.fallbacks = {}  # Group name -> utterances left to the LLM
+        self.configure(config)
+
+    def configure(self, config: dict | None) -> None:
+        """Apply the [router] section of a (re)loaded paavoai.toml."""
+        config = config or {}
+        self.enabled = config.get("enabled", False)
+        self.model = config.get("model", _DEFAULT_MODEL)
+        self.margin = config.get("margin", _DEFAULT_MARGIN)
+        self.min_score = config.get("min_score", _DEFAULT_MIN_SCORE)
+        self.timeout = config.get("timeout", _DEFAULT_TIMEOUT)
+        self.abstain = set(config.get("abstain", _DEFAULT_ABSTAIN))
+        # Group name -> label -> exemplar utterances
+        exemplars = config.get("exemplars", {})
+        self._exemplars = {group: labels for group, labels in exemplars.items()
+                           if isinstance(labels, dict)}
+        self._groups = {}
+        self._prepared_at = None
+        self._failed_at = None
+
+    @property
+    def ready(self) -> bool:
+        """Return True if the exemplars have been embedded."""
+        return self._prepared_at is not None
+
+    def raise_error(self, message: str, cause_exception=None):
+        """Helper method to log error and raise IntentRouterError."""
+        if cause_exception:
+            message = f"{message} Error: {str(cause_exception)}"
+            _LOGGER.error(message)
+            raise IntentRouterError(message) from cause_exception
+        else:
+            _LOGGER.error(message)
+            raise IntentRouterError(message)
+
+    async def async_prepare(self) -> None:
+        """Embed the exemplars missing from the stored vectors and build the groups."""
+        async with self._lock:
+            if self.enabled and self._exemplars and not self.ready:
+                await self._prepare()
+
+    async def _prepare(self) -> None:
+        if self._store is None:
+            self._store = Store(self.hass, _STORAGE_VERSION, _STORAGE_KEY)
+        stored = (await self._store.async_load() or {}).get("vectors", {})
+
+        # A reload during the preparation replaces the exemplars, the result is dropped
+        exemplars, model = self._exemplars, self.model
+        texts = {_exemplar_key(model, text): text
+                 for labels in exemplars.values()
+                 for utterances in labels.values() for text in utterances}
+        missing = [key for key in texts if key not in stored]
+        if missing:
+            _LOGGER.info("Embedding %d router exemplars with %s", len(missing), model)
+            try:
+                vectors = await self._client.embed([texts[key] for key in missing],
+                                                   model, timeout=_PREPARE_TIMEOUT)
+            except OllamaClientError as e:
+                self._failed_at = time.monotonic()
+                self.raise_error("Failed to embed the router exemplars.", e)
+            stored.update(zip(missing, vectors))
+            # Only the current exemplars are kept
+            await self._store.async_save({"vectors": {key: stored[key] for key in texts}})
+
+        if exemplars is not self._exemplars or model != self.model:
+            _LOGGER.debug("Router exemplars reloaded during the preparation")
+            return
+
+        groups = {}
+        for group, labels in exemplars.items():
+            group_labels, group_vectors = [], []
+            for label, utterances in labels.items():
+                for text in utterances:
+                    group_labels.append(label)
+                    group_vectors.append(_normalize(stored[_exemplar_key(model, text)]))
+            if group_labels:
+                groups[group] = _Group(group_labels, group_vectors)
+        self._groups = groups
+        self._prepared_at = time.monotonic()
+        _LOGGER.debug("Intent router ready: %s",
+                      {group: len(labels) for group, labels in self._exemplars.items()})
+
+    async def async_embed(self, utterance: str) -> list[float] | None:
+        """
+        Return the normalized embedding of the utterance, or None if the router
+        is not usable now (disabled, not prepared or the embedding failed).
+        """
+        if not self.enabled:
+            return None
+        if not self.ready:
+            # Prepared in the background, e.g. after a reload or when the server
+            # was down at startup, never within a command
+            self._start_preparing()
+            return None
+        try:
+            vectors = await self._client.embed([utterance], self.model, timeout=self.timeout)
+        except OllamaClientError as e:
+            _LOGGER.warning("Failed to embed the utterance, using the LLM: %s", e)
+            return None
+        return _normalize(vectors[0])
+
+    def _start_preparing(self) -> None:
+        """Start the preparation in the background unless running or recently failed."""
+        if self._preparing is not None and not self._preparing.done():
+            return
+        if self._failed_at is not None and \
+           time.monotonic() - self._failed_at < _RETRY_SECONDS:
+            return
+
+        async def _prepare() -> None:
+            try:
+                await self.async_prepare()
+            except IntentRouterError:
+                pass  # Logged, retried after _RETRY_SECONDS
+
+        self._preparing = self.hass.async_create_background_task(
+            _prepare(), "PaavoAI intent router exemplars")
+
+    def route(self, vector: list[float] | None, group: str) -> RouteResult | None:
+        """
+        Return the best label of the group for the embedded utterance, or None if
+        the result is not confident enough and the LLM should decide.
+
+        :param vector: The normalized utterance embedding from async_embed().
+        :param group: The exemplar group, e.g. 'topics' or 'music'.
+        """
+        exemplars = self._groups.get(group)
+        if vector is None or exemplars is None:
+            return None
+        ranked = sorted(exemplars.scores(vector).items(), key=lambda item: item[1],
+                        reverse=True)
+        label, score = ranked[0]
+        margin = score - ranked[1][1] if len(ranked) > 1 else score
+        result = RouteResult(label, score, margin)
+        if score < self.min_score or margin < self.margin or label in self.abstain:
+            self.fallbacks[group] = self.fallbacks.get(group, 0) + 1
+            _LOGGER.debug("Router not confident for %s: %s", group, result)
+            return None
+        self.routed[group] = self.routed.get(group, 0) + 1
+        _LOGGER.debug("Routed %s: %s", group, result)
+        return result
+
+    def stats(self) -> dict:
+        """Return the router state and counters."""
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "model": self.model,
+            "vectorized": np is not None,
+            "routed": dict(self.routed),
+            "fallbacks": dict(self.fallbacks),
+        }
@@ -0,0 +1,282 @@
+""" Area-aware light control with grouped service calls """
+
+import asyncio
+import logging
+from difflib import SequenceMatcher
+from typing import Callable
+
+from homeassistant.core import Event, HomeAssistant, callback
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import area_registry as ar, device_registry as dr, \
+    entity_registry as er
+from homeassistant.util.color import color_name_to_rgb
+
+from .playlist_catalog import fold_name
+from .trace_recorder import trace_event
+
+_LOGGER = logging.getLogger(__name__)
+
+_LIGHT_DOMAIN = "light"
+_ALL_AREAS = "all"
+_DEFAULT_THRESHOLD = 0.75  # Minimum similarity of a fuzzy area name match
+
+LIGHT_ACTIONS = ["on", "off"]
+
+
+class LightControllerError(Exception):
+    """Custom exception for light controller errors."""
+
+
+class LightArea:
+    """An area and the lights in it."""
+    __slots__ = ("area_id", "name", "words", "entity_ids")
+
+    def __init__(self, area_id: str, name: str, words: list[str]):
+        self.area_id = area_id
+        self.name = name
+        self.words = words  # Folded name and aliases
+        self.entity_ids = []
+
+    def __repr__(self) -> str:
+        return f"LightArea({self.area_id!r}, {self.name!r}, {self.entity_ids!r})"
+
+
+class LightActionResult:
+    """The result of a light action, rendered with the [replies] templates."""
+    __slots__ = ("action", "areas", "brightness", "color", "lights", "failed")
+
+    def __init__(self, action: str, areas: list[str], brightness: int | None = None,
+                 color: str | None = None, lights: int = 0, failed: list[str] = ()):
+        self.action = action
+        self.areas = ", ".join(areas)  # The areas the action succeeded in
+        self.brightness = brightness
+        self.color = color
+        self.lights = lights
+        self.failed = ", ".join(failed)  # The areas the service call failed in
+
+    @property
+    def template_key(self) -> str:
+        """Return the key of the reply template for this result."""
+        if not self.lights:
+            return "lights_none"
+        if self.failed:
+            return "lights_partial"
+        return f"lights_{self.action}"
+
+    def as_dict(self) -> dict:
+        """Return the result fields as a dictionary."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self) -> str:
+        if not self.lights:
+            return f"No lights found in {self.areas or 'the requested areas'}."
+        failed = f" Failed to turn {self.action} the lights in {self.failed}." \
+            if self.failed else ""
+        if self.action == "off":
+            return f"Turned off {self.lights} lights in {self.areas}.{failed}"
+        details = "".join([f", brightness {self.brightness}%" if self.brightness is not None
+                           else "", f", color {self.color}" if self.color else ""])
+        return f"Turned on {self.lights} lights in {self.areas}{details}.{failed}"
+
+    def __repr__(self) -> str:
+        return f"LightActionResult({self.as_dict()})"
+
+
+class LightController:
+    """
+    A class to control the Home Assistant lights by area.
+
+    The lights of each area are precomputed from the entity, device and area
+    registries and updated on their changes. An action on several areas is a
+    single light service call per area targeting the area's lights, and the
+    calls for the areas are made concurrently.
+    """
+    def __init__(self, hass: HomeAssistant, config: dict | None = None):
+        """
+        Initialize the LightController, the areas are mapped by async_start_tracking().
+
+        :param hass: The Home Assistant instance.
+        :param config: The [lights] section of paavoai.toml.
+        """
+        self.hass = hass
+        self._areas = {}  # Area id -> LightArea
+        self._built = False
+        self.configure(config)
+
+    def configure(self, config: dict | None) -> None:
+        """Apply the [lights] section of a (re)loaded paavoai.toml."""
+        config = config or {}
+        self.threshold = config.get("area_match_threshold", _DEFAULT_THRESHOLD)
+        self.transition = config.get("transition")
+
+    def raise_error(self, message: str, cause_exception=None):
+        """Helper method to log error and raise LightControllerError."""
+        if cause_exception:
+            message = f"{message} Error: {str(cause_exception)}"
+            _LOGGER.error(message)
+            raise LightControllerError(message) from cause_exception
+        else:
+            _LOGGER.error(message)
+            raise LightControllerError(message)
+
+    @callback
+    def async_build(self) -> None:
+        """Map the areas to their lights from the registries."""
+        areas = {area.id: LightArea(area.id, area.name,
+                                    [fold_name(area.name)] +
+                                    [fold_name(alias) for alias in area.aliases])
+                 for area in ar.async_get(self.hass).async_list_areas()}
+        devices = dr.async_get(self.hass)
+        for entity in er.async_get(self.hass).entities.values():
+            if entity.domain != _LIGHT_DOMAIN or entity.disabled_by is not None:
+                continue
+            area_id = entity.area_id
+            if area_id is None and entity.device_id is not None:
+                device = devices.async_get(entity.device_id)
+                area_id = device.area_id if device else None
+            if area_id in areas:
+                areas[area_id].entity_ids.append(entity.entity_id)
+        # Only the areas with lights can be controlled
+        self._areas = {area_id: area for area_id, area in areas.items() if area.entity_ids}
+        self._built = True
+        _LOGGER.debug("Light areas mapped: %s", list(self._areas.values()))
+
+    @callback
+    def async_start_tracking(self) -> Callable[[], None]:
+        """Map the areas and keep them current, returns a function stopping the tracking."""
+        self.async_build()
+
+        @callback
+        def _entity_registry_updated(event: Event) -> None:
+            if event.data["entity_id"].startswith(f"{_LIGHT_DOMAIN}."):
+                self.async_build()
+
+        @callback
+        def _registry_updated(_event: Event) -> None:
+            self.async_build()
+
+        unsubscribers = [
+            self.hass.bus.async_listen(er.EVENT_ENTITY_REGISTRY_UPDATED,
+                                       _entity_registry_updated),
+            self.hass.bus.async_listen(ar.EVENT_AREA_REGISTRY_UPDATED, _registry_updated),
+            self.hass.bus.async_listen(dr.EVENT_DEVICE_REGISTRY_UPDATED, _registry_updated),
+        ]
+
+        @callback
+        def _stop() -> None:
+            for unsubscribe in unsubscribers:
+                unsubscribe()
+
+        return _stop
+
+    def area_names(self) -> list[str]:
+        """Return the names of the areas with lights, e.g. for the LLM prompt."""
+        if not self._built:
+            self.async_build()
+        return [area.name for area in self._areas.values()]
+
+    def resolve_area(self, name: str) -> LightArea | None:
+        """Return the area best matching the name (also inflected), None if not found."""
+        folded = fold_name(name)
+        if not folded:
+            return None
+        best_score, best_area = 0.0, None
+        for area in self._areas.values():
+            for word in area.words:
+                if folded == word or folded.startswith(word):
+                    return area
+                score = SequenceMatcher(None, folded, word).ratio()
+                if score > best_score:
+                    best_score, best_area = score, area
+        return best_area if best_score >= self.threshold else None
+
+    def _service_data(self, action: str, brightness: int | None,
+                      color: str | None) -> dict:
+        """Return the light service data for the action parameters."""
+        data = {}
+        if self.transition is not None:
+            data["transition"] = self.transition
+        if action == "off":
+            return data
+        if brightness is not None:
+            data["brightness_pct"] = max(1, min(int(brightness), 100))
+        if color:
+            data["color_name"] = color
+        return data
+
+    async def _call_area(self, service: str, area: LightArea, data: dict) -> None:
+        """Call the light service once for all the lights of the area."""
+        _LOGGER.debug("Calling light.%s for %s with data: %s", service, area.name, data)
+        trace_event("service", domain=_LIGHT_DOMAIN, service=service, data=data,
+                    entity_ids=area.entity_ids)
+        try:
+            await self.hass.services.async_call(
+                domain=_LIGHT_DOMAIN,
+                service=service,
+                service_data=data,
+                blocking=True,
+                target={"entity_id": area.entity_ids}
+            )
+        except HomeAssistantError as e:
+            self.raise_error(f"Failed to call light.{service} for {area.name}.",
+                             cause_exception=e)
+
+    async def execute(self, action: str, area_names: list[str],
+                      brightness: int | None = None,
+                      color: str | None = None) -> LightActionResult:
+        """
+        Turn the lights of the areas on or off.
+
+        :param action: 'on' or 'off'.
+        :param area_names: The area names, 'all' for all the areas.
+        :param brightness: Optional brightness in percent for 'on', 0 turns off.
+        :param color: Optional color name (CSS color names) for 'on'.
+        :return: The result of the action, listing the areas it failed in. Raises
+                 LightControllerError only if it failed in all the areas.
+        """
+        if action not in LIGHT_ACTIONS:
+            self.raise_error(f"Unknown light action: {action}")
+        if not self._built:
+            self.async_build()
+        if action == "on" and brightness is not None and int(brightness) <= 0:
+            action, brightness = "off", None
+        if color:
+            try:
+                color_name_to_rgb(color)
+            except ValueError:
+                _LOGGER.warning("Unknown light color '%s', ignored", color)
+                color = None
+
+        if any(name.strip().lower() == _ALL_AREAS for name in area_names):
+            areas = list(self._areas.values())
+        else:
+            areas = []
+            for name in area_names:
+                area = self.resolve_area(name)
+                if area is None:
+                    _LOGGER.info("No lights in area '%s'", name)
+                elif area not in areas:
+                    areas.append(area)
+        if not areas:
+            return LightActionResult(action, area_names)
+
+        _LOGGER.info("Executing 'lights %s' action for %s.", action,
+                     [area.name for area in areas])
+        service = "turn_on" if action == "on" else "turn_off"
+        data = self._service_data(action, brightness, color)
+        results = await asyncio.gather(*(self._call_area(service, area, data) for area in areas),
+                                       return_exceptions=True)
+        succeeded = [area for area, result in zip(areas, results)
+                     if not isinstance(result, Exception)]
+        failed = [area.name for area in areas if area not in succeeded]
+        if not succeeded:
+            self.raise_error(f"Failed to turn {action} the lights in {', '.join(failed)}.")
+        return LightActionResult(action, [area.name for area in succeeded],
+                                 brightness if action == "on" else None,
+                                 color if action == "on" else None,
+                                 sum(len(area.entity_ids) for area in succeeded),
+                                 failed)
+
+    def stats(self) -> dict:
+        """Return the mapped areas."""
+        return {area.name: len(area.entity_ids) for area in self._areas.values()}
@@ -0,0 +1,129 @@
+""" Latency and Ollama statistics for the Paavo AI integration """
+
+import logging
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+
+_LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_WINDOW = 500  # Latest observations kept per metric
+
+# Metric name -> unit, these are exposed as sensors
+METRICS = {
+    "total": "ms",               # The whole async_process
+    "fast_path": "ms",           # Local command matching
+    "classify": "ms",            # Structured single-call classification
+    "route": "ms",               # Embedding the utterance for the router
+    "topic": "ms",               # Topic classification
+    "action": "ms",              # Music action classification
+    "service": "ms",             # Music player service calls
+    "confirm": "ms",             # Until the players confirm a non-blocking command
+    "sensor": "ms",              # Sensor query lookup and reply
+    "reply": "ms",               # Reply rendering or generation
+    "reply_first_sentence": "ms",  # Until the first streamed reply sentence
+    "ollama_request": "ms",      # A single Ollama call, as seen by the agent
+    "ollama_load_duration": "ms",
+    "ollama_prompt_eval_duration": "ms",
+    "ollama_eval_duration": "ms",
+    "ollama_prompt_eval_count": "tokens",
+    "ollama_eval_count": "tokens",
+    "scheduler_wait": "ms",      # Time queued for a free Ollama slot
+    "scheduler_queue_depth": "requests",
+}
+
+# Ollama response fields in nanoseconds -> metric name
+_OLLAMA_DURATIONS = {
+    "load_duration": "ollama_load_duration",
+    "prompt_eval_duration": "ollama_prompt_eval_duration",
+    "eval_duration": "ollama_eval_duration",
+}
+_OLLAMA_COUNTS = {
+    "prompt_eval_count": "ollama_prompt_eval_count",
+    "eval_count": "ollama_eval_count",
+}
+
+
+class LatencyHistogram:
+    """Rolling window of observations with percentile summaries."""
+    __slots__ = ("_values", "count")
+
+    def __init__(self, window: int = _DEFAULT_WINDOW):
+        self._values = deque(maxlen=window)
+        self.count = 0  # All observations, not only the ones in the window
+
+    def observe(self, value: float) -> None:
+        """Add an observation."""
+        self._values.append(value)
+        self.count += 1
+
+    def percentile(self, percent: float, ordered: list | None = None) -> float | None:
+        """Return the percentile (nearest rank) of the window or None if empty."""
+        if ordered is None:
+            ordered = sorted(self._values)
+        if not ordered:
+            return None
+        rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+        return ordered[rank - 1]
+
+    def summary(self) -> dict:
+        """Return the count and the p50/p95/p99 of the window."""
+        ordered = sorted(self._values)
+        return {
+            "count": self.count,
+            "p50": self.percentile(50, ordered),
+            "p95": self.percentile(95, ordered),
+            "p99": self.percentile(99, ordered),
+        }
+
+
+class PaavoAIMetrics:
+    """Registry of the rolling histograms, keyed by the metric name."""
+    def __init__(self, window: int = _DEFAULT_WINDOW):
+        """
+        Initialize the registry.
+
+        :param window: The number of latest observations kept per metric.
+        """
+        self.window = window
+        self._histograms = {}
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        """Return the histogram for the metric, creating it if needed."""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = LatencyHistogram(self.window)
+        return histogram
+
+    def observe(self, name: str, value: float) -> None:
+        """Add an observation to the metric."""
+        self.histogram(name).observe(value)
+
+    @contextmanager
+    def span(self, name: str):
+        """Measure the wall time of the block in milliseconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.observe(name, elapsed)
+            _LOGGER.debug("Stage '%s' took %.1f ms", name, elapsed)
+
+    def observe_ollama(self, response_data: dict) -> None:
+        """Record the timing and token count fields of a final Ollama response."""
+        for field, name in _OLLAMA_DURATIONS.items():
+            if field in response_data:
+                self.observe(name, response_data[field] / 1e6)
+        for field, name in _OLLAMA_COUNTS.items():
+            if field in response_data:
+                self.observe(name, response_data[field])
+
+    def summary(self, name: str) -> dict:
+        """Return the summary of the metric."""
+        return self.histogram(name).summary()
+
+    def as_dict(self) -> dict:
+        """Return the summaries of all the metrics with observations."""
+        return {name: histogram.summary() for name, histogram in self._histograms.items()}
@@ -1,31 +1,139 @@
 """ Music Assistant control for Home Assistant """
 
+import asyncio
 import logging
-from homeassistant.core import HomeAssistant
+from homeassistant.core import Event, HomeAssistant, State, callback
 from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.event import async_track_state_change_event
+
+from .playlist_catalog import PlaylistCatalog
+from .trace_recorder import trace_event
 
 _LOGGER = logging.getLogger(__name__)
 
+_DEFAULT_CONFIRM_TIMEOUT = 5  # Seconds to wait for the players to confirm a command
+_ACTIVE_STATES = ("playing", "paused", "buffering")
+
+
+def _confirms(service: str, before: State | None, after: State | None) -> bool:
+    """Return True if the player state after the service call shows it took effect."""
+    if after is None:
+        return False
+    if service in ("play_media", "media_play"):
+        return after.state == "playing"
+    if service == "media_pause":
+        return after.state == "paused"
+    if service == "media_stop":
+        return after.state not in _ACTIVE_STATES
+    if service == "turn_on":
+        return after.state != "off"
+    if service in ("media_next_track", "media_previous_track"):
+        # The track changes, the state may stay the same
+        title = before.attributes.get("media_title") if before else None
+        return after.attributes.get("media_title") != title
+    return True
+
 class MusicPlayerError(Exception):
     """Custom exception for MusicPlayer errors."""
 
+class MusicActionResult:
+    """
+    Structured result of a music player action, used to render the reply
+    to the user. str() gives a plain English description of the result.
+    """
+    _FIELDS = ("action", "entity_id", "entity_name", "playlist", "title", "artist", "album")
+    __slots__ = _FIELDS + ("confirmation",)
+
+    def __init__(self, action: str, entity_id: str, entity_name: str | None = None,
+                 playlist: str | None = None, title: str | None = None,
+                 artist: str | None = None, album: str | None = None,
+                 confirmation: asyncio.Task | None = None):
+        self.action = action
+        self.entity_id = entity_id
+        self.entity_name = entity_name or entity_id
+        self.playlist = playlist
+        self.title = title
+        self.artist = artist
+        self.album = album
+        # In the non-blocking mode, resolves to True once the players confirm the action
+        self.confirmation = confirmation
+
+    @property
+    def template_key(self) -> str:
+        """Return the key of the reply template for this result."""
+        if self.action == "info" and not self.title:
+            return "info_idle"
+        return self.action
+
+    def as_dict(self) -> dict:
+        """Return the result fields as a dictionary."""
+        return {name: getattr(self, name) for name in self._FIELDS}
+
+    def __str__(self) -> str:
+        messages = {
+            "play": f"Playing default playlist on {self.entity_id}.",
+            "load": f"Playing playlist '{self.playlist}' on {self.entity_id}.",
+            "stop": f"Playback stopped on {self.entity_id}.",
+            "pause": f"Playback paused on {self.entity_id}.",
+            "resume": f"Playback resumed on {self.entity_id}.",
+            "next": f"Skipped to next track on {self.entity_id}.",
+            "prev": f"Skipped to previous track on {self.entity_id}.",
+            "info": f"Now playing: {self.title} by {self.artist} on {self.entity_id}",
+            "info_idle": f"No media currently playing on {self.entity_id}",
+        }
+        return messages.get(self.template_key, f"{self.action} done on {self.entity_id}.")
+
+    def __repr__(self) -> str:
+        return f"MusicActionResult({self.as_dict()})"
+
 class MusicPlayer:
     """
-    A class to control a Home Assistant media_player entity,
+    A class to control Home Assistant media_player entities,
     specifically tailored for Music Assistant commands.
+
+    A command is sent to all the players at once, e.g. for multi-room playback.
+    In the blocking mode the service calls wait for the players to acknowledge.
+    In the non-blocking mode the calls are fired and the result carries a
+    confirmation task that waits for the expected player state change, with a
+    deadline, so the reply can be built meanwhile.
     """
-    def __init__(self, hass: HomeAssistant, entity_id: str, default_playlist_id: str = ""):
+    def __init__(self, hass: HomeAssistant, entity_ids: str | list[str],
+                 default_playlist_id: str = "", catalog: PlaylistCatalog | None = None,
+                 blocking: bool = True, confirm_timeout: float = _DEFAULT_CONFIRM_TIMEOUT):
         """
         Initialize the MusicPlayer.
 
         :param hass: The Home Assistant instance.
-        :param entity_id: The entity_id of the Music Assistant media_player.
+        :param entity_ids: The entity_id(s) of the Music Assistant media_players.
         :param default_playlist_id: The media_content_id for the default playlist
                (for 'play' action).
+        :param catalog: Optional playlist catalog resolving the requested playlist names.
+        :param blocking: Wait for the service calls to complete instead of
+               confirming them from the state changes.
+        :param confirm_timeout: Seconds to wait for the state change confirmation.
         """
         self.hass = hass
-        self.entity_id = entity_id
+        self.entity_ids = [entity_ids] if isinstance(entity_ids, str) else list(entity_ids)
         self.default_playlist_id = default_playlist_id
+        self.catalog = catalog
+        self.blocking = blocking
+        self.confirm_timeout = confirm_timeout
+        self.confirmed = 0
+        self.unconfirmed = 0
+
+    @property
+    def entity_id(self) -> str:
+        """Return the main player, e.g. for the media info."""
+        return self.entity_ids[0]
+
+    def stats(self) -> dict:
+        """Return the confirmation counters."""
+        return {
+            "entity_ids": self.entity_ids,
+            "blocking": self.blocking,
+            "confirmed": self.confirmed,
+            "unconfirmed": self.unconfirmed,
+        }
 
     def raise_error(self, message: str, cause_exception=None):
         """
@@ -41,11 +149,35 @@ class MusicPlayer:
             _LOGGER.error(message)
             raise MusicPlayerError(message)
 
-    async def parse_action(self, action: str) -> str:
+    def _result(self, action: str, **fields) -> MusicActionResult:
+        """Create the result of an action on the player entities."""
+        names = []
+        for entity_id in self.entity_ids:
+            state = self.hass.states.get(entity_id)
+            names.append(state.attributes.get("friendly_name", entity_id) if state else entity_id)
+        return MusicActionResult(action, ", ".join(self.entity_ids), ", ".join(names), **fields)
+
+    async def async_confirm(self, result: MusicActionResult) -> bool:
+        """
+        Wait for the confirmation of the action, True if confirmed or blocking.
+        The reply is optimistic, so an unconfirmed action is only logged.
+        """
+        if result.confirmation is None:
+            return True
+        confirmed = await result.confirmation
+        if confirmed:
+            self.confirmed += 1
+        else:
+            self.unconfirmed += 1
+            _LOGGER.warning("The %s action was not confirmed by %s within %s seconds",
+                            result.action, result.entity_id, self.confirm_timeout)
+        return confirmed
+
+    async def parse_action(self, action: str) -> MusicActionResult:
         """
         Parse the action string and call the appropriate method.
         :param action: The action string (e.g., "play", "load [playlist_name]", etc.)
-        :return: A message indicating the result of the action.
+        :return: The result of the action.
         """
 
         action = action.strip().lower()
@@ -67,11 +199,10 @@ class MusicPlayer:
             return await self.previous_track()
         elif action == "info":
             media_info = await self.get_current_media_info()
-            if media_info["title"]:
-                return f"Now playing: {media_info['title']} by " \
-                       f"{media_info['artist']} on {self.entity_id}"
-            else:
-                return f"No media currently playing on {self.entity_id}"
+            return self._result("info",
+                                title=media_info["title"],
+                                artist=media_info["artist"],
+                                album=media_info["album"])
         else:
             self.raise_error(f"Unknown action: {action}")
 
@@ -80,10 +211,13 @@ class MusicPlayer:
         Get information about the currently playing media.
         :return: Dictionary containing current media information.
         """
-        _LOGGER.debug("Getting current media info for %s", self.entity_id)
+        _LOGGER.debug("Getting current media info for %s", self.entity_ids)
 
         try:
-            state = self.hass.states.get(self.entity_id)
+            states = [self.hass.states.get(entity_id) for entity_id in self.entity_ids]
+            # The first player playing something, or the main player
+            state = next((state for state in states
+                          if state and state.attributes.get("media_title")), states[0])
             if not state:
                 self.raise_error(f"Entity {self.entity_id} not found")
 
@@ -103,44 +237,95 @@ class MusicPlayer:
         except Exception as e: # pylint: disable=broad-except
             self.raise_error(f"Failed to get media info for {self.entity_id}", cause_exception=e)
 
-    async def _call_service(self, service_name: str, data: dict | None = None) -> None:
+    async def _call_service(self, service_name: str, data: dict | None = None,
+                            entity_ids: list[str] | None = None) -> asyncio.Task | None:
         """
-        Helper method to call media_player services.
+        Helper method to call media_player services for the players.
         Raises MusicPlayerError on failure.
+
+        :param service_name: The media_player service.
+        :param data: The service data.
+        :param entity_ids: The players, all of them by default.
+        :return: None in the blocking mode, otherwise a task resolving to True once
+                 the players confirm the call through their state, False on timeout.
         """
         if data is None:
             data = {}
+        if entity_ids is None:
+            entity_ids = self.entity_ids
 
         _LOGGER.debug(
             "Calling media_player.%s for %s with data: %s",
-            service_name, self.entity_id, data
+            service_name, entity_ids, data
         )
+        trace_event("service", domain="media_player", service=service_name, data=data,
+                    entity_ids=entity_ids)
+        confirmation = None
+        if not self.blocking:
+            # Listen before the call, so a fast state change isn't missed
+            confirmation = self._confirmation(service_name, entity_ids)
         try:
             await self.hass.services.async_call(
                 domain="media_player",
                 service=service_name,
                 service_data=data,
-                blocking=True,  # Wait for the service call to complete
-                target={"entity_id": self.entity_id}
+                blocking=self.blocking,
+                target={"entity_id": entity_ids}
             )
             _LOGGER.info(
                 "Successfully called media_player.%s for %s",
-                service_name, self.entity_id
+                service_name, entity_ids
             )
         except HomeAssistantError as e:
-            self.raise_error(f"Failed to call media_player.{service_name} for {self.entity_id}.",
+            if confirmation is not None:
+                confirmation.cancel()
+            self.raise_error(f"Failed to call media_player.{service_name} for {entity_ids}.",
                              cause_exception=e)
         except Exception as e: # pylint: disable=broad-except
+            if confirmation is not None:
+                confirmation.cancel()
             self.raise_error(f"Unexpected error calling media_player.{service_name} "
-                             f"for {self.entity_id}.",
+                             f"for {entity_ids}.",
                              cause_exception=e)
+        return confirmation
+
+    def _confirmation(self, service_name: str, entity_ids: list[str]) -> asyncio.Task:
+        """Start waiting for the state changes confirming the service call."""
+        before = {entity_id: self.hass.states.get(entity_id) for entity_id in entity_ids}
+        pending = {entity_id for entity_id, state in before.items()
+                   if service_name.endswith("_track") or
+                   not _confirms(service_name, state, state)}
+        done = self.hass.loop.create_future()
+
+        @callback
+        def _state_changed(event: Event) -> None:
+            entity_id = event.data["entity_id"]
+            if entity_id in pending and \
+               _confirms(service_name, before[entity_id], event.data["new_state"]):
+                pending.discard(entity_id)
+                if not pending and not done.done():
+                    done.set_result(True)
+
+        unsubscribe = async_track_state_change_event(self.hass, list(pending), _state_changed)
 
-    async def play_default(self) -> str:
+        async def _wait() -> bool:
+            try:
+                if pending:
+                    await asyncio.wait_for(done, self.confirm_timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                unsubscribe()
+
+        return self.hass.async_create_task(_wait(), f"confirm media_player.{service_name}")
+
+    async def play_default(self) -> MusicActionResult:
         """
         Handles the 'play' action: Powers on the player and loads the default playlist.
         If no default playlist is configured, attempts a generic 'media_play'.
         """
-        _LOGGER.info("Executing 'play default' action for %s.", self.entity_id)
+        _LOGGER.info("Executing 'play default' action for %s.", self.entity_ids)
         #await self._call_service("turn_on") # Ensure player is on
 
         #if not self.default_playlist_id:
@@ -155,52 +340,66 @@ class MusicPlayer:
             "media_content_id": self.default_playlist_id,
             "media_content_type": "playlist", # Assuming default is a playlist
         }
-        await self._call_service("play_media", service_data)
-        return f"Playing default playlist on {self.entity_id}."
+        confirmation = await self._call_service("play_media", service_data)
+        return self._result("play", playlist=self.default_playlist_id, confirmation=confirmation)
 
-    async def load_playlist(self, playlist_name: str) -> str:
+    async def load_playlist(self, playlist_name: str) -> MusicActionResult:
         """
         Handles the 'load [playlist_name]' action: Loads and plays a specific playlist.
         """
-        _LOGGER.info("Executing 'load playlist: %s' for %s.", playlist_name, self.entity_id)
-        await self._call_service("turn_on") # Ensure player is on
+        _LOGGER.info("Executing 'load playlist: %s' for %s.", playlist_name, self.entity_ids)
+        media_content_id = playlist_name
+        if self.catalog is not None:
+            # A close enough name is mapped to the real playlist, otherwise
+            # Music Assistant searches with the name as it is
+            playlist = await self.catalog.async_resolve(playlist_name)
+            if playlist is not None:
+                playlist_name, media_content_id = playlist.name, playlist.uri
+
+        # Ensure the players are on, only the ones that are off need to be waited for
+        off = [entity_id for entity_id in self.entity_ids
+               if (state := self.hass.states.get(entity_id)) is None or state.state == "off"]
+        if off:
+            turned_on = await self._call_service("turn_on", entity_ids=off)
+            if turned_on is not None and not await turned_on:
+                _LOGGER.warning("Players %s didn't turn on in time, loading anyway", off)
 
         service_data = {
-            "media_content_id": playlist_name,
+            "media_content_id": media_content_id,
             "media_content_type": "playlist",
             "enqueue": "replace" # Typically, loading a new playlist replaces the current queue
         }
-        await self._call_service("play_media", service_data)
-        return f"Playing playlist '{playlist_name}' on {self.entity_id}."
+        confirmation = await self._call_service("play_media", service_data)
+        return self._result("load", playlist=playlist_name, confirmation=confirmation)
 
-    async def stop(self) -> str:
+    async def stop(self) -> MusicActionResult:
         """Handles the 'stop' action: Stops playback."""
-        _LOGGER.info("Executing 'stop' action for %s.", self.entity_id)
-        await self._call_service("media_stop")
+        _LOGGER.info("Executing 'stop' action for %s.", self.entity_ids)
+        confirmation = await self._call_service("media_stop")
         # If "powers down the needed devices" implies turning off the player:
         # await self._call_service("turn_off")
-        return f"Playback stopped on {self.entity_id}."
+        return self._result("stop", confirmation=confirmation)
 
-    async def pause(self) -> str:
+    async def pause(self) -> MusicActionResult:
         """Handles the 'pause' action: Pauses playback."""
-        _LOGGER.info("Executing 'pause' action for %s.", self.entity_id)
-        await self._call_service("media_pause")
-        return f"Playback paused on {self.entity_id}."
+        _LOGGER.info("Executing 'pause' action for %s.", self.entity_ids)
+        confirmation = await self._call_service("media_pause")
+        return self._result("pause", confirmation=confirmation)
 
-    async def resume(self) -> str:
+    async def resume(self) -> MusicActionResult:
         """Handles the 'resume' action: Resumes playback (uses media_play)."""
-        _LOGGER.info("Executing 'resume' action for %s.", self.entity_id)
-        await self._call_service("media_play")
-        return f"Playback resumed on {self.entity_id}."
+        _LOGGER.info("Executing 'resume' action for %s.", self.entity_ids)
+        confirmation = await self._call_service("media_play")
+        return self._result("resume", confirmation=confirmation)
 
-    async def next_track(self) -> str:
+    async def next_track(self) -> MusicActionResult:
         """Handles the 'next' action: Skips to the next track."""
-        _LOGGER.info("Executing 'next track' action for %s.", self.entity_id)
-        await self._call_service("media_next_track")
-        return f"Skipped to next track on {self.entity_id}."
+        _LOGGER.info("Executing 'next track' action for %s.", self.entity_ids)
+        confirmation = await self._call_service("media_next_track")
+        return self._result("next", confirmation=confirmation)
 
-    async def previous_track(self) -> str:
+    async def previous_track(self) -> MusicActionResult:
         """Handles the 'prev' action: Skips to the previous track."""
-        _LOGGER.info("Executing 'previous track' action for %s.", self.entity_id)
-        await self._call_service("media_previous_track")
-        return f"Skipped to previous track on {self.entity_id}."
+        _LOGGER.info("Executing 'previous track' action for %s.", self.entity_ids)
+        confirmation = await self._call_service("media_previous_track")
+        return self._result("prev", confirmation=confirmation)
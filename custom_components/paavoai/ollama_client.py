@@ -1,67 +1,385 @@
 """Ollama Client for Home Assistant integration."""
 
+import asyncio
 import logging
 import json
 import re
-import requests
+from typing import AsyncIterator, Callable
+
+import aiohttp
 
 _LOGGER = logging.getLogger(__name__)
 
+_DEFAULT_TIMEOUT = 30  # Seconds for a single generation request
+_PROBE_TIMEOUT = 5     # Seconds for the health probe
+_WARM_UP_TIMEOUT = 300 # Seconds for loading the model into memory
+
 class OllamaClientError(Exception):
     """Custom exception for Ollama client errors."""
 
+class OllamaServerError(OllamaClientError):
+    """Raised when the server is unreachable, times out or fails with a 5xx status."""
+
 class OllamaClient:
     """Client for interacting with the Ollama API."""
-    def __init__(self, host, port, model):
+    def __init__(self, host, port, model, session: aiohttp.ClientSession | None = None,
+                 timeout: float = _DEFAULT_TIMEOUT, keep_alive: str | int | None = None,
+                 metrics=None):
+        """
+        Initialize the Ollama client.
+
+        :param host: Hostname or IP address of the Ollama server.
+        :param port: Port of the Ollama server.
+        :param model: The model used for the generation requests.
+        :param session: Shared aiohttp session (e.g. Home Assistant's
+               async_get_clientsession). A private session is created if not given.
+        :param timeout: Default timeout in seconds for a single request.
+        :param keep_alive: How long the server keeps the model loaded after a
+               request (e.g. "30m" or -1 for forever). Server default if None.
+        :param metrics: Optional PaavoAIMetrics for the Ollama timings and token counts.
+        """
         self.base_url = f"http://{host}:{port}"
         self.model = model
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.metrics = metrics
+        self._session = session
+        self._owns_session = session is None
+        self._ready = asyncio.Event()
+
+    @property
+    def ready(self) -> bool:
+        """Return True once the model is known to be loaded."""
+        return self._ready.is_set()
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """
+        Wait until the model is loaded.
+        :param timeout: Maximum time to wait in seconds.
+        :return: True if the model is loaded, False on timeout.
+        """
+        if self._ready.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
 
-    def raise_error(self, message: str, cause_exception=None):
-        """Helper method to log error and raise OllamaClientError."""
+    def raise_error(self, message: str, cause_exception=None,
+                    error_class: type[OllamaClientError] = OllamaClientError):
+        """Helper method to log error and raise OllamaClientError (or the given subclass)."""
 
         if cause_exception:
             message = f"{message} Error: {str(cause_exception)}"
             _LOGGER.error(message)
-            raise OllamaClientError(message) from cause_exception
+            raise error_class(message) from cause_exception
         else:
             _LOGGER.error(message)
-            raise OllamaClientError(message)
+            raise error_class(message)
 
-    def send_request(self, prompt: str) -> str:
-        """Send a request to the Ollama API and return the response."""
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Return the HTTP session, creating a private one if none was given."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+            self._owns_session = True
+        return self._session
 
-        # TODO: Use Ollama's API to disable thinking mode
-        prompt = prompt.strip() + "\n/nothink"
+    async def close(self) -> None:
+        """Close the HTTP session if it is owned by this client."""
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
 
-        api_url = f"{self.base_url}/api/generate"
-        payload = {"prompt": prompt, "model": self.model, "stream": False}
+    async def check_model(self) -> None:
+        """
+        Check quickly that the server is reachable and has the configured model,
+        without loading the model. Raises OllamaClientError on failure.
+        """
+        api_url = f"{self.base_url}/api/tags"
+        try:
+            async with self._get_session().get(
+                    api_url, timeout=aiohttp.ClientTimeout(total=_PROBE_TIMEOUT)) as response:
+                if response.status != 200:
+                    self.raise_error(f"Failed to list the models at {self.base_url}.\n"
+                                     f"Status code: {response.status}.")
+                tags = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.raise_error(f"Failed to connect to Ollama at {self.base_url}.", e)
 
-        _LOGGER.debug("Sending request to Ollama: URL=%s, Payload=%s", api_url, json.dumps(payload))
+        names = {model.get("name") for model in tags.get("models", [])}
+        names |= {model.get("model") for model in tags.get("models", [])}
+        if self.model not in names and f"{self.model}:latest" not in names:
+            self.raise_error(f"Model '{self.model}' not found at {self.base_url}. "
+                             f"Available models: {', '.join(sorted(filter(None, names)))}")
 
+    async def loaded_models(self) -> set[str]:
+        """
+        Return the names of the models loaded in memory (/api/ps), a cheap health
+        probe. Raises OllamaClientError on failure.
+        """
+        api_url = f"{self.base_url}/api/ps"
         try:
-            response = requests.post(api_url, json=payload, timeout=30)
-        except Exception as e: # pylint: disable=broad-except
+            async with self._get_session().get(
+                    api_url, timeout=aiohttp.ClientTimeout(total=_PROBE_TIMEOUT)) as response:
+                if response.status != 200:
+                    self.raise_error(f"Failed to list the loaded models at {self.base_url}.\n"
+                                     f"Status code: {response.status}.")
+                running = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
             self.raise_error(f"Failed to connect to Ollama at {self.base_url}.", e)
 
-        _LOGGER.debug("Ollama response status: %s, response: %s",
-                      response.status_code,
-                      response.json().get("response"))
+        loaded = {model.get("name") for model in running.get("models", [])}
+        loaded |= {model.get("model") for model in running.get("models", [])}
+        if self.model in loaded or f"{self.model}:latest" in loaded:
+            # Loaded by someone else, e.g. after a restart of Home Assistant
+            self._ready.set()
+        return set(filter(None, loaded))
 
-        if response.status_code == 200:
-            try:
-                response_data = response.json().get("response")
-                response_text = re.sub(r"<think>.*?</think>\s*",
-                                       "",
-                                       response_data,
-                                       flags=re.DOTALL).strip()
-
-                return response_text
-            except Exception as exc: # pylint: disable=broad-except
-                self.raise_error("An error occurred while processing the json response.\n"
-                                 f"Response: {response.text}.\n", exc)
-        else:
+    async def warm_up(self) -> None:
+        """
+        Load the model into memory with an empty generation request.
+        The model is marked ready when done, also on failure so that the
+        requests are not held back forever.
+        """
+        api_url = f"{self.base_url}/api/generate"
+        payload = {"model": self.model, "prompt": "", "stream": False}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+
+        _LOGGER.debug("Loading model %s at %s", self.model, self.base_url)
+        try:
+            async with self._get_session().post(
+                    api_url, json=payload,
+                    timeout=aiohttp.ClientTimeout(total=_WARM_UP_TIMEOUT)) as response:
+                await response.read()
+                if response.status != 200:
+                    _LOGGER.error("Failed to load model %s at %s. Status code: %s",
+                                  self.model, self.base_url, response.status)
+                else:
+                    _LOGGER.info("Model %s loaded at %s", self.model, self.base_url)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            _LOGGER.error("Failed to load model %s at %s: %s", self.model, self.base_url, e)
+        finally:
+            self._ready.set()
+
+    async def send_request(self, prompt: str, timeout: float | None = None,
+                           stop_when: Callable[[str], bool] | None = None,
+                           fmt: dict | str | None = None,
+                           think: bool | None = None,
+                           stats: dict | None = None,
+                           num_predict: int | None = None) -> str:
+        """
+        Send a request to the Ollama API and return the response.
+
+        The request is cancelled (and the connection dropped) if the calling
+        task is cancelled.
+
+        :param prompt: The prompt to send.
+        :param timeout: Optional per-call timeout in seconds, overrides the default.
+        :param stop_when: Optional predicate for streaming mode. The response is
+               streamed and the generation is stopped as soon as the predicate
+               returns True for the complete lines received so far (thinking removed).
+        :param fmt: Optional output format, "json" or a JSON schema the reply must follow.
+        :param think: Enable or disable thinking through the API. If None, thinking
+               is disabled with the '/nothink' prompt suffix for older servers.
+        :param stats: Optional dict updated with the number of generated tokens
+               ('eval_count'), also as they are streamed in case the request is cancelled.
+        :param num_predict: Optional maximum number of tokens to generate.
+        """
+
+        prompt = prompt.strip()
+        if think is None:
+            prompt += "\n/nothink"
+
+        api_url = f"{self.base_url}/api/generate"
+        payload = {"prompt": prompt, "model": self.model, "stream": stop_when is not None}
+        if think is not None:
+            payload["think"] = think
+        if fmt is not None:
+            payload["format"] = fmt
+        if num_predict is not None:
+            payload["options"] = {"num_predict": num_predict}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+
+        # Formatted only if the debug logging is enabled
+        _LOGGER.debug("Sending request to Ollama: URL=%s, Payload=%s", api_url, payload)
+
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        try:
+            async with self._get_session().post(api_url, json=payload,
+                                                timeout=client_timeout) as response:
+                status = response.status
+                if status == 200:
+                    # The model is evidently loaded
+                    self._ready.set()
+                if status == 200 and stop_when is not None:
+                    return await self._read_stream(response, stop_when, stats)
+                response_body = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.raise_error(f"Failed to connect to Ollama at {self.base_url}.", e,
+                             OllamaServerError)
+
+        if status != 200:
             self.raise_error(
                 f"Failed to get a valid response from Ollama.\n"
-                f"Status code: {response.status_code}.\n"
-                f"Response: {response.text}"
+                f"Status code: {status}.\n"
+                f"Response: {response_body}",
+                error_class=OllamaServerError if status >= 500 else OllamaClientError
             )
+
+        try:
+            response_json = json.loads(response_body)
+            response_data = response_json.get("response")
+            _LOGGER.debug("Ollama response status: %s, response: %s", status, response_data)
+            if self.metrics is not None:
+                self.metrics.observe_ollama(response_json)
+            if stats is not None:
+                stats["eval_count"] = response_json.get("eval_count", 0)
+            return _strip_thinking(response_data)
+        except Exception as exc: # pylint: disable=broad-except
+            self.raise_error("An error occurred while processing the json response.\n"
+                             f"Response: {response_body}.\n", exc)
+
+    async def stream_request(self, prompt: str, timeout: float | None = None,
+                             think: bool | None = None) -> AsyncIterator[str]:
+        """
+        Send a request to the Ollama API and yield the response text as it is
+        generated, without the thinking. Closing the iterator early drops the
+        connection, which aborts the generation on the server.
+
+        :param prompt: The prompt to send.
+        :param timeout: Optional per-call timeout in seconds, overrides the default.
+        :param think: Enable or disable thinking through the API. If None, thinking
+               is disabled with the '/nothink' prompt suffix for older servers.
+        """
+        prompt = prompt.strip()
+        if think is None:
+            prompt += "\n/nothink"
+
+        api_url = f"{self.base_url}/api/generate"
+        payload = {"prompt": prompt, "model": self.model, "stream": True}
+        if think is not None:
+            payload["think"] = think
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+
+        _LOGGER.debug("Streaming request to Ollama: URL=%s, Payload=%s", api_url, payload)
+
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        response_data = ""
+        emitted = 0
+        try:
+            async with self._get_session().post(api_url, json=payload,
+                                                timeout=client_timeout) as response:
+                if response.status != 200:
+                    self.raise_error(
+                        f"Failed to get a valid response from Ollama.\n"
+                        f"Status code: {response.status}.\n"
+                        f"Response: {await response.text()}",
+                        error_class=OllamaServerError if response.status >= 500
+                        else OllamaClientError
+                    )
+                self._ready.set()
+                async for line in response.content:
+                    if not line.strip():
+                        continue
+                    try:
+                        chunk = json.loads(line)
+                    except ValueError as exc:
+                        self.raise_error(f"Invalid line in the Ollama stream: {line!r}.", exc)
+                    if "error" in chunk:
+                        self.raise_error(f"Ollama returned an error: {chunk['error']}")
+
+                    response_data += chunk.get("response", "")
+                    # Only the text outside the thinking is yielded
+                    visible = _strip_thinking(response_data)
+                    if len(visible) > emitted:
+                        yield visible[emitted:]
+                        emitted = len(visible)
+                    if chunk.get("done"):
+                        if self.metrics is not None:
+                            self.metrics.observe_ollama(chunk)
+                        break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.raise_error(f"Failed to connect to Ollama at {self.base_url}.", e,
+                             OllamaServerError)
+
+        _LOGGER.debug("Ollama streamed response: %s", response_data)
+
+    async def embed(self, texts: list[str], model: str,
+                    timeout: float | None = None) -> list[list[float]]:
+        """
+        Return the embedding vectors of the texts (/api/embed).
+
+        :param texts: The texts to embed, in a single batch.
+        :param model: The embedding model, usually not the generation model.
+        :param timeout: Optional timeout in seconds, overrides the default.
+        """
+        api_url = f"{self.base_url}/api/embed"
+        payload = {"model": model, "input": texts}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        try:
+            async with self._get_session().post(api_url, json=payload,
+                                                timeout=client_timeout) as response:
+                if response.status != 200:
+                    self.raise_error(f"Failed to get the embeddings from Ollama.\n"
+                                     f"Status code: {response.status}.\n"
+                                     f"Response: {await response.text()}")
+                response_json = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.raise_error(f"Failed to connect to Ollama at {self.base_url}.", e)
+
+        embeddings = response_json.get("embeddings")
+        if not isinstance(embeddings, list) or len(embeddings) != len(texts):
+            self.raise_error(f"Invalid embeddings returned by Ollama for {len(texts)} texts.")
+        return embeddings
+
+    async def _read_stream(self, response: aiohttp.ClientResponse,
+                           stop_when: Callable[[str], bool], stats: dict | None = None) -> str:
+        """
+        Read the NDJSON token stream until it is done or stop_when matches.
+        Stopping early closes the connection, which aborts the generation on the server.
+        """
+        response_data = ""
+        tokens = 0
+        async for line in response.content:
+            if not line.strip():
+                continue
+            try:
+                chunk = json.loads(line)
+            except ValueError as exc:
+                self.raise_error(f"Invalid line in the Ollama stream: {line!r}.", exc)
+            if "error" in chunk:
+                self.raise_error(f"Ollama returned an error: {chunk['error']}")
+
+            token = chunk.get("response", "")
+            response_data += token
+            tokens += 1
+            if stats is not None:
+                stats["eval_count"] = tokens
+            if chunk.get("done"):
+                if self.metrics is not None:
+                    self.metrics.observe_ollama(chunk)
+                break
+            # Only the lines terminated by a newline are complete
+            if "\n" in token and \
+               stop_when(_strip_thinking(response_data[:response_data.rfind("\n")])):
+                _LOGGER.debug("Stopping the Ollama generation early after %d tokens", tokens)
+                response.close()
+                if self.metrics is not None:
+                    # No final statistics from the server, count the streamed tokens
+                    self.metrics.observe("ollama_eval_count", tokens)
+                break
+
+        _LOGGER.debug("Ollama streamed response: %s", response_data)
+        return _strip_thinking(response_data)
+
+
+def _strip_thinking(text: str) -> str:
+    """Remove the <think> blocks, including a still unterminated one, from the text."""
+    text = re.sub(r"<think>.*?</think>\s*", "", text, flags=re.DOTALL)
+    return text.split("<think>")[0].strip()
@@ -0,0 +1,246 @@
+""" Cached catalog of the Music Assistant playlists with fuzzy name resolution """
+
+import logging
+import time
+import unicodedata
+from datetime import timedelta
+from difflib import SequenceMatcher
+from typing import Callable
+
+from homeassistant.config_entries import ConfigEntryState
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.event import async_track_time_interval
+
+from .fast_path import normalize_utterance
+
+_LOGGER = logging.getLogger(__name__)
+
+_MA_DOMAIN = "music_assistant"
+_DEFAULT_REFRESH_INTERVAL = 3600  # Seconds between the background refreshes
+_DEFAULT_MIN_REFRESH = 60         # Seconds before an on-demand refresh after a miss
+_DEFAULT_THRESHOLD = 0.75         # Minimum similarity of a fuzzy match
+_DEFAULT_LIMIT = 500              # Playlists fetched from the library
+_STEM_LENGTH = 4                  # Word prefix shared by the inflected forms (kesä-)
+
+
+def fold_name(text: str) -> str:
+    """Normalize a name for matching: lowercase, no punctuation nor accents (ä -> a)."""
+    decomposed = unicodedata.normalize("NFKD", normalize_utterance(text))
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+class PlaylistCatalogError(Exception):
+    """Custom exception for playlist catalog errors."""
+
+
+def _stems(words: list[str]) -> set[str]:
+    """Return the word prefixes used for finding the candidate playlists."""
+    return {word[:_STEM_LENGTH] for word in words}
+
+
+class Playlist:
+    """A playlist in the library."""
+    __slots__ = ("name", "uri", "folded", "size")
+
+    def __init__(self, name: str, uri: str):
+        self.name = name
+        self.uri = uri
+        self.folded = fold_name(name)
+        self.size = max(len(self.folded.split()), 1)  # Words in the name
+
+    def __repr__(self) -> str:
+        return f"Playlist({self.name!r}, {self.uri!r})"
+
+
+def _similarity(folded_query: str, playlist: Playlist) -> float:
+    """Return the similarity of a folded query and the playlist name."""
+    if folded_query == playlist.folded:
+        return 1.0
+    return SequenceMatcher(None, folded_query, playlist.folded).ratio()
+
+
+class PlaylistCatalog:
+    """
+    In-memory index of the Music Assistant playlists.
+
+    The library is fetched through the music_assistant.get_library service,
+    refreshed in the background and on demand when a name is not found.
+    Names are resolved locally with accent-insensitive fuzzy matching, so a
+    slightly wrong name from the LLM still plays the right playlist.
+    """
+    def __init__(self, hass: HomeAssistant, config: dict | None = None):
+        """
+        Initialize the catalog, the playlists are fetched by async_refresh().
+
+        :param hass: The Home Assistant instance.
+        :param config: The [music] section of paavoai.toml.
+        """
+        self.hass = hass
+        self.refresh_interval = None
+        self._playlists = []
+        self._by_stem = {}  # Word prefix -> playlists with a word starting with it
+        self._refreshed_at = None  # time.monotonic() of the last refresh
+        self._refreshing = None
+        self._unsub_refresh = None
+        self.resolved = 0
+        self.unresolved = 0
+        self.configure(config)
+
+    def configure(self, config: dict | None) -> None:
+        """Apply the [music] section of a (re)loaded paavoai.toml."""
+        config = config or {}
+        self.threshold = config.get("playlist_match_threshold", _DEFAULT_THRESHOLD)
+        self.limit = config.get("playlist_limit", _DEFAULT_LIMIT)
+        refresh_interval = config.get("playlist_refresh_interval", _DEFAULT_REFRESH_INTERVAL)
+        if refresh_interval != self.refresh_interval:
+            self.refresh_interval = refresh_interval
+            if self._unsub_refresh is not None:
+                # Restarted with the new interval
+                self._unsub_refresh()
+                self._track_refresh()
+
+    def __len__(self) -> int:
+        return len(self._playlists)
+
+    def raise_error(self, message: str, cause_exception=None):
+        """Helper method to log error and raise PlaylistCatalogError."""
+        if cause_exception:
+            message = f"{message} Error: {str(cause_exception)}"
+            _LOGGER.error(message)
+            raise PlaylistCatalogError(message) from cause_exception
+        else:
+            _LOGGER.error(message)
+            raise PlaylistCatalogError(message)
+
+    def _config_entry_id(self) -> str | None:
+        """Return the loaded Music Assistant config entry, if any."""
+        for entry in self.hass.config_entries.async_entries(_MA_DOMAIN):
+            if entry.state is ConfigEntryState.LOADED:
+                return entry.entry_id
+        return None
+
+    async def async_refresh(self) -> None:
+        """Fetch the playlists from the Music Assistant library."""
+        if self._refreshing is not None:
+            # Join the refresh in progress
+            await self._refreshing
+            return
+        self._refreshing = self.hass.loop.create_future()
+        try:
+            await self._fetch()
+        finally:
+            self._refreshing.set_result(None)
+            self._refreshing = None
+
+    async def _fetch(self) -> None:
+        entry_id = self._config_entry_id()
+        if entry_id is None:
+            self.raise_error("Music Assistant is not set up, no playlists available")
+        try:
+            response = await self.hass.services.async_call(
+                _MA_DOMAIN, "get_library",
+                {"config_entry_id": entry_id, "media_type": "playlist", "limit": self.limit},
+                blocking=True, return_response=True)
+        except (HomeAssistantError, ValueError) as e:
+            self.raise_error("Failed to get the playlists from Music Assistant.", e)
+
+        playlists = [Playlist(item["name"], item.get("uri") or item["name"])
+                     for item in (response or {}).get("items", []) if item.get("name")]
+        by_stem = {}
+        for playlist in playlists:
+            for stem in _stems(playlist.folded.split()):
+                by_stem.setdefault(stem, []).append(playlist)
+        self._playlists = playlists
+        self._by_stem = by_stem
+        self._refreshed_at = time.monotonic()
+        _LOGGER.debug("Playlist catalog refreshed, %d playlists", len(playlists))
+
+    @callback
+    def async_start_refreshing(self) -> Callable[[], None]:
+        """Start the background refreshes, returns a function stopping them."""
+        self._track_refresh()
+
+        @callback
+        def _stop() -> None:
+            if self._unsub_refresh is not None:
+                self._unsub_refresh()
+                self._unsub_refresh = None
+
+        return _stop
+
+    def _track_refresh(self) -> None:
+        """Schedule the background refreshes at the current interval."""
+        async def _async_refresh(_now) -> None:
+            try:
+                await self.async_refresh()
+            except PlaylistCatalogError:
+                pass  # Logged, the previous catalog is kept
+
+        self._unsub_refresh = async_track_time_interval(
+            self.hass, _async_refresh, timedelta(seconds=self.refresh_interval))
+
+    def resolve(self, name: str) -> Playlist | None:
+        """Return the playlist best matching the name, or None below the threshold."""
+        folded = fold_name(name)
+        if not folded or not self._playlists:
+            return None
+        score, playlist = max(((_similarity(folded, playlist), playlist)
+                               for playlist in self._playlists), key=lambda item: item[0])
+        return playlist if score >= self.threshold else None
+
+    async def async_resolve(self, name: str) -> Playlist | None:
+        """
+        Resolve the name, refreshing the catalog first if it was not found and the
+        catalog is not fresh, e.g. for a playlist created after the last refresh.
+        """
+        playlist = self.resolve(name)
+        stale = self._refreshed_at is None or \
+            time.monotonic() - self._refreshed_at > _DEFAULT_MIN_REFRESH
+        if playlist is None and stale:
+            try:
+                await self.async_refresh()
+            except PlaylistCatalogError:
+                pass  # Logged, resolve with what we have
+            playlist = self.resolve(name)
+
+        if playlist is None:
+            self.unresolved += 1
+            _LOGGER.debug("No playlist matching '%s'", name)
+        else:
+            self.resolved += 1
+            _LOGGER.debug("Playlist '%s' resolved to '%s'", name, playlist.name)
+        return playlist
+
+    def candidates(self, utterance: str, count: int) -> list[str]:
+        """
+        Return the names of the playlists most similar to some part of the
+        utterance, for the LLM prompt. Only the playlists sharing a word prefix
+        with the utterance are scored.
+        """
+        words = fold_name(utterance).split()
+        if not words:
+            return []
+        matching = {id(playlist): playlist for stem in _stems(words)
+                    for playlist in self._by_stem.get(stem, ())}
+
+        def score(playlist: Playlist) -> float:
+            # Best match against the word windows of the playlist name's length
+            size = playlist.size
+            windows = {" ".join(words[i:i + size])
+                       for i in range(max(len(words) - size + 1, 1))}
+            return max(SequenceMatcher(None, window, playlist.folded).ratio()
+                       for window in windows)
+
+        ranked = sorted(matching.values(), key=score, reverse=True)
+        return [playlist.name for playlist in ranked[:count]]
+
+    def stats(self) -> dict:
+        """Return the catalog counters."""
+        return {
+            "playlists": len(self._playlists),
+            "refreshed_seconds_ago": None if self._refreshed_at is None else
+                                     round(time.monotonic() - self._refreshed_at),
+            "resolved": self.resolved,
+            "unresolved": self.unresolved,
+        }
@@ -0,0 +1,238 @@
+""" Compiled prompt templates loaded from paavoai.toml, with hot-reload """
+
+import hashlib
+import logging
+import os
+import re
+import tomllib
+from datetime import timedelta
+from typing import Callable
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_track_time_interval
+
+from .fast_path import FastPathError, FastPathMatcher
+from .replies import ReplyTemplateError, ReplyTemplates
+
+_LOGGER = logging.getLogger(__name__)
+
+_WATCH_INTERVAL = timedelta(seconds=10)
+
+# Prompt name -> (required placeholders, optional placeholders). Only these names
+# are substituted, so other braces (e.g. JSON examples) are kept as they are.
+PROMPT_PLACEHOLDERS = {
+    "topic_get_prompt": ({"conversation_history"}, set()),
+    "music_get_action_prompt": ({"conversation_history"}, {"playlists"}),
+    "classify_prompt": ({"conversation_history"}, {"playlists"}),
+    "user_error_prompt": ({"conversation_history", "message"}, set()),
+    "user_reply_prompt": ({"conversation_history", "message"}, set()),
+    "sensor_prompt": ({"conversation_history", "sensors"}, set()),
+    "lights_prompt": ({"conversation_history", "areas"}, set()),
+    "summary_prompt": ({"conversation_history"}, {"summary"}),
+}
+# Prompts that must exist in the [conversation] section
+REQUIRED_PROMPTS = ("topic_get_prompt", "music_get_action_prompt",
+                    "user_error_prompt", "user_reply_prompt")
+
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+
+class PromptError(Exception):
+    """Custom exception for invalid prompt templates or configuration."""
+
+
+class CompiledPrompt:
+    """A prompt template split once into literal segments and placeholders."""
+    __slots__ = ("name", "version", "placeholders", "_segments")
+
+    def __init__(self, name: str, template: str, required: set, optional: set):
+        """
+        Compile the template.
+
+        :param name: The name of the prompt in the [conversation] section.
+        :param template: The prompt template.
+        :param required: Placeholders that must be present in the template.
+        :param optional: Placeholders that may be present in the template.
+        """
+        self.name = name
+        self.version = hashlib.sha1(template.encode()).hexdigest()[:12]
+
+        known = required | optional
+        segments = []  # Literal strings and (placeholder,) tuples
+        position = 0
+        found = set()
+        for match in _PLACEHOLDER_RE.finditer(template):
+            if match.group(1) not in known:
+                continue
+            segments.append(template[position:match.start()])
+            segments.append((match.group(1),))
+            found.add(match.group(1))
+            position = match.end()
+        segments.append(template[position:])
+
+        missing = required - found
+        if missing:
+            raise PromptError(f"Prompt '{name}' is missing the placeholders: "
+                              f"{', '.join('{' + p + '}' for p in sorted(missing))}")
+        self.placeholders = frozenset(found)
+        self._segments = tuple(s for s in segments if s != "")
+
+    def render(self, **values) -> str:
+        """Render the prompt, all the placeholders present in the template must be given."""
+        try:
+            return "".join(s if isinstance(s, str) else values[s[0]] for s in self._segments)
+        except KeyError as e:
+            raise PromptError(f"No value for the placeholder {e} of prompt '{self.name}'") from e
+
+
+class _Snapshot:
+    """The loaded configuration and compiled prompts, replaced as a whole on reload."""
+    __slots__ = ("config", "prompts", "mtime")
+
+    def __init__(self, config: dict, prompts: dict, mtime: float | None):
+        self.config = config
+        self.prompts = prompts
+        self.mtime = mtime
+
+
+def _compile(config: dict, mtime: float | None = None) -> _Snapshot:
+    """Validate the configuration and compile the prompts."""
+    conversation = config.get("conversation")
+    if not isinstance(conversation, dict):
+        raise PromptError("paavoai.toml is empty or the [conversation] section is missing.")
+
+    for name in REQUIRED_PROMPTS:
+        if not conversation.get(name):
+            raise PromptError(f"'{name}' under [conversation] is missing or empty.")
+    if conversation.get("classification") == "structured" and \
+       not conversation.get("classify_prompt"):
+        raise PromptError("'classify_prompt' under [conversation] is required for "
+                          "the structured classification.")
+
+    prompts = {}
+    for name, (required, optional) in PROMPT_PLACEHOLDERS.items():
+        if conversation.get(name):
+            prompts[name] = CompiledPrompt(name, conversation[name], required, optional)
+
+    # Built by the agent from the swapped in configuration, so a broken rule or
+    # template must reject the file here, before the swap
+    try:
+        FastPathMatcher(config)
+        ReplyTemplates(config)
+    except (FastPathError, ReplyTemplateError) as e:
+        raise PromptError(str(e)) from e
+    return _Snapshot(config, prompts, mtime)
+
+
+class PromptRegistry:
+    """
+    The paavoai.toml configuration with the prompts compiled and validated once.
+
+    When watching is started the file's mtime is checked periodically and a
+    changed file is loaded, validated and swapped in atomically; an invalid file
+    is logged and the previous configuration is kept. The listeners are called
+    after each swap.
+    """
+    def __init__(self, path: str | None = None):
+        """
+        Initialize the registry, load() must be called before use.
+
+        :param path: Path to paavoai.toml.
+        """
+        self.path = path
+        self._snapshot = None
+        self._listeners = []
+
+    @classmethod
+    def from_config(cls, config: dict) -> "PromptRegistry":
+        """Create a registry from an already loaded configuration (no file watching)."""
+        registry = cls()
+        registry._snapshot = _compile(config)  # pylint: disable=protected-access
+        return registry
+
+    def load(self) -> None:
+        """
+        Synchronously load and compile paavoai.toml. Raises FileNotFoundError,
+        tomllib.TOMLDecodeError or PromptError on failure.
+        """
+        self._snapshot = self._load_snapshot()
+        _LOGGER.debug("Loaded paavoai.toml from %s, prompt versions: %s",
+                      self.path, {n: p.version for n, p in self._snapshot.prompts.items()})
+
+    def _load_snapshot(self) -> _Snapshot:
+        """Load and compile the file into a new snapshot."""
+        _LOGGER.debug("Attempting to load paavoai.toml from: %s", self.path)
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, "rb") as f:
+            config = tomllib.load(f)
+        return _compile(config, mtime)
+
+    @property
+    def config(self) -> dict:
+        """Return the loaded configuration."""
+        return self._snapshot.config
+
+    def get(self, name: str) -> CompiledPrompt:
+        """Return the compiled prompt, raises PromptError if not configured."""
+        prompt = self._snapshot.prompts.get(name)
+        if prompt is None:
+            raise PromptError(f"Prompt '{name}' is not configured in paavoai.toml")
+        return prompt
+
+    def render(self, name: str, **values) -> str:
+        """Render the named prompt."""
+        return self.get(name).render(**values)
+
+    def version(self, *names: str) -> str:
+        """Return a combined version hash of the named prompts (or all of them)."""
+        prompts = self._snapshot.prompts
+        digest = hashlib.sha1()
+        for name in names or sorted(prompts):
+            digest.update(f"{name}={prompts[name].version if name in prompts else ''};".encode())
+        return digest.hexdigest()[:12]
+
+    def versions(self) -> dict:
+        """Return the version hash of each compiled prompt."""
+        return {name: prompt.version for name, prompt in self._snapshot.prompts.items()}
+
+    def add_listener(self, listener: Callable[[], None]) -> Callable[[], None]:
+        """Add a callback called after a reload, returns a function removing it."""
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+    @callback
+    def async_start_watching(self, hass: HomeAssistant) -> Callable[[], None]:
+        """Start watching the file for changes, returns a function stopping it."""
+        async def _async_check(_now) -> None:
+            await self.async_reload_if_changed(hass)
+
+        return async_track_time_interval(hass, _async_check, _WATCH_INTERVAL)
+
+    async def async_reload_if_changed(self, hass: HomeAssistant) -> bool:
+        """Reload the file if its mtime has changed, returns True if reloaded."""
+        try:
+            mtime = await hass.async_add_executor_job(os.path.getmtime, self.path)
+        except OSError as e:
+            _LOGGER.error("Cannot check paavoai.toml at %s: %s", self.path, e)
+            return False
+        if self._snapshot is not None and mtime == self._snapshot.mtime:
+            return False
+
+        try:
+            snapshot = await hass.async_add_executor_job(self._load_snapshot)
+        except (OSError, tomllib.TOMLDecodeError, PromptError) as e:
+            _LOGGER.error("Not reloading the changed paavoai.toml, keeping the previous "
+                          "configuration: %s", e)
+            # Don't retry the same broken file on every check
+            self._snapshot.mtime = mtime
+            return False
+
+        self._snapshot = snapshot
+        _LOGGER.info("Reloaded paavoai.toml from %s", self.path)
+        for listener in list(self._listeners):
+            try:
+                listener()
+            except Exception: # pylint: disable=broad-except
+                # The other listeners still apply their part of the configuration
+                _LOGGER.exception("Error while applying the reloaded paavoai.toml")
+        return True
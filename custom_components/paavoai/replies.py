@@ -0,0 +1,69 @@
+""" Reply templates for rendering action results without the LLM """
+
+import logging
+import string
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ReplyTemplateError(Exception):
+    """Custom exception for invalid reply templates."""
+
+
+class _MissingAsEmpty(dict):
+    """Format mapping returning an empty string for missing or None fields."""
+    def __getitem__(self, key):
+        value = self.get(key)
+        return "" if value is None else value
+
+
+class ReplyTemplates:
+    """
+    Catalog of the localized reply templates from the [replies] section of
+    paavoai.toml. The templates are keyed by the result's template key (e.g.
+    'next', 'load' or 'info_idle') and can refer to the result fields such
+    as {playlist}, {title}, {artist} and {entity_name}. Only plain named fields
+    are allowed, without attributes, indexes, conversions or format specs,
+    so a template that loads always renders.
+    """
+    def __init__(self, paavoai_config: dict):
+        """
+        Initialize the catalog and validate the templates.
+
+        :param paavoai_config: The loaded paavoai.toml configuration.
+        """
+        self._templates = {}
+        formatter = string.Formatter()
+        for key, template in paavoai_config.get("replies", {}).items():
+            try:
+                # Parse once to fail early on broken templates
+                fields = [(name, spec, conversion) for _literal, name, spec, conversion
+                          in formatter.parse(template) if name is not None]
+            except ValueError as e:
+                raise ReplyTemplateError(f"Invalid reply template '{key}': {e}") from e
+            for name, spec, conversion in fields:
+                # Positional, attribute and index fields and the format specs
+                # would fail or leak object internals only when rendered
+                if not name.isidentifier() or spec or conversion is not None:
+                    field = name + (f"!{conversion}" if conversion else "") + \
+                        (f":{spec}" if spec else "")
+                    raise ReplyTemplateError(
+                        f"Invalid reply template '{key}': only plain named fields "
+                        f"like {{title}} are allowed, not {{{field}}}")
+            self._templates[key] = template
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._templates
+
+    def render(self, result) -> str | None:
+        """
+        Render the reply for an action result.
+        :param result: The action result with template_key and as_dict().
+        :return: The reply or None if there is no template for the result.
+        """
+        template = self._templates.get(result.template_key)
+        if template is None:
+            return None
+        reply = template.format_map(_MissingAsEmpty(result.as_dict()))
+        _LOGGER.debug("Rendered reply for '%s': %s", result.template_key, reply)
+        return reply
@@ -0,0 +1,143 @@
+""" Tolerant parser for the line-based classification answers """
+
+import logging
+import re
+from collections import Counter
+from difflib import get_close_matches
+
+_LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_CUTOFF = 0.75  # Minimum similarity for mapping an unknown label to a valid one
+
+# Markdown emphasis, code, headings, quotes and list bullets around the answer lines
+_MARKDOWN_RE = re.compile(r"[*_`#>]+")
+_BULLET_RE = re.compile(r"^\s*(?:[-+•]|\d+[.)])\s+")
+_KEY_LINE_RE = re.compile(r"^\s*([a-z]+)\s*[:=]\s*(.*?)\s*$")
+_WORD_RE = re.compile(r"\w+")
+
+
+class ResponseParseError(Exception):
+    """Custom exception for answers that can't be parsed or repaired."""
+
+
+def _clean_line(line: str) -> str:
+    """Return the line without the markdown and the list bullet, lowercased."""
+    return _BULLET_RE.sub("", _MARKDOWN_RE.sub("", line)).strip().lower()
+
+
+def answer_lines(response: str) -> tuple[dict, list[str]]:
+    """
+    Return the 'key: value' lines of the answer in any order (the last one of a
+    key wins, as the reasoning may quote an earlier one) and the other lines.
+    """
+    values = {}
+    others = []
+    for line in response.splitlines():
+        line = _clean_line(line)
+        if not line:
+            continue
+        match = _KEY_LINE_RE.match(line)
+        if match:
+            values[match.group(1)] = match.group(2)
+        else:
+            others.append(line)
+    return values, others
+
+
+def closest_label(value: str, labels: list[str], parametrized: tuple[str, ...] = (),
+                  cutoff: float = _DEFAULT_CUTOFF) -> str | None:
+    """
+    Return the valid label for the answer value, or None if it's not close to any.
+
+    :param value: The cleaned answer value, e.g. 'music', 'Next song.' or 'lod rock'.
+    :param labels: The valid labels without a parameter.
+    :param parametrized: The labels followed by a parameter, e.g. 'load'.
+    :param cutoff: Minimum similarity for a misspelled label.
+    """
+    value = value.strip().strip(".,!\"'").strip()
+    if value in labels:
+        return value
+    first, _, parameter = value.partition(" ")
+    parameter = parameter.strip().strip("[]\"'").strip()
+    if first in parametrized and parameter:
+        return f"{first} {parameter}"
+    # The label with extra words, e.g. 'next song' or 'music control'
+    words = set(_WORD_RE.findall(value))
+    found = [label for label in labels if label in words]
+    if len(found) == 1:
+        return found[0]
+    # A misspelled label, e.g. 'ligths' or 'lod rock'
+    close = get_close_matches(first, labels + list(parametrized), n=1, cutoff=cutoff)
+    if close:
+        if close[0] in parametrized:
+            return f"{close[0]} {parameter}" if parameter else None
+        return close[0]
+    return None
+
+
+class ResponseParser:
+    """
+    Parses the 'reasoning:' and answer lines of the classification replies.
+
+    The lines are accepted in any order and casing, with markdown and list
+    bullets. An unknown or misspelled label is mapped to the closest valid one,
+    and an answer without the key line is accepted if its last line is a label.
+    The answers are counted per prompt as 'parsed' as is, 'repaired' or
+    'unparsed', the caller counts its retries ('retried') and the answers
+    failing for good ('failed').
+    """
+    def __init__(self, cutoff: float = _DEFAULT_CUTOFF):
+        """
+        Initialize the parser.
+
+        :param cutoff: Minimum similarity for mapping an unknown label to a valid one.
+        """
+        self.cutoff = cutoff
+        self._counts = {}  # Prompt name -> Counter of the outcomes
+
+    def count(self, prompt_name: str, outcome: str) -> None:
+        """Count an outcome for the prompt."""
+        self._counts.setdefault(prompt_name, Counter())[outcome] += 1
+
+    def parse(self, prompt_name: str, response: str, key: str, labels: list[str],
+              parametrized: tuple[str, ...] = ()) -> tuple[str, str]:
+        """
+        Return the label and the reasoning of the answer.
+
+        :param prompt_name: The prompt the answer is for, for the counters.
+        :param response: The answer from the LLM.
+        :param key: The key of the answer line, e.g. 'topic'.
+        :param labels: The valid labels without a parameter.
+        :param parametrized: The labels followed by a parameter, e.g. 'load'.
+        :raises ResponseParseError: If no valid label can be found.
+        """
+        values, others = answer_lines(response)
+        reasoning = values.get("reasoning", "")
+        value = values.get(key)
+        if value is not None and (value in labels or
+                                  value.partition(" ")[0] in parametrized and
+                                  value.partition(" ")[2].strip()):
+            self.count(prompt_name, "parsed")
+            return value, reasoning
+
+        # Repaired from the key line's value, or the last line without a key
+        candidate = value if value is not None else (others[-1] if others else "")
+        label = closest_label(candidate, labels, parametrized, self.cutoff)
+        if label is None:
+            self.count(prompt_name, "unparsed")
+            raise ResponseParseError(f"No valid {key} in the response: {response!r}")
+        self.count(prompt_name, "repaired")
+        _LOGGER.debug("Repaired the %s '%s' to '%s' for %s", key, candidate, label,
+                      prompt_name)
+        return label, reasoning
+
+    def stats(self) -> dict:
+        """Return the outcome counters and the repair and failure rates per prompt."""
+        stats = {}
+        for prompt_name, counts in self._counts.items():
+            total = counts["parsed"] + counts["repaired"] + counts["unparsed"]
+            stats[prompt_name] = dict(
+                counts,
+                repair_rate=counts["repaired"] / total if total else None,
+                failure_rate=counts["unparsed"] / total if total else None)
+        return stats
@@ -0,0 +1,248 @@
+""" Priority scheduler for the Ollama requests """
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import AsyncIterator
+
+from .ollama_client import OllamaClientError
+
+_LOGGER = logging.getLogger(__name__)
+
+# Priority classes, lower is served first
+PRIORITY_LIVE = 0    # Classification of a live command
+PRIORITY_REPLY = 1   # Rephrasing the reply to the user
+PRIORITY_ERROR = 2   # Explaining an error to the user
+PRIORITY_BACKGROUND = 3  # Work no command is waiting for, e.g. the history summaries
+
+
+class OllamaRequestCancelled(OllamaClientError):
+    """Raised for a queued request whose conversation was superseded, or a
+    background request preempted by a live one."""
+
+
+class _Waiter:
+    """A request waiting for a free slot."""
+    __slots__ = ("future", "conversation_id")
+
+    def __init__(self, future: asyncio.Future, conversation_id: str | None):
+        self.future = future
+        self.conversation_id = conversation_id
+
+
+class OllamaScheduler:
+    """
+    Schedules the requests to an Ollama client.
+
+    At most 'parallel' requests run at a time, matching the server's parallel
+    slots (OLLAMA_NUM_PARALLEL), and the queued requests are served by priority
+    class and then in order of arrival. Identical requests of a conversation in
+    flight are coalesced into one. Queued requests of a conversation can be
+    cancelled when the conversation is superseded by a newer command. A running
+    background request is cancelled when a command's request has to queue, so
+    the command doesn't wait for the background generation to finish. Provides
+    the same send_request, stream_request, model and wait_ready interface as
+    the client. While the circuit breaker below is open, the requests skip the
+    queue, so they fail fast instead of waiting behind the requests in flight.
+    """
+    def __init__(self, client, parallel: int = 1, metrics=None):
+        """
+        Initialize the scheduler.
+
+        :param client: The client the requests are sent with.
+        :param parallel: Maximum number of concurrent requests.
+        :param metrics: Optional PaavoAIMetrics for the queue depth and wait time.
+        """
+        self._client = client
+        self.parallel = max(parallel, 1)
+        self.metrics = metrics
+        self._running = 0
+        self._queue = []  # Heap of (priority, sequence, _Waiter)
+        self._sequence = itertools.count()
+        self._inflight = {}  # Request key -> [task, number of callers]
+        self._background = set()  # Tasks of the running background requests
+        self._preempted = set()   # Background tasks cancelled for a command's request
+        self.coalesced = 0
+        self.cancelled = 0
+        self.preempted = 0
+
+    @property
+    def model(self) -> str:
+        """Return the model of the client."""
+        return self._client.model
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Wait until the client's model is loaded."""
+        return await self._client.wait_ready(timeout)
+
+    @property
+    def _circuit_open(self) -> bool:
+        """Return True if the client is a circuit breaker failing fast (or probing)."""
+        return getattr(self._client, "is_open", False)
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of queued requests."""
+        return sum(1 for _, _, waiter in self._queue if not waiter.future.done())
+
+    def stats(self) -> dict:
+        """Return the scheduler counters."""
+        return {
+            "parallel": self.parallel,
+            "running": self._running,
+            "queued": self.queue_depth,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "preempted": self.preempted,
+        }
+
+    async def send_request(self, prompt: str, priority: int = PRIORITY_LIVE,
+                           conversation_id: str | None = None, **kwargs) -> str:
+        """
+        Send the request through the queue and return the response.
+
+        :param prompt: The prompt to send.
+        :param priority: The priority class of the request.
+        :param conversation_id: The conversation the request belongs to.
+        :param kwargs: The other arguments for the client's send_request.
+        """
+        # The stats out-dict is per caller, it doesn't make the request different.
+        # Only coalesced within the conversation, so superseding a conversation
+        # can't cancel the request another conversation is waiting for.
+        key = (conversation_id, prompt,
+               tuple(sorted((name, repr(value)) for name, value in kwargs.items()
+                            if name != "stats")))
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(self._run(prompt, priority, conversation_id, kwargs))
+            entry = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda _task: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+            _LOGGER.debug("Coalescing an identical request in flight")
+
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        except asyncio.CancelledError:
+            # Stop the request if nobody is waiting for it anymore
+            if entry[1] == 1:
+                entry[0].cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    async def stream_request(self, prompt: str, priority: int = PRIORITY_REPLY,
+                             conversation_id: str | None = None,
+                             **kwargs) -> AsyncIterator[str]:
+        """
+        Stream the response through the queue, the slot is held until the stream ends.
+
+        :param prompt: The prompt to send.
+        :param priority: The priority class of the request.
+        :param conversation_id: The conversation the request belongs to.
+        :param kwargs: The other arguments for the client's stream_request.
+        """
+        if self._circuit_open:
+            async for text in self._client.stream_request(prompt, **kwargs):
+                yield text
+            return
+        await self._acquire(priority, conversation_id)
+        try:
+            async for text in self._client.stream_request(prompt, **kwargs):
+                yield text
+        finally:
+            self._release()
+
+    async def embed(self, texts: list[str], model: str, **kwargs) -> list[list[float]]:
+        """
+        Return the embeddings of the texts. Not queued: the small embedding model
+        runs alongside the generation and must not wait behind it.
+
+        :param texts: The texts to embed.
+        :param model: The embedding model.
+        :param kwargs: The other arguments for the client's embed.
+        """
+        return await self._client.embed(texts, model, **kwargs)
+
+    def cancel_conversation(self, conversation_id: str) -> int:
+        """
+        Cancel the queued (not yet running) requests of the conversation.
+        :return: The number of cancelled requests.
+        """
+        count = 0
+        for _, _, waiter in self._queue:
+            if waiter.conversation_id == conversation_id and not waiter.future.done():
+                waiter.future.set_exception(OllamaRequestCancelled(
+                    f"Request of the superseded conversation {conversation_id} cancelled"))
+                count += 1
+        if count:
+            self.cancelled += count
+            _LOGGER.debug("Cancelled %d queued requests of conversation %s",
+                          count, conversation_id)
+        return count
+
+    async def _run(self, prompt: str, priority: int, conversation_id: str | None,
+                   kwargs: dict) -> str:
+        """Wait for a slot and send the request."""
+        if self._circuit_open:
+            return await self._client.send_request(prompt, **kwargs)
+        await self._acquire(priority, conversation_id)
+        task = asyncio.current_task()
+        if priority >= PRIORITY_BACKGROUND:
+            self._background.add(task)
+        try:
+            return await self._client.send_request(prompt, **kwargs)
+        except asyncio.CancelledError:
+            if task in self._preempted:
+                raise OllamaRequestCancelled(
+                    "Background request preempted by a command's request") from None
+            raise
+        finally:
+            self._background.discard(task)
+            self._preempted.discard(task)
+            self._release()
+
+    async def _acquire(self, priority: int, conversation_id: str | None) -> None:
+        """Wait for a free slot in the priority order."""
+        start = time.perf_counter()
+        if self._running < self.parallel and not self.queue_depth:
+            self._running += 1
+        else:
+            waiter = _Waiter(asyncio.get_running_loop().create_future(), conversation_id)
+            heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+            if priority < PRIORITY_BACKGROUND:
+                self._preempt()
+            if self.metrics is not None:
+                self.metrics.observe("scheduler_queue_depth", self.queue_depth)
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                # The slot may have been granted just before the cancellation
+                if waiter.future.done() and not waiter.future.cancelled() and \
+                   waiter.future.exception() is None:
+                    self._release()
+                raise
+        if self.metrics is not None:
+            self.metrics.observe("scheduler_wait", (time.perf_counter() - start) * 1000)
+
+    def _preempt(self) -> None:
+        """Cancel a running background request, its slot goes to the queued request."""
+        for task in self._background - self._preempted:
+            self._preempted.add(task)
+            self.preempted += 1
+            _LOGGER.debug("Preempting a background request")
+            task.cancel()
+            break
+
+    def _release(self) -> None:
+        """Free a slot and hand it to the next queued request."""
+        self._running -= 1
+        while self._queue:
+            _, _, waiter = heapq.heappop(self._queue)
+            if not waiter.future.done():
+                self._running += 1
+                waiter.future.set_result(None)
+                break
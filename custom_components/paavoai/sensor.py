@@ -0,0 +1,47 @@
+""" Latency sensors for the Paavo AI integration."""
+
+from datetime import timedelta
+
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.device_registry import DeviceInfo
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .metrics import METRICS
+
+DOMAIN = "paavoai"
+SCAN_INTERVAL = timedelta(seconds=30)
+
+
+async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry,
+                            async_add_entities: AddEntitiesCallback) -> None:
+    """Set up the latency sensors for a config entry."""
+    metrics = hass.data[DOMAIN][entry.entry_id]["metrics"]
+    async_add_entities(PaavoAIMetricSensor(entry, metrics, name, unit)
+                       for name, unit in METRICS.items())
+
+
+class PaavoAIMetricSensor(SensorEntity):
+    """
+    The rolling p95 of a Paavo AI metric, e.g. a processing stage latency.
+    The p50, p99 and the observation count are given as attributes.
+    """
+    _attr_has_entity_name = True
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_suggested_display_precision = 0
+
+    def __init__(self, entry: ConfigEntry, metrics, metric: str, unit: str):
+        self._metrics = metrics
+        self._metric = metric
+        self._attr_name = f"{metric.replace('_', ' ').capitalize()} p95"
+        self._attr_unique_id = f"{entry.entry_id}_{metric}_p95"
+        self._attr_native_unit_of_measurement = unit
+        self._attr_device_info = DeviceInfo(identifiers={(DOMAIN, entry.entry_id)},
+                                            name=entry.title)
+
+    async def async_update(self) -> None:
+        """Update the state from the rolling histogram."""
+        summary = self._metrics.summary(self._metric)
+        self._attr_native_value = summary["p95"]
+        self._attr_extra_state_attributes = summary
@@ -0,0 +1,32 @@
+""" Sentence chunking of the streamed replies for speech synthesis """
+
+import re
+from typing import AsyncIterable, AsyncIterator
+
+_DEFAULT_MIN_CHARS = 12  # Shorter sentences are joined with the next one
+
+# The end of a sentence: punctuation followed by whitespace, or a line break
+_SENTENCE_END_RE = re.compile(r"[.!?…]+[\"'”)\]]*\s+|\n+")
+
+
+async def sentence_chunks(texts: AsyncIterable[str],
+                          min_chars: int = _DEFAULT_MIN_CHARS) -> AsyncIterator[str]:
+    """
+    Regroup the streamed text into sentences, so speech synthesis can start on
+    the first sentence while the rest is still being generated.
+
+    :param texts: The streamed text pieces, e.g. tokens.
+    :param min_chars: Minimum length of a chunk, avoids splitting at abbreviations
+           and very short fragments like "Ok.".
+    """
+    buffer = ""
+    async for text in texts:
+        buffer += text
+        position = 0
+        for match in _SENTENCE_END_RE.finditer(buffer):
+            if match.end() - position >= min_chars:
+                yield buffer[position:match.end()]
+                position = match.end()
+        buffer = buffer[position:]
+    if buffer.strip():
+        yield buffer
@@ -0,0 +1,137 @@
+""" Recorder of the latest commands for debugging and offline replay """
+
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_MAX_CONVERSATIONS = 10
+_MAX_COMMANDS_PER_CONVERSATION = 20  # Bounds a long-lived conversation
+
+# The trace of the command in process, None when not recording
+_CURRENT_TRACE: ContextVar["CommandTrace | None"] = ContextVar("paavoai_trace", default=None)
+
+
+def trace_event(kind: str, **data) -> None:
+    """
+    Add an event to the trace of the command in process, if it is recorded.
+    The data is kept as is and only serialized on export, so pass the objects
+    (prompts, responses, service data) instead of formatted strings.
+    """
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.events.append((time.perf_counter() - trace.start, kind, data))
+
+
+def _plain(value):
+    """Return the value as JSON compatible data, other objects as their repr."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, dict):
+        return {str(key): _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [_plain(item) for item in value]
+    return repr(value)
+
+
+class CommandTrace:
+    """The events of one command, offsets in seconds from the start."""
+    __slots__ = ("conversation_id", "text", "started_at", "start", "duration", "events")
+
+    def __init__(self, conversation_id: str, text: str):
+        self.conversation_id = conversation_id
+        self.text = text
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None  # Seconds, None while in process
+        self.events = []      # (offset, kind, data)
+
+    def as_dict(self) -> dict:
+        """Return the trace as JSON compatible data, the milliseconds rounded."""
+        return {
+            "conversation_id": self.conversation_id,
+            "text": self.text,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 1) if self.duration is not None else None,
+            "events": [{"at_ms": round(offset * 1000, 1), "kind": kind, **_plain(data)}
+                       for offset, kind, data in self.events],
+        }
+
+
+class TraceRecorder:
+    """
+    Keeps the traces of the commands of the latest conversations in a bounded
+    ring buffer. Disabled by default, since the traces have the raw utterances.
+
+    A trace has the prompts and the raw responses of the Ollama calls, the
+    decisions, the service calls and the reply with their offsets from the
+    start of the command. The events are recorded as references and serialized
+    only on export (diagnostics), so recording costs an append per event. The
+    exported traces can be replayed against the agent with a fake Ollama
+    server answering the recorded responses (benchmarks/replay_traces.py).
+    """
+    def __init__(self, config: dict | None = None):
+        """
+        Initialize the recorder.
+
+        :param config: The [trace] section of paavoai.toml.
+        """
+        self._conversations = OrderedDict()  # Conversation id -> deque of traces
+        self.recorded = 0
+        self.configure(config)
+
+    def configure(self, config: dict | None) -> None:
+        """Apply the [trace] section of a (re)loaded paavoai.toml."""
+        config = config or {}
+        self.enabled = config.get("enabled", False)
+        self.max_conversations = max(config.get("max_conversations",
+                                                _DEFAULT_MAX_CONVERSATIONS), 1)
+        if not self.enabled:
+            self._conversations.clear()
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop the least recently active conversations over the limit."""
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+
+    @contextmanager
+    def command(self, conversation_id: str, text: str):
+        """Record the events of the command processed in the block."""
+        if not self.enabled:
+            yield
+            return
+        trace = CommandTrace(conversation_id, text)
+        # Added at the start, so a command hanging in process is visible too
+        traces = self._conversations.pop(conversation_id, None)
+        if traces is None:
+            traces = deque(maxlen=_MAX_COMMANDS_PER_CONVERSATION)
+        traces.append(trace)
+        self._conversations[conversation_id] = traces
+        self._evict()
+        self.recorded += 1
+        token = _CURRENT_TRACE.set(trace)
+        try:
+            yield
+        finally:
+            trace.duration = time.perf_counter() - trace.start
+            _CURRENT_TRACE.reset(token)
+
+    def export(self) -> list[dict]:
+        """Return the recorded traces as JSON compatible data, the oldest first."""
+        traces = [trace for traces in list(self._conversations.values()) for trace in traces]
+        traces.sort(key=lambda trace: trace.start)
+        return [trace.as_dict() for trace in traces]
+
+    def stats(self) -> dict:
+        """Return the recorder state and counters."""
+        return {
+            "enabled": self.enabled,
+            "max_conversations": self.max_conversations,
+            "conversations": len(self._conversations),
+            "buffered": sum(len(traces) for traces in self._conversations.values()),
+            "recorded": self.recorded,
+        }